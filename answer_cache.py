@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from search_index import STOPWORDS, tokenize
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase and collapse whitespace/punctuation so trivial rewrites share a key"""
+    return " ".join(re.findall(r"[a-z0-9.]+", question.lower())).strip(".")
+
+
+def context_hash(context: dict) -> str:
+    """Stable hash of a search_knowledge_base result"""
+    return hashlib.sha256(
+        json.dumps(context, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def passage_set_hash(context: dict) -> str:
+    """Hash of which passages a context holds (file and span), ignoring their scores and order"""
+    keys = sorted(
+        json.dumps([passage.get("source"), passage.get("file"), passage.get("span")])
+        for passage in context.get("passages", [])
+    )
+    return hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+def shingles(text: str, size: int = 3) -> frozenset:
+    """Word n-gram shingles of a question, ignoring stopwords"""
+    tokens = [t for t in tokenize(text) if t not in STOPWORDS]
+    if len(tokens) < size:
+        return frozenset([" ".join(tokens)]) if tokens else frozenset()
+    return frozenset(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MemoryBackend:
+    """In-process LRU store with TTL expiry"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Local-disk store shared by every worker on the host, LRU by last access"""
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers(accessed)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM answers WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE answers SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            self._db.execute("DELETE FROM answers WHERE expires < ?", (now,))
+            self._db.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM answers")
+
+
+class AnswerCache:
+    """Two-tier cache of LLM answers.
+
+    The exact tier is keyed on the normalized question plus a hash of the
+    retrieved context, so an answer is only reused when it would have been
+    generated from the same prompt. The optional near-duplicate tier matches
+    reworded questions by shingle Jaccard similarity against recent entries
+    that were answered from the same passages: rewording changes the BM25
+    scores in the context, so it compares passage_set_hash, not the context.
+
+    partition separates entries that similar question text must not share,
+    e.g. an attached image's hash: both tiers only match within it.
+    """
+
+    def __init__(self, backend=None, near_duplicate_threshold: float = 0.0, near_duplicate_window: int = 512):
+        self.backend = backend or MemoryBackend()
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._recent = OrderedDict()  # key -> (shingles, (passage set hash, partition))
+        self._recent_window = near_duplicate_window
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "near_hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(question: str, context: dict, partition: str = "") -> str:
+        key = f"{normalize_question(question)}\0{context_hash(context)}"
+        if partition:
+            key = f"{key}\0{partition}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, question: str, context: dict, partition: str = ""):
+        key = self.make_key(question, context, partition)
+        value = self.backend.get(key)
+        if value is not None:
+            self._count("exact_hits")
+            return value
+
+        if self.near_duplicate_threshold > 0:
+            question_shingles = shingles(question)
+            scope = (passage_set_hash(context), partition)
+            with self._lock:
+                candidates = [
+                    (jaccard(question_shingles, s), k)
+                    for k, (s, c) in self._recent.items() if c == scope
+                ]
+            if candidates:
+                score, best = max(candidates)
+                if score >= self.near_duplicate_threshold:
+                    value = self.backend.get(best)
+                    if value is not None:
+                        self._count("near_hits")
+                        return value
+
+        self._count("misses")
+        return None
+
+    def set(self, question: str, context: dict, value: dict, partition: str = ""):
+        key = self.make_key(question, context, partition)
+        self.backend.set(key, value)
+        if self.near_duplicate_threshold > 0:
+            with self._lock:
+                self._recent[key] = (shingles(question), (passage_set_hash(context), partition))
+                self._recent.move_to_end(key)
+                while len(self._recent) > self._recent_window:
+                    self._recent.popitem(last=False)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def hit_rate(self) -> float:
+        total = sum(self.stats.values())
+        return (self.stats["exact_hits"] + self.stats["near_hits"]) / total if total else 0.0
+
+
+def cache_from_env() -> AnswerCache:
+    """Build the cache configured by ANSWER_CACHE* environment variables"""
+    ttl = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+    max_entries = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+    if os.getenv("ANSWER_CACHE", "memory") == "sqlite":
+        backend = SQLiteBackend(os.getenv("ANSWER_CACHE_PATH", "./data/answer_cache.sqlite3"), max_entries, ttl)
+    else:
+        backend = MemoryBackend(max_entries, ttl)
+    return AnswerCache(backend, float(os.getenv("ANSWER_CACHE_NEAR_THRESHOLD", "0")))
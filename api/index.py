@@ -1,16 +1,30 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
 import os
+import asyncio
 import openai
 from dotenv import load_dotenv
 import markdown
 from bs4 import BeautifulSoup
 import json
 import requests
-from openai import OpenAI
-import re
+import llm_client
+import metrics
+from answer_cache import cache_from_env
+from prompt_builder import build_prompt, select_passages
+from image_processing import IMAGE_MODE, ImageError, ImageProcessor
+from upstream import Overloaded
 from models import Link  # Assuming you have a Link Pydantic model
+from kb_compiler import load_artifact
+from knowledge_base import RECORDS_DIR, links_in_span, list_records, load_documents, parse_date
+from metadata_index import infer_filters
+from document_store import normalized_text
+from search_index import build_index
+from index_manager import IndexManager
+from vector_index import VectorIndex
+from hybrid_search import RERANKER, filter_ranked, get_reranker, hybrid_search_many, rerank
 
 # Load environment variables
 load_dotenv()
@@ -27,9 +41,33 @@ app = FastAPI(
 openai.api_key = os.getenv("API_KEY")
 openai.api_base = os.getenv("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
 
+class SearchFilters(BaseModel):
+    # ISO 8601 dates/datetimes, inclusive; a date-only until covers that whole day
+    since: Optional[str] = None
+    until: Optional[str] = None
+    # Course term, e.g. "jan-2025", "may-2025", "sep-2025"
+    term: Optional[str] = None
+    topic_id: Optional[int] = None
+    authors: Optional[List[str]] = None
+    staff_only: bool = False
+
+    @field_validator("since", "until")
+    @classmethod
+    def check_date(cls, value: Optional[str]) -> Optional[str]:
+        # An unparseable date must not silently drop the filter
+        if value is not None and parse_date(value) is None:
+            raise ValueError("must be an ISO 8601 date or datetime, e.g. 2025-01-31")
+        return value
+
 class QuestionRequest(BaseModel):
     question: str
     image: Optional[str] = None
+    filters: Optional[SearchFilters] = None
+
+class BatchRequest(BaseModel):
+    questions: List[QuestionRequest]
+    # Concurrent LLM calls; capped at BATCH_CONCURRENCY
+    concurrency: Optional[int] = None
 
 class Link(BaseModel):
     url: str
@@ -38,136 +76,360 @@ class Link(BaseModel):
 class AnswerResponse(BaseModel):
     answer: str
     links: List[Link]
+    # Per-stage timing breakdown, only with ?debug=true
+    debug: Optional[dict] = None
 
-# Load course knowledge base (you'll need to implement this)
+# "keyword" (BM25), "semantic" (precomputed embeddings, see vector_index.py)
+# or "hybrid" (both, fused; see hybrid_search.py)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "keyword")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./data/vector_index")
+# Compiled corpus from kb_compiler.py; used instead of the data dirs if present
+KB_ARTIFACT = os.getenv("KB_ARTIFACT", "./data/kb.bin")
+# /api/batch limits
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Load course knowledge base
 def load_knowledge_base():
-    course_content = {}
-    discourse_posts = {}
-
-    course_dir = "./data/course_content"
-    for fname in os.listdir(course_dir):
-        if fname.endswith(".html") or fname.endswith(".md"):
-            with open(os.path.join(course_dir, fname), "r", encoding="utf-8") as f:
-                course_content[fname] = f.read()
-
-    discourse_dir = "./data/discourse_posts"
-    for fname in os.listdir(discourse_dir):
-        if fname.endswith(".md"):
-            with open(os.path.join(discourse_dir, fname), "r", encoding="utf-8") as f:
-                discourse_posts[fname] = f.read()
-
-    return {
-        "course_content": course_content,
-        "discourse_posts": discourse_posts
+    if os.path.exists(KB_ARTIFACT):
+        # mmap'd texts and a prebuilt index: near-constant cold start
+        kb = load_artifact(KB_ARTIFACT)
+    else:
+        kb = load_documents()
+        # Build the inverted index once so queries only touch matching postings
+        kb["index"] = build_index(kb)
+    if RETRIEVAL_MODE in ("semantic", "hybrid"):
+        kb["vectors"] = VectorIndex.load(VECTOR_INDEX_DIR)
+    return kb
+
+
+# Hot reload: poll the data dirs every KB_WATCH_INTERVAL seconds (0 = off)
+# and/or POST /api/admin/reload with an X-Admin-Token header
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# load_documents prefers ingested records, so watch whichever the KB came from
+index_manager = IndexManager(load_knowledge_base(), records_dir=RECORDS_DIR if list_records() else None)
+if KB_WATCH_INTERVAL > 0:
+    index_manager.watch(KB_WATCH_INTERVAL)
+elif ADMIN_TOKEN:
+    index_manager.refresh()  # baseline for the first admin reload
+answer_cache = cache_from_env()
+image_processor = ImageProcessor(workers=int(os.getenv("IMAGE_WORKERS", "2")))
+reranker = get_reranker(RERANKER)
+
+@app.on_event("shutdown")
+async def shutdown_llm_client():
+    await llm_client.close_client()
+
+async def prepare_question(request: QuestionRequest) -> tuple:
+    """Fold the request's image into (question, image_url, cache_key).
+
+    OCR text is appended to the question so retrieval sees it; in vision
+    mode the downscaled image is forwarded to the model instead. cache_key
+    is (question, partition): the image hash and filters partition the
+    answer cache, so similar text with another image never shares an answer.
+    """
+    question, image_url, partition = request.question, None, []
+    if request.image and IMAGE_MODE != "off":
+        image = await image_processor.process(request.image)
+        if image["text"]:
+            question = f"{question}\n\nText from the attached image:\n{image['text']}"
+        image_url = image["data_url"]
+        partition.append(image["hash"])
+    if request.filters:
+        partition.append(request.filters.model_dump_json(exclude_defaults=True))
+    return question, image_url, (question, "\0".join(partition))
+
+@app.post("/api/", response_model=AnswerResponse, response_model_exclude_none=True)
+async def answer_question(request: QuestionRequest, debug: bool = False):
+    with metrics.trace("answer") as trace:
+        try:
+            with metrics.stage("image"):
+                question, image_url, cache_key = await prepare_question(request)
+
+            # Step 1: Search knowledge base for relevant information
+            with metrics.stage("retrieval"):
+                relevant_content = search_knowledge_base(question, request.filters)
+
+            # Steps 2-4: prompt, LLM call and links, unless the answer is cached
+            result = await generate_answer(question, image_url, cache_key, relevant_content)
+            return {**result, "debug": trace.breakdown()} if debug else result
+        except ImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Overloaded as e:
+            # Shed load: tell clients to back off instead of queueing more
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+async def generate_answer(question: str, image_url: Optional[str], cache_key: tuple, relevant_content: dict) -> dict:
+    """Answer from the retrieved context: cache lookup, prompt, LLM call, links"""
+    # Same question over the same context (and image/filters): reuse the previous answer
+    cache_question, partition = cache_key
+    with metrics.stage("cache"):
+        cached = answer_cache.get(cache_question, relevant_content, partition)
+    metrics.annotate(cache_hit=cached is not None)
+    if cached is not None:
+        return cached
+
+    # Step 2: Generate prompt for OpenAI
+    with metrics.stage("prompt"):
+        prompt = generate_prompt(question, relevant_content)
+
+    # Step 3: Call OpenAI API without blocking the event loop
+    with metrics.stage("llm"):
+        answer = await llm_client.complete(prompt, image_url)
+
+    # Step 4: Process response and extract links
+    with metrics.stage("links"):
+        links = extract_links(answer, relevant_content)
+
+    result = {
+        "answer": answer,
+        "links": [link.model_dump() for link in links]
     }
+    answer_cache.set(cache_question, relevant_content, result, partition)
+    return result
+
+async def answer_batch(batch: List[QuestionRequest], concurrency: int = BATCH_CONCURRENCY):
+    """Answer many questions, yielding {"index", "answer", "links"} or {"index", "error"} as each finishes.
+
+    Identical questions (and images) are answered once, retrieval for the
+    whole batch is one pass (one batched embedding search in semantic and
+    hybrid modes), and at most `concurrency` LLM calls run at a time.
+    Results come in completion order; "index" is the request's position.
+    """
+    with metrics.trace("batch"):
+        # Images first, so OCR text takes part in retrieval and deduplication
+        prepared = await asyncio.gather(*(prepare_question(r) for r in batch), return_exceptions=True)
+        unique = {}
+        for i, item in enumerate(prepared):
+            if isinstance(item, Exception):
+                yield {"index": i, "error": str(item)}
+                continue
+            unique.setdefault(item[2], (item, []))[1].append(i)
+
+        items = [item for item, _ in unique.values()]
+        filters = [batch[indices[0]].filters for _, indices in unique.values()]
+        with metrics.stage("retrieval"):
+            contexts = await asyncio.to_thread(
+                search_knowledge_base_many, [question for question, _, _ in items], filters
+            )
 
+        semaphore = asyncio.Semaphore(max(1, concurrency))
 
-knowledge_base = load_knowledge_base()
+        async def answer(item, relevant_content, indices):
+            question, image_url, cache_key = item
+            async with semaphore:
+                try:
+                    return indices, await generate_answer(question, image_url, cache_key, relevant_content)
+                except Exception as e:
+                    return indices, {"error": str(e)}
 
-@app.post("/api/", response_model=AnswerResponse)
-async def answer_question(request: QuestionRequest):
+        tasks = [
+            asyncio.ensure_future(answer(item, context, indices))
+            for (item, indices), context in zip(unique.values(), contexts)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indices, result = await next_done
+                for i in indices:
+                    yield {"index": i, **result}
+        finally:
+            # Client went away mid-stream: stop the remaining LLM calls
+            for task in tasks:
+                task.cancel()
+
+@app.post("/api/batch")
+async def answer_questions_batch(request: BatchRequest):
+    """Answer many questions, streamed back as JSON lines as they finish"""
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+
+    async def lines():
+        async for result in answer_batch(request.questions, concurrency):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of latency histograms, token and cache counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def answer_cache_metrics() -> list:
+    lines = [
+        "# HELP tds_answer_cache_total Answer cache lookups by result",
+        "# TYPE tds_answer_cache_total counter"
+    ]
+    for result, count in sorted(answer_cache.stats.items()):
+        lines.append(f'tds_answer_cache_total{{result="{result}"}} {count}')
+    lines += [
+        "# HELP tds_answer_cache_hit_ratio Share of answer cache lookups that hit",
+        "# TYPE tds_answer_cache_hit_ratio gauge",
+        f"tds_answer_cache_hit_ratio {answer_cache.hit_rate()}"
+    ]
+    return lines
+
+metrics.register_collector(answer_cache_metrics)
+
+@app.post("/api/admin/reload")
+async def reload_knowledge_base(x_admin_token: Optional[str] = Header(None)):
+    """Apply added/changed/deleted data files to the live index"""
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    # Off the event loop so questions keep being answered meanwhile
+    return await asyncio.to_thread(index_manager.refresh)
+
+@app.get("/api/cache")
+async def cache_stats():
+    return {**answer_cache.stats, "hit_rate": answer_cache.hit_rate()}
+
+@app.post("/api/stream")
+async def answer_question_stream(request: QuestionRequest):
+    """Stream the answer as server-sent events.
+
+    Emits one `data: {"token": ...}` event per token, then a `links` event
+    once the answer is complete, then `data: [DONE]`.
+    """
     try:
-        # Step 1: Search knowledge base for relevant information
-        relevant_content = search_knowledge_base(request.question)
-        
-        # Step 2: Generate prompt for OpenAI
-        prompt = generate_prompt(request.question, relevant_content)
-        
-        # Step 3: Call OpenAI API
-        client = OpenAI(
-            api_key=os.getenv("API_KEY"),
-            base_url=os.getenv("OPENAI_BASE_URL")
-        )
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful teaching assistant..."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3
-        )
-        
-        # Step 4: Process response and extract links
-        answer = response.choices[0].message.content
-        links = extract_links(answer, relevant_content)
-        
-        return {
-            "answer": answer,
-            "links": links
+        question, image_url, _ = await prepare_question(request)
+    except ImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    relevant_content = search_knowledge_base(question, request.filters)
+    prompt = generate_prompt(question, relevant_content)
+
+    async def events():
+        parts = []
+        with metrics.trace("stream"):
+            try:
+                with metrics.stage("llm"):
+                    async for token in llm_client.stream(prompt, image_url):
+                        parts.append(token)
+                        yield f"data: {json.dumps({'token': token})}\n\n"
+                with metrics.stage("links"):
+                    links = extract_links("".join(parts), relevant_content)
+                yield f"event: links\ndata: {json.dumps([link.model_dump() for link in links])}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def search_knowledge_base(question: str, filters: Optional[SearchFilters] = None) -> dict:
+    return search_knowledge_base_many([question], [filters])[0]
+
+def resolve_filters(question: str, filters: Optional[SearchFilters]) -> dict:
+    """Metadata filters for a question: those it implies (a term, a topic URL), then the request's own"""
+    resolved = infer_filters(question)
+    if filters:
+        explicit = filters.model_dump(exclude_defaults=True)
+        if "since" in explicit:
+            explicit["since"] = parse_date(explicit["since"])
+        if "until" in explicit:
+            # A date-only until includes that whole day
+            explicit["until"] = parse_date(explicit["until"], end_of_day=True)
+        for key in ("term", "topic_id"):
+            # An explicit filter replaces the looser one inferred from the question
+            if key in explicit:
+                resolved.pop("inferred_" + key, None)
+        resolved.update(explicit)
+    return resolved
+
+def rank_passages(kb: dict, questions: List[str], filters: List[dict], top_k: int) -> List[list]:
+    if RETRIEVAL_MODE == "hybrid":
+        return hybrid_search_many(kb["index"], kb["vectors"], questions, top_k, filters=filters)
+    if RETRIEVAL_MODE == "semantic":
+        # Over-fetch, since filtering happens after the vector search
+        rankings = kb["vectors"].search_many(questions, top_k * (5 if any(filters) else 1))
+        return [filter_ranked(kb["index"], ranked, f)[:top_k] for ranked, f in zip(rankings, filters)]
+    return [kb["index"].search(question, top_k, f) for question, f in zip(questions, filters)]
+
+def search_knowledge_base_many(questions: List[str], filters: Optional[list] = None) -> List[dict]:
+    """Retrieve the context of several questions in one pass over one snapshot"""
+    top_k = 20
+    filters = filters or [None] * len(questions)
+    resolved = [resolve_filters(question, f) for question, f in zip(questions, filters)]
+    # One snapshot for the whole search, even if a reload swaps it meanwhile
+    kb = index_manager.current
+    rankings = rank_passages(kb, questions, resolved, top_k)
+    # Filters only inferred from the question must not leave it without context
+    retry = [i for i, ranked in enumerate(rankings) if not ranked and resolved[i] and not filters[i]]
+    if retry:
+        unfiltered = rank_passages(kb, [questions[i] for i in retry], [{} for _ in retry], top_k)
+        for i, ranked in zip(retry, unfiltered):
+            rankings[i] = ranked
+    return [build_context(kb, question, ranked) for question, ranked in zip(questions, rankings)]
+
+def build_context(kb: dict, question: str, ranked: list) -> dict:
+    """Turn ranked (section, fname, start, end) keys into the prompt's passages"""
+    if reranker is not None:
+        if getattr(reranker, "normalized_input", False):
+            text_of = lambda key: normalized_text(kb[key[0]], key[1], key[2], key[3])
+        else:
+            text_of = lambda key: kb[key[0]][key[1]][key[2]:key[3]]
+        ranked = rerank(reranker, question, ranked, text_of)
+
+    passages = [
+        {
+            "source": section,
+            "file": fname,
+            "span": [start, end],
+            "url": kb["urls"].get((section, fname)),
+            # Other URLs with the same content, whose duplicates were dropped at ingest
+            "sources": kb.get("sources", {}).get((section, fname)) or [],
+            "text": kb[section][fname][start:end],
+            "score": round(score, 4),
+            # Outbound links inside this passage, from the precomputed link table
+            "links": [
+                [url, text]
+                for url, text, offset in links_in_span(kb["links"].get((section, fname), []), start, end)
+            ]
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-def search_knowledge_base(question: str) -> dict:
-    course_hits = {}
-    discourse_hits = {}
-    total_chars = 0
-    max_chars = 5000  # You can tune this
-
-    keywords = question.lower().split()
-
-    # Search and collect up to max_chars of relevant text
-    for fname, content in knowledge_base["course_content"].items():
-        if total_chars >= max_chars:
-            break
-        if any(kw in content.lower() for kw in keywords):
-            snippet = content[:1000]
-            total_chars += len(snippet)
-            course_hits[fname] = snippet
-
-    for fname, content in knowledge_base["discourse_posts"].items():
-        if total_chars >= max_chars:
-            break
-        if any(kw in content.lower() for kw in keywords):
-            snippet = content[:1000]
-            total_chars += len(snippet)
-            discourse_hits[fname] = snippet
-
-    return {
-        "course_content": course_hits,
-        "discourse_posts": discourse_hits
-    }
+        for (section, fname, start, end), score in ranked
+    ]
+    # Keep the best passages that fit the prompt's token budget
+    return {"passages": select_passages(question, passages)}
 
 
 
 def generate_prompt(question: str, context: dict) -> str:
-    # Generate a comprehensive prompt with question and context
-    prompt = f"""
-    Question: {question}
-    
-    Context from course materials:
-    {json.dumps(context.get('course_content', {}), indent=2)}
-    
-    Context from Discourse posts:
-    {json.dumps(context.get('discourse_posts', {}), indent=2)}
-    
-    Please provide a detailed answer with references to the course materials where applicable.
-    """
-    return prompt
+    # Compact delimited passages with their sources, in relevance order
+    return build_prompt(question, context.get("passages", []))
 
 
-def extract_links(answer: str, context: dict) -> List[Link]:
-    links = []
-    seen_urls = set()
+def extract_links(answer: str, context: dict, max_links: int = 2) -> List[Link]:
+    """Rank the context's links and return the best max_links.
 
-    for section in ["course_content", "discourse_posts"]:
-        for fname, text in context.get(section, {}).items():
-            # Find all URLs in the content
-            matches = re.findall(r'(https?://[^\s)"]+)', text)
+    Each passage votes for its source URL (full weight), the other URLs its
+    content was deduplicated from and the links inside it (half weight) in
+    proportion to its relevance score; links the answer actually cites get a
+    bonus on top.
+    """
+    passages = context.get("passages", [])
+    if not passages:
+        return []
+    top_score = max(p["score"] for p in passages) or 1.0
 
-            for url in matches:
-                # If URL is in answer or is relevant (even if not explicitly mentioned)
-                if url not in seen_urls:
-                    # Add the link with a descriptive label
-                    links.append(Link(url=url, text=f"Referenced in {fname}"))
-                    seen_urls.add(url)
+    weights = {}
+    labels = {}
+    for passage in passages:
+        relevance = passage["score"] / top_score
+        candidates = [(passage["url"], f"Referenced in {passage['file']}", 1.0)] if passage.get("url") else []
+        candidates += [(url, f"Same content as {passage['file']}", 0.5) for url in passage.get("sources", [])]
+        candidates += [(url, text or f"Referenced in {passage['file']}", 0.5) for url, text in passage.get("links", [])]
+        for url, label, weight in candidates:
+            weights[url] = weights.get(url, 0.0) + weight * relevance
+            labels.setdefault(url, label)
 
-                # Limit to top 2 links to keep response clean
-                if len(links) >= 2:
-                    return links
+    for url in weights:
+        if url.rstrip("/") in answer:
+            weights[url] += 1.0
 
-    return links
+    ranked = sorted(weights, key=weights.get, reverse=True)[:max_links]
+    return [Link(url=url, text=labels[url]) for url in ranked]
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Answer a file of questions offline, without going through HTTP.
+
+Input is JSON lines of {"question": ..., "image": ...} (plain text lines are
+taken as questions). Output is one JSON line per question, written as each
+answer finishes, with its input line number as "index":
+
+    python batch_answer.py questions.jsonl -o answers.jsonl --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+
+def read_questions(path: str) -> list:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                questions.append(json.loads(line))
+            else:
+                questions.append({"question": line})
+    return questions
+
+
+async def run(questions: list, out, concurrency: int) -> int:
+    import index
+
+    requests = [index.QuestionRequest(**question) for question in questions]
+    errors = 0
+    try:
+        async for result in index.answer_batch(requests, concurrency):
+            errors += "error" in result
+            result["question"] = questions[result["index"]]["question"]
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        await index.llm_client.close_client()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer a file of questions in one batch')
+    parser.add_argument('input', help='JSONL of {"question", "image"} or one question per line')
+    parser.add_argument('--output', '-o', default=None, help='Output JSONL (default: stdout)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                       help='Concurrent LLM calls')
+    args = parser.parse_args()
+
+    questions = read_questions(args.input)
+    start = time.perf_counter()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        errors = asyncio.run(run(questions, out, args.concurrency))
+    finally:
+        if args.output:
+            out.close()
+    print(f"Answered {len(questions)} questions in {time.perf_counter() - start:.1f}s ({errors} errors)",
+          file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Retrieval and end-to-end benchmarks over synthetic corpora.
+
+Generates course/Discourse corpora of the requested sizes (in passages),
+then for each size measures knowledge-base load time and peak RSS,
+search_knowledge_base p50/p99 latency and QPS, and recall@k on
+promptfoo-style questions. Optionally drives /api/ under concurrency
+against a local mock LLM server. Results are written as JSON so runs can
+be compared:
+
+    python benchmark.py --sizes 1000,10000 --e2e --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POSTS_PER_THREAD = 40
+COURSE_SHARE = 0.1
+
+# Facts the promptfoo evaluation asks about, planted in every corpus
+PLANTED = [
+    {
+        "question": "The question asks to use gpt-3.5-turbo-0125 model but the ai-proxy provided by Anand sir only supports gpt-4o-mini. So should we just use gpt-4o-mini or use the OpenAI API for gpt3.5 turbo?",
+        "url": "https://discourse.onlinedegree.iitm.ac.in/t/ga5-question-8-clarification/155939",
+        "section": "discourse_posts",
+        "title": "GA5 Question 8 Clarification",
+        "text": "Use gpt-3.5-turbo-0125 through the OpenAI API as the question specifies, even though the ai-proxy only supports gpt-4o-mini."
+    },
+    {
+        "question": "If a student scores 10/10 on GA4 as well as a bonus, how would it appear on the dashboard?",
+        "url": "https://discourse.onlinedegree.iitm.ac.in/t/ga4-data-sourcing-discussion-thread-tds-jan-2025/165959",
+        "section": "discourse_posts",
+        "title": "GA4 Data Sourcing Discussion Thread TDS Jan 2025",
+        "text": "A 10/10 on GA4 plus the bonus shows up as 110 on the dashboard."
+    },
+    {
+        "question": "I know Docker but have not used Podman before. Should I use Docker for this course?",
+        "url": "https://tds.s-anand.net/#/docker",
+        "section": "course_content",
+        "title": "Containers: Docker, Podman",
+        "text": "We recommend Podman for this course. Docker is also acceptable and works the same way."
+    },
+]
+
+
+def make_vocabulary(rng: random.Random, size: int = 5000) -> list:
+    syllables = ["ka", "lo", "mi", "ra", "te", "su", "pen", "dor", "vi", "ax", "qu", "zel", "no", "bri", "sta"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_corpus(root: str, n_passages: int, seed: int = 0, n_queries: int = 200) -> list:
+    """Write a synthetic data/ tree of about n_passages passages under root.
+
+    Words follow a Zipf distribution so postings lengths look like real
+    text. Returns benchmark queries as {"question", "url"}: the planted
+    promptfoo facts plus questions sampled from random passages.
+    """
+    rng = random.Random(seed)
+    vocab = make_vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    course_dir = os.path.join(root, "data", "course_content")
+    discourse_dir = os.path.join(root, "data", "discourse_posts")
+    os.makedirs(course_dir, exist_ok=True)
+    os.makedirs(discourse_dir, exist_ok=True)
+
+    queries = [{"question": fact["question"], "url": fact["url"]} for fact in PLANTED]
+    sampled = []
+
+    def passage_words():
+        return rng.choices(vocab, weights=weights, k=rng.randint(60, 140))
+
+    n_files = max(1, n_passages // POSTS_PER_THREAD)
+    query_files = set(rng.sample(range(n_files), min(n_queries, n_files)))
+    for i in range(n_files):
+        is_course = rng.random() < COURSE_SHARE
+        posts = [passage_words() for _ in range(POSTS_PER_THREAD)]
+        if is_course:
+            url = f"https://tds.s-anand.net/#/page-{i}"
+            body = "".join(f"## Section {n}\n\n{' '.join(words)}\n\n" for n, words in enumerate(posts, 1))
+            text = f'---\ntitle: "Page {i}"\nurl: "{url}"\n---\n\n# Page {i}\n\n{body}'
+            path = os.path.join(course_dir, f"page_{i}.md")
+        else:
+            url = f"https://discourse.onlinedegree.iitm.ac.in/t/synthetic-topic-{i}/{100000 + i}"
+            body = "".join(f"### Post #{n} by @user{rng.randint(1, 500)}\n{' '.join(words)}\n\n" for n, words in enumerate(posts, 1))
+            text = f'---\ntitle: "Topic {i}"\noriginal_url: "{url}"\n---\n\n# Topic {i}\n\n{body}'
+            path = os.path.join(discourse_dir, f"topic_{i}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        if i in query_files:
+            # Rarest words of one passage make a question only it answers well
+            words = sorted(set(rng.choice(posts)), key=vocab.index)[-5:]
+            sampled.append({"question": " ".join(words), "url": url})
+
+    for n, fact in enumerate(PLANTED):
+        if fact["section"] == "course_content":
+            text = f'---\ntitle: "{fact["title"]}"\nurl: "{fact["url"]}"\n---\n\n# {fact["title"]}\n\n{fact["text"]}\n'
+            path = os.path.join(course_dir, f"planted_{n}.md")
+        else:
+            text = f'---\ntitle: "{fact["title"]}"\noriginal_url: "{fact["url"]}"\n---\n\n# {fact["title"]}\n\n### Post #1 by @ta\n{fact["text"]}\n'
+            path = os.path.join(discourse_dir, f"planted_{n}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    return queries + sampled
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def import_api(root: str):
+    """Import api/index.py against the corpus under root"""
+    os.chdir(root)
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ["KB_ARTIFACT"] = os.path.join(root, "missing-kb.bin")
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "api")]
+    if os.getenv("RETRIEVAL_MODE", "keyword") != "keyword" and not os.path.exists("data/vector_index"):
+        # Embeddings are built offline in production, so not part of the load time
+        from knowledge_base import load_documents
+        from vector_index import build_vector_index
+        build_vector_index(load_documents()).save("data/vector_index")
+    import index
+    return index
+
+
+def run_retrieval(root: str, queries: list, k: int) -> dict:
+    """Child process: load time and memory, search latency, recall@k"""
+    index = import_api(root)
+    # Time the knowledge-base load by itself, not the import of fastapi,
+    # openai, numpy and friends; the new snapshot then serves the searches
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    index.index_manager = index.IndexManager(index.load_knowledge_base())
+    load_seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kb = index.index_manager.current
+
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        context = index.search_knowledge_base(query["question"])
+        latencies.append(time.perf_counter() - start)
+        urls = [passage["url"] for passage in context["passages"][:k]]
+        hits += query["url"] in urls
+
+    return {
+        "documents": sum(len(kb[section]) for section in ["course_content", "discourse_posts"]),
+        "passages": len(kb["index"]),
+        "load_seconds": round(load_seconds, 4),
+        # ru_maxrss is KiB on Linux
+        "load_peak_rss_mb": round((rss_after - rss_before) / 1024, 1),
+        "peak_rss_mb": round(rss_after / 1024, 1),
+        "search_p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "search_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "search_qps": round(len(latencies) / sum(latencies), 1),
+        f"recall@{k}": round(hits / len(queries), 3),
+        "planted_recall": [
+            query["url"] in [p["url"] for p in index.search_knowledge_base(query["question"])["passages"][:k]]
+            for query in queries[:len(PLANTED)]
+        ]
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def mock_llm_app(latency: float):
+    """Minimal OpenAI-compatible chat completions server"""
+    from fastapi import FastAPI, Request
+
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        prompt = body["messages"][-1]["content"]
+        return {
+            "id": "mock", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "Mock answer."}}],
+            "usage": {"prompt_tokens": len(str(prompt)) // 4, "completion_tokens": 3, "total_tokens": 0}
+        }
+
+    return app
+
+
+def serve(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def run_e2e(root: str, queries: list, requests: int, concurrency: int, llm_latency: float) -> dict:
+    """Child process: /api/ throughput over HTTP with a mock LLM upstream"""
+    import httpx
+
+    llm_port = free_port()
+    serve(mock_llm_app(llm_latency), llm_port)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    index = import_api(root)
+    api_port = free_port()
+    serve(index.app, api_port)
+
+    async def drive():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one(client, n):
+            nonlocal errors
+            # Distinct questions so the answer cache does not short-circuit
+            question = f"{queries[n % len(queries)]['question']} ({n})"
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/api/", json={"question": question})
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits, timeout=60) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(one(client, n) for n in range(requests)))
+            elapsed = time.perf_counter() - start
+        return latencies, errors, elapsed
+
+    latencies, errors, elapsed = asyncio.run(drive())
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "llm_latency_ms": llm_latency * 1000,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "errors": errors
+    }
+
+
+def run_child(mode: str, root: str, args) -> dict:
+    """Run one measurement in a fresh interpreter so load/RSS numbers are clean"""
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--root", root,
+               "--k", str(args.k), "--requests", str(args.requests),
+               "--concurrency", str(args.concurrency), "--llm-latency", str(args.llm_latency),
+               "--mode", args.mode, "--reranker", args.reranker]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(previous: dict, current: dict):
+    """Print relative changes of every numeric metric against a previous run"""
+    for size, result in current["retrieval"].items():
+        before = previous.get("retrieval", {}).get(size)
+        if not before:
+            continue
+        for key, value in result.items():
+            if isinstance(value, (int, float)) and isinstance(before.get(key), (int, float)) and before[key]:
+                change = (value - before[key]) / before[key] * 100
+                print(f"{size:>8} {key:<18} {before[key]:>10} -> {value:<10} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark retrieval and the /api/ endpoint')
+    parser.add_argument('--sizes', default='1000,10000',
+                       help='Comma-separated corpus sizes in passages (up to 1000000)')
+    parser.add_argument('--k', type=int, default=5, help='k for recall@k')
+    parser.add_argument('--e2e', action='store_true', help='Also benchmark /api/ end to end')
+    parser.add_argument('--requests', type=int, default=200, help='End-to-end requests')
+    parser.add_argument('--concurrency', type=int, default=16, help='End-to-end concurrency')
+    parser.add_argument('--llm-latency', type=float, default=0.05,
+                       help='Mock LLM response time in seconds')
+    parser.add_argument('--mode', choices=['keyword', 'semantic', 'hybrid'], default='keyword',
+                       help='RETRIEVAL_MODE to benchmark')
+    parser.add_argument('--reranker', default='off', help='RERANKER to benchmark')
+    parser.add_argument('--output', '-o', default=None, help='Write JSON results here')
+    parser.add_argument('--compare', default=None, help='Previous JSON results to compare against')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', choices=['retrieval', 'e2e'], help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        os.environ["RETRIEVAL_MODE"] = args.mode
+        os.environ["RERANKER"] = args.reranker
+        with open(os.path.join(args.root, "queries.json"), "r", encoding="utf-8") as f:
+            queries = json.load(f)
+        if args.child == "retrieval":
+            result = run_retrieval(args.root, queries, args.k)
+        else:
+            result = run_e2e(args.root, queries, args.requests, args.concurrency, args.llm_latency)
+        print(json.dumps(result))
+        return 0
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "mode": args.mode,
+        "reranker": args.reranker,
+        "retrieval": {}
+    }
+    sizes = [int(size) for size in args.sizes.split(",")]
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="tds-bench-") as root:
+            start = time.perf_counter()
+            queries = generate_corpus(root, size, args.seed)
+            with open(os.path.join(root, "queries.json"), "w", encoding="utf-8") as f:
+                json.dump(queries, f)
+            print(f"Generated {size} passages in {time.perf_counter() - start:.1f}s")
+
+            results["retrieval"][str(size)] = run_child("retrieval", root, args)
+            print(json.dumps(results["retrieval"][str(size)]))
+            if args.e2e and size == sizes[0]:
+                results["e2e"] = run_child("e2e", root, args)
+                print(json.dumps(results["e2e"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Concurrent Discourse crawler.
+
+Fetches a category's listing pages and every topic page with a pooled async
+HTTP client, a token-bucket rate limit and bounded concurrency. Failed
+requests are retried with exponential backoff, and the frontier is
+checkpointed to an append-only log so an interrupted crawl resumes where it
+stopped, retrying the items that failed.
+Pages are parsed from their raw bytes in a pool of worker processes, so
+parsing does not hold up fetching.
+
+With a PageArchive every response is archived, pages already archived are
+fetched with conditional requests, and replay() re-parses the archive
+offline after a parser fix.
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime
+
+import httpx
+
+from html_parsing import PARSE_WORKERS, ParserPool
+from page_archive import PageArchive
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+STATE_FILE = ".crawl_state.json"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CrawlState:
+    """Persistent frontier: queued items, finished URLs and failures.
+
+    Items are {"kind": "list" | "topic", "url": ..., ...}. The checkpoint is
+    an append-only log: a snapshot line ({"pending", "done", "failed",
+    "failed_items"}) followed by one event line per add/finish, so each
+    checkpoint costs one short write. Loading replays the log and compacts
+    it back to a single snapshot. Anything that was queued but not finished
+    when the process stopped is pending again after a load, and so are
+    failed items once retry_failed() is called.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = {}
+        self.done = set()
+        self.failed = {}
+        self.failed_items = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._replay(json.loads(line))
+                    except ValueError:
+                        break  # a line cut short by a crash; nothing after it was written
+        self._compact()
+        self._log = open(path, 'a', encoding='utf-8')
+
+    def _replay(self, entry: dict):
+        event = entry.get('event')
+        if event is None:
+            # Snapshot (also the whole file of a pre-log checkpoint)
+            self.pending = {item['url']: item for item in entry.get('pending', [])}
+            self.done = set(entry.get('done', []))
+            self.failed = entry.get('failed', {})
+            self.failed_items = {item['url']: item for item in entry.get('failed_items', [])}
+        elif event == 'add':
+            self.pending[entry['item']['url']] = entry['item']
+        else:
+            self._finish(entry['url'], entry.get('error'))
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'pending': list(self.pending.values()),
+                'done': sorted(self.done),
+                'failed': self.failed,
+                'failed_items': list(self.failed_items.values())
+            }) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _append(self, entry: dict):
+        self._log.write(json.dumps(entry) + '\n')
+
+    def add(self, item: dict) -> bool:
+        if item['url'] in self.done or item['url'] in self.pending:
+            return False
+        self.pending[item['url']] = item
+        self._append({'event': 'add', 'item': item})
+        return True
+
+    def _finish(self, url: str, error: str = None):
+        item = self.pending.pop(url, None)
+        if error:
+            self.failed[url] = error
+            if item is not None:
+                self.failed_items[url] = item
+        else:
+            self.done.add(url)
+            self.failed.pop(url, None)
+            self.failed_items.pop(url, None)
+
+    def finish(self, url: str, error: str = None):
+        self._finish(url, error)
+        self._append({'event': 'finish', 'url': url, 'error': error})
+
+    def retry_failed(self) -> int:
+        """Move failed items back to pending; returns how many"""
+        retried = 0
+        for url, item in list(self.failed_items.items()):
+            del self.failed_items[url]
+            if self.add(item):
+                retried += 1
+        return retried
+
+    def save(self):
+        """Flush the log, so a crash loses at most what is still in flight"""
+        self._log.flush()
+
+    def close(self):
+        self._log.close()
+
+
+async def fetch(client: httpx.AsyncClient, bucket: TokenBucket, url: str,
+                max_retries: int = 3, backoff: float = 1.0, archive: PageArchive = None,
+                kind: str = None) -> bytes:
+    """GET url's raw body under the rate limit, retrying transient failures with backoff.
+
+    With an archive, the response is archived under kind, and an archived
+    page is revalidated with a conditional request instead of re-downloaded.
+    """
+    headers = archive.validators(url) if archive is not None else {}
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+        else:
+            if response.status_code == 304 and headers:
+                return archive.revalidated(url, response.headers)
+            if response.status_code == 200:
+                if archive is not None:
+                    archive.put(url, response.content, response.headers, kind=kind)
+                return response.content
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                response.raise_for_status()
+                raise httpx.HTTPStatusError(
+                    f"Unexpected status {response.status_code}", request=response.request, response=response
+                )
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        await asyncio.sleep(delay)
+
+
+def topic_filename(topic: dict) -> str:
+    date = topic['date'][:10].replace('-', '') if topic.get('date') else 'undated'
+    filename = f"{date}_{topic['title'][:50]}"
+    return re.sub(r'[^\w\-]', '_', filename) + '.json'
+
+
+def topic_items(topics: list, start_date: datetime = None, end_date: datetime = None) -> list:
+    """Frontier items for the topics of a listing page that fall in the date range"""
+    items = []
+    for topic in topics:
+        date = topic['date']
+        if date and ((start_date and date < start_date) or (end_date and date > end_date)):
+            continue
+        items.append({
+            'kind': 'topic',
+            'url': topic['url'],
+            'title': topic['title'],
+            'date': date.isoformat() if date else None
+        })
+    return items
+
+
+def save_topic(output_dir: str, item: dict, topic_data: dict) -> dict:
+    """Write a parsed topic page, completed from its frontier item, to output_dir"""
+    posts = topic_data['posts']
+    topic_data.update({
+        'title': topic_data.get('title') or item['title'],
+        'url': item['url'],
+        'date': item['date'],
+        'content': posts[0]['content'] if posts else "",
+        'scraped_at': datetime.now().isoformat()
+    })
+    with open(os.path.join(output_dir, topic_filename(topic_data)), 'w', encoding='utf-8') as f:
+        json.dump(topic_data, f, ensure_ascii=False, indent=2)
+    return topic_data
+
+
+async def crawl(base_url: str, output_dir: str, concurrency: int = 4, rate: float = 2.0,
+                max_retries: int = 3, start_date: datetime = None, end_date: datetime = None,
+                limit: int = None, resume: bool = True, parse_workers: int = None,
+                archive: PageArchive = None) -> int:
+    """Crawl the category at base_url into output_dir, one JSON file per topic.
+
+    limit caps the topics fetched by this run; done topics don't count, and
+    topics past the limit stay queued for the next run. parse_workers is the
+    number of parser processes (default PARSE_WORKERS, at most concurrency;
+    0 parses in this process). Responses are archived in archive if one is
+    given. Returns the number of topics saved by this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_FILE)
+    if not resume and os.path.exists(state_path):
+        os.remove(state_path)
+    state = CrawlState(state_path)
+    if not state.pending and not state.done:
+        state.add({'kind': 'list', 'url': base_url})
+    retried = state.retry_failed()
+    if retried:
+        print(f"Retrying {retried} items that failed last time")
+
+    queue = asyncio.Queue()
+    bucket = TokenBucket(rate, burst=concurrency)
+    counts = {'topics': 0, 'queued': 0}
+
+    def schedule(item: dict):
+        # Topics past the limit stay in the frontier for the next run
+        if item['kind'] == 'topic':
+            if limit is not None and counts['queued'] >= limit:
+                return
+            counts['queued'] += 1
+        queue.put_nowait(item)
+
+    def enqueue(item: dict):
+        # Only new items count toward the limit: done ones are not re-added
+        if state.add(item):
+            schedule(item)
+
+    for item in list(state.pending.values()):
+        schedule(item)
+
+    async def handle(client: httpx.AsyncClient, item: dict):
+        content = await fetch(client, bucket, item['url'], max_retries, archive=archive, kind=item['kind'])
+        parsed = await parser.parse(item['kind'], content, item['url'])
+        if item['kind'] == 'list':
+            topics, next_url = parsed
+            print(f"Found {len(topics)} topics on {item['url']}")
+            for topic_item in topic_items(topics, start_date, end_date):
+                enqueue(topic_item)
+            if next_url:
+                enqueue({'kind': 'list', 'url': next_url})
+            return
+
+        topic_data = save_topic(output_dir, item, parsed)
+        counts['topics'] += 1
+        print(f"Saved: {topic_data['title']}")
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            item = await queue.get()
+            try:
+                await handle(client, item)
+                state.finish(item['url'])
+            except Exception as e:
+                print(f"Error fetching {item['url']}: {str(e)}")
+                state.finish(item['url'], error=str(e))
+            finally:
+                # Checkpoint after every item so a crash loses at most the in-flight ones
+                state.save()
+                queue.task_done()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    parser = ParserPool(min(concurrency, PARSE_WORKERS) if parse_workers is None else parse_workers)
+    async with httpx.AsyncClient(headers=HEADERS, limits=limits, timeout=30, follow_redirects=True) as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            parser.close()
+            state.save()
+            state.close()
+
+    return counts['topics']
+
+
+def replay(archive: PageArchive, output_dir: str, start_date: datetime = None, end_date: datetime = None,
+           parse_workers: int = None, batch_size: int = 256) -> int:
+    """Re-parse the archived listing and topic pages into output_dir, without network access.
+
+    Topics get their title and date from the archived listing pages that
+    link to them, as in a crawl. Returns the number of topics saved.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    saved = 0
+    with ParserPool(parse_workers) as parser:
+        lists = archive.records('list')
+        items = {}
+        for topics, _ in parser.map([('list', archive.read(record), record['url']) for record in lists]):
+            for item in topic_items(topics, start_date, end_date):
+                items[item['url']] = item
+        print(f"Found {len(items)} topics on {len(lists)} archived listing pages")
+
+        records = [record for record in archive.records('topic') if record['url'] in items]
+        # In batches, so only batch_size decompressed pages are in memory at once
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            pages = [('topic', archive.read(record), record['url']) for record in batch]
+            for record, topic_data in zip(batch, parser.map(pages)):
+                save_topic(output_dir, items[record['url']], topic_data)
+                saved += 1
+            print(f"Re-parsed {saved}/{len(records)} archived topics")
+    return saved
@@ -1,42 +1,155 @@
-import zipfile
-import os
-import markdown
-from bs4 import BeautifulSoup
+#!/usr/bin/env python3
+"""
+Ingestion pipeline for the downloaded zip archives.
+
+Members are streamed straight out of the ZipFile (nothing is extracted to
+disk), parsed and cleaned in a process pool, and written as one JSON record
+per line:
+
+    {"id", "section", "title", "url", "date", "links", "text"}
+
+where links are {"url", "text", "offset"} with offsets into text.
+
+Run it with:
+
+    python data_processing.py --threads downloaded_threads.zip --posts markdown_files.zip
+
+Quoted replies are stripped while parsing, and the records are then
+deduplicated (see dedup.py) unless --no-dedup is given.
+"""
+
+import argparse
 import json
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def process_downloaded_threads(zip_path: str):
-    """Process the downloaded_threads.zip file"""
+from dedup import dedup_records, strip_quotes
+from knowledge_base import FRONT_MATTER_RE, RECORDS_DIR, extract_link_table
+
+HEADING_TITLE_RE = re.compile(r"^#\s+(.+)$", re.MULTILINE)
+
+
+def parse_front_matter(content: str):
+    """Split simple `key: value` front matter from the body"""
+    match = FRONT_MATTER_RE.match(content)
+    if not match:
+        return {}, content
+    meta = {}
+    for line in match.group(1).splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            meta[key.strip()] = value.strip().strip('"\'')
+    return meta, content[match.end():]
+
+
+def parse_markdown(name: str, content: str, section: str) -> dict:
+    """Turn one markdown member into a normalized record"""
+    meta, body = parse_front_matter(content)
+
+    title = meta.get("title")
+    if not title:
+        heading = HEADING_TITLE_RE.search(body)
+        title = heading.group(1).strip() if heading else os.path.splitext(os.path.basename(name))[0]
+
+    if section == "discourse_posts":
+        # Replies quoting earlier posts would index the quoted text twice
+        body = strip_quotes(body)
+
+    # Keep the title searchable even when the body has no heading of its own
+    body = body.strip()
+    if not body.startswith("#"):
+        body = f"# {title}\n\n{body}"
+
+    return {
+        "id": name,
+        "section": section,
+        "title": title,
+        "url": meta.get("original_url") or meta.get("url"),
+        "date": meta.get("downloaded_at") or meta.get("date") or meta.get("created_at"),
+        # Link offsets index into text, so passages can look up their own links
+        "links": [
+            {"url": url, "text": text, "offset": offset}
+            for url, text, offset in extract_link_table(body)
+        ],
+        "text": body
+    }
+
+
+def _parse_member(args):
+    return parse_markdown(*args)
+
+
+def iter_members(zip_path: str, section: str):
+    """Yield (name, text, section) for each markdown member, read one at a time"""
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall("data/course_content")
-    
-    # Process the extracted files
-    knowledge_base = {}
-    
-    for root, dirs, files in os.walk("data/course_content"):
-        for file in files:
-            if file.endswith(".md"):
-                with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    html = markdown.markdown(content)
-                    soup = BeautifulSoup(html, 'html.parser')
-                    # Extract relevant information and add to knowledge_base
-                    
-    return knowledge_base
-
-def process_discourse_posts(zip_path: str):
+        for info in zip_ref.infolist():
+            if info.is_dir() or not info.filename.endswith(".md"):
+                continue
+            yield info.filename, zip_ref.read(info).decode("utf-8", errors="replace"), section
+
+
+def ingest_zip(zip_path: str, section: str, output_path: str, workers: int = None, max_pending: int = None) -> int:
+    """Parse every markdown member of zip_path in a process pool into a JSONL file.
+
+    At most max_pending members are read but not yet written at any time,
+    so memory stays bounded however large the archive is. Records are
+    written in archive order. Returns the number of records.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    count = 0
+    tmp_path = output_path + ".tmp"
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(tmp_path, 'w', encoding='utf-8') as out:
+        pending = deque()
+        for member in iter_members(zip_path, section):
+            pending.append(executor.submit(_parse_member, member))
+            if len(pending) >= max_pending:
+                out.write(json.dumps(pending.popleft().result(), ensure_ascii=False) + "\n")
+                count += 1
+        while pending:
+            out.write(json.dumps(pending.popleft().result(), ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def process_downloaded_threads(zip_path: str, output_dir: str = RECORDS_DIR, workers: int = None):
+    """Process the downloaded_threads.zip file"""
+    output_path = os.path.join(output_dir, "course_content.jsonl")
+    return {"records": ingest_zip(zip_path, "course_content", output_path, workers), "output": output_path}
+
+
+def process_discourse_posts(zip_path: str, output_dir: str = RECORDS_DIR, workers: int = None):
     """Process the markdown_files.zip file"""
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall("data/discourse_posts")
-    
-    # Process the extracted files
-    discourse_data = {}
-    
-    for root, dirs, files in os.walk("data/discourse_posts"):
-        for file in files:
-            if file.endswith(".md"):
-                with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # Extract metadata and content
-                    # Add to discourse_data
-                    
-    return discourse_data
\ No newline at end of file
+    output_path = os.path.join(output_dir, "discourse_posts.jsonl")
+    return {"records": ingest_zip(zip_path, "discourse_posts", output_path, workers), "output": output_path}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest the downloaded zip archives')
+    parser.add_argument('--threads', help='Path to downloaded_threads.zip (course content)')
+    parser.add_argument('--posts', help='Path to markdown_files.zip (Discourse posts)')
+    parser.add_argument('--output', '-o', default=RECORDS_DIR,
+                       help='Directory for the JSONL record files')
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                       help='Parser processes (default: all cores)')
+    parser.add_argument('--no-dedup', action='store_true',
+                       help='Skip near-duplicate removal')
+    args = parser.parse_args()
+
+    if args.threads:
+        print(process_downloaded_threads(args.threads, args.output, args.workers))
+    if args.posts:
+        print(process_discourse_posts(args.posts, args.output, args.workers))
+    if (args.threads or args.posts) and not args.no_dedup:
+        print(dedup_records(args.output))
+
+
+if __name__ == "__main__":
+    main()
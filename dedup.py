@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate removal for ingested records.
+
+Discourse replies quote each other and the scrapers can save one topic
+twice under different filenames, so the same text ends up indexed (and
+sent to the model) several times. This stage:
+
+- strips quoted blocks ([quote]...[/quote], <aside class="quote">,
+  <blockquote>, "> " lines) while records are parsed (see data_processing.py)
+- drops records that are exact or near duplicates of an earlier record
+- cuts passages that near-duplicate an earlier passage out of the remaining
+  records, and drops records left with nothing
+
+Near duplicates are found with MinHash signatures over word shingles and
+LSH banding, then confirmed by estimated Jaccard similarity. Every record
+keeps a "sources" list of the URLs whose content it absorbed, which the
+knowledge base carries through to the answer's links. Run it over the JSONL
+records, or with --topics over the scrapers' topic JSON files (where the
+passages are posts, and duplicate topic files are deleted):
+
+    python dedup.py data/records
+    python dedup.py --topics discourse_posts_2025
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+from knowledge_base import RECORDS_DIR, extract_link_table, front_matter_end, split_passages
+from search_index import tokenize
+
+QUOTE_RES = [
+    re.compile(r'\[quote(?:=[^\]]*)?\].*?\[/quote\]\s*', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<aside[^>]*class="[^"]*\bquote\b[^"]*"[^>]*>.*?</aside>\s*', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<blockquote[^>]*>.*?</blockquote>\s*', re.IGNORECASE | re.DOTALL),
+    re.compile(r'^>.*(?:\n|$)', re.MULTILINE),
+]
+
+SHINGLE_SIZE = 3
+MIN_SHINGLES = 8
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def strip_quotes(text: str) -> str:
+    """Remove quoted earlier replies, which duplicate the posts they quote"""
+    for pattern in QUOTE_RES:
+        text = pattern.sub("", text)
+    return text
+
+
+class MinHashLSH:
+    """MinHash signatures with banded locality-sensitive hashing.
+
+    With bands b of r rows, pairs at Jaccard s become candidates with
+    probability 1 - (1 - s^r)^b (about 0.5 at s = 0.5 for 16 x 4), and
+    candidates are kept only if their estimated similarity reaches threshold.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.RandomState(seed)
+        # a, b < 2^31 and shingle hashes < 2^32 keep a * x + b inside uint64
+        self.a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def signature(self, text: str):
+        """MinHash signature of text's word shingles, or None if it is too short to judge"""
+        tokens = tokenize(text)
+        shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+        if len(shingles) < MIN_SHINGLES:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def query(self, signature):
+        """Key of the most similar stored signature at or above threshold, or None"""
+        candidates = set()
+        for band, buckets in enumerate(self.buckets):
+            candidates.update(buckets.get(signature[band * self.rows:(band + 1) * self.rows].tobytes(), ()))
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self.signatures[key] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def insert(self, key, signature):
+        self.signatures[key] = signature
+        for band, buckets in enumerate(self.buckets):
+            buckets.setdefault(signature[band * self.rows:(band + 1) * self.rows].tobytes(), []).append(key)
+
+
+def iter_record_files(records_dir: str):
+    for fname in sorted(os.listdir(records_dir)):
+        if fname.endswith(".jsonl"):
+            yield os.path.join(records_dir, fname)
+
+
+def iter_jsonl(paths: list):
+    """Yield ((path, line number), record) for every record of the JSONL files"""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f):
+                yield (path, line_number), json.loads(line)
+
+
+def plan(records, doc_threshold: float = 0.9, passage_threshold: float = 0.8, spans=None) -> dict:
+    """First pass: decide which records and passages to drop, without keeping any text.
+
+    records yields (key, record) with the record's "text", "url" and any
+    earlier "sources"; spans(record) gives its passages as (start, end),
+    split_passages of the text by default. Returns {"drop": set of keys,
+    "cut": {key: [passage indexes]}, "sources": {key: [urls]}}.
+    """
+    spans = spans or (lambda record: split_passages(record["text"]))
+    documents = MinHashLSH(doc_threshold)
+    passages = MinHashLSH(passage_threshold)
+    exact = {}
+    decisions = {"drop": set(), "cut": {}, "sources": {}}
+
+    def absorb(survivor, record):
+        sources = decisions["sources"].setdefault(survivor, [])
+        for url in [record.get("url")] + record.get("sources", []):
+            if url and url not in sources:
+                sources.append(url)
+
+    for key, record in records:
+        text = record["text"]
+        if not text.strip():
+            # Nothing to compare, and blank records aren't duplicates of each other
+            continue
+
+        digest = hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).digest()
+        signature = documents.signature(text)
+        duplicate_of = exact.get(digest)
+        if duplicate_of is None and signature is not None:
+            duplicate_of = documents.query(signature)
+        if duplicate_of is not None:
+            decisions["drop"].add(key)
+            absorb(duplicate_of, record)
+            continue
+        record_spans = spans(record)
+        cut = []
+        for n, (start, end) in enumerate(record_spans):
+            passage_signature = passages.signature(text[start:end])
+            if passage_signature is None:
+                continue
+            earlier = passages.query(passage_signature)
+            if earlier is not None:
+                cut.append(n)
+                absorb(earlier[0], record)
+            else:
+                passages.insert((key, n), passage_signature)
+        if cut and len(cut) == len(record_spans):
+            decisions["drop"].add(key)
+            continue
+        if cut:
+            decisions["cut"][key] = cut
+        # Only records that survive can absorb later duplicates
+        exact[digest] = key
+        if signature is not None:
+            documents.insert(key, signature)
+    return decisions
+
+
+def remove_passages(text: str, cut: list) -> str:
+    """text without the passages (by split_passages index) in cut; overlaps are emitted once.
+
+    Front matter, which is in no passage, is kept.
+    """
+    cut = set(cut)
+    emitted = front_matter_end(text)
+    parts = [text[:emitted]]
+    for n, (start, end) in enumerate(split_passages(text)):
+        if n in cut:
+            continue
+        parts.append(text[max(start, emitted):end])
+        emitted = max(emitted, end)
+    return "".join(parts)
+
+
+def dedup_records(records_dir: str = RECORDS_DIR, doc_threshold: float = 0.9, passage_threshold: float = 0.8) -> dict:
+    """Deduplicate every JSONL record file in records_dir in place; returns counts"""
+    paths = list(iter_record_files(records_dir))
+    decisions = plan(iter_jsonl(paths), doc_threshold, passage_threshold)
+    stats = {"records": 0, "dropped": len(decisions["drop"]), "trimmed": len(decisions["cut"]),
+             "chars_before": 0, "chars_after": 0}
+
+    for path in paths:
+        tmp_path = path + ".tmp"
+        with open(path, "r", encoding="utf-8") as f, open(tmp_path, "w", encoding="utf-8") as out:
+            for line_number, line in enumerate(f):
+                record = json.loads(line)
+                key = (path, line_number)
+                stats["records"] += 1
+                stats["chars_before"] += len(record["text"])
+                if key in decisions["drop"]:
+                    continue
+                if key in decisions["cut"]:
+                    record["text"] = remove_passages(record["text"], decisions["cut"][key])
+                    record["links"] = [
+                        {"url": url, "text": text, "offset": offset}
+                        for url, text, offset in extract_link_table(record["text"])
+                    ]
+                record["sources"] = merged_sources(record, decisions["sources"].get(key, []))
+                stats["chars_after"] += len(record["text"])
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+    return stats
+
+
+def merged_sources(record: dict, absorbed: list) -> list:
+    """The record's own URL, then every URL it has absorbed, once each"""
+    sources = [record.get("url")] + record.get("sources", []) + absorbed
+    return list(dict.fromkeys(url for url in sources if url))
+
+
+def topic_posts(topic: dict) -> list:
+    """A saved topic's posts; topics saved without them count as one post of their content"""
+    return topic.get("posts") or [{"content": topic.get("content") or ""}]
+
+
+def topic_record(topic: dict) -> dict:
+    """A topic as a dedup record: its posts' text, one passage per post"""
+    spans = []
+    parts = []
+    pos = 0
+    for post in topic_posts(topic):
+        content = post.get("content") or ""
+        spans.append((pos, pos + len(content)))
+        parts.append(content)
+        pos += len(content) + 2
+    return {"text": "\n\n".join(parts), "url": topic.get("url"), "sources": topic.get("sources", []),
+            "spans": spans}
+
+
+def iter_topic_files(topic_dir: str):
+    """Paths of the scrapers' topic JSON files in topic_dir, oldest filename first"""
+    for fname in sorted(os.listdir(topic_dir)):
+        if fname.endswith(".json") and not fname.startswith("."):
+            path = os.path.join(topic_dir, fname)
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    topic = json.load(f)
+                except ValueError:
+                    continue
+            # Skip state files and anything else that isn't a saved topic
+            if isinstance(topic, dict) and topic.get("url") and ("posts" in topic or "content" in topic):
+                yield path
+
+
+def dedup_topics(topic_dir: str, doc_threshold: float = 0.9, passage_threshold: float = 0.8) -> dict:
+    """Deduplicate the topic JSON files the scrapers wrote to topic_dir in place; returns counts.
+
+    A topic saved twice (e.g. under two sanitized filenames) keeps its
+    first file; the others are deleted and their URLs added to its sources.
+    Posts that near-duplicate an earlier post are removed.
+    """
+    paths = list(iter_topic_files(topic_dir))
+
+    def topics():
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                yield path, topic_record(json.load(f))
+
+    decisions = plan(topics(), doc_threshold, passage_threshold, spans=lambda record: record["spans"])
+    stats = {"topics": len(paths), "dropped": len(decisions["drop"]), "trimmed": len(decisions["cut"]),
+             "chars_before": 0, "chars_after": 0}
+
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            topic = json.load(f)
+        posts = topic_posts(topic)
+        stats["chars_before"] += sum(len(post.get("content") or "") for post in posts)
+        if path in decisions["drop"]:
+            os.remove(path)
+            continue
+        cut = set(decisions["cut"].get(path, ()))
+        if cut and "posts" in topic:
+            topic["posts"] = [post for n, post in enumerate(posts) if n not in cut]
+            topic["content"] = topic["posts"][0].get("content", "")
+        stats["chars_after"] += sum(len(post.get("content") or "") for post in topic_posts(topic))
+        if cut or path in decisions["sources"]:
+            topic["sources"] = merged_sources(topic, decisions["sources"].get(path, []))
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(topic, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove exact and near-duplicate records and passages')
+    parser.add_argument('records_dir', nargs='?', default=RECORDS_DIR,
+                       help='Directory of JSONL record files (or, with --topics, topic JSON files)')
+    parser.add_argument('--topics', action='store_true',
+                       help="Deduplicate the scrapers' topic JSON files instead of JSONL records")
+    parser.add_argument('--doc-threshold', type=float, default=0.9,
+                       help='Estimated Jaccard similarity at which whole records are duplicates')
+    parser.add_argument('--passage-threshold', type=float, default=0.8,
+                       help='Estimated Jaccard similarity at which passages are duplicates')
+    args = parser.parse_args()
+
+    dedup = dedup_topics if args.topics else dedup_records
+    print(dedup(args.records_dir, args.doc_threshold, args.passage_threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@
 import requests
 import json
 import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin
+
+BASE_URL = "https://discourse.onlinedegree.iitm.ac.in"
+STATE_FILE = "sync_state.json"
 
 def scrape_via_api():
     api_url = "https://discourse.onlinedegree.iitm.ac.in/posts.json"
@@ -21,4 +28,260 @@ def scrape_via_api():
             return False
     except Exception as e:
         print(f"API error: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def retry_delay(value, default: float) -> float:
+    """Seconds to wait for a Retry-After header: delta-seconds or an HTTP date"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class SyncSession:
+    """requests.Session that remembers ETag/Last-Modified per URL.
+
+    get_json returns None for a 304 so unchanged resources cost one cheap
+    round trip and no parsing. 429 and 5xx responses are retried, honouring
+    Retry-After.
+    """
+
+    def __init__(self, base_url: str, validators: dict, delay: float = 0.2):
+        self.base_url = base_url
+        self.validators = validators
+        self.delay = delay
+        self.session = requests.Session()
+        self.session.headers['Accept'] = 'application/json'
+
+    def _key(self, path: str, params=None) -> str:
+        return requests.Request('GET', urljoin(self.base_url, path), params=params).prepare().url
+
+    def forget(self, path: str, params=None):
+        """Drop stored validators so the next request is unconditional"""
+        self.validators.pop(self._key(path, params), None)
+
+    def get_json(self, path: str, params=None, conditional: bool = True):
+        url = urljoin(self.base_url, path)
+        key = self._key(path, params)
+        headers = {}
+        cached = self.validators.get(key, {}) if conditional else {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        for attempt in range(4):
+            response = self.session.get(url, params=params, headers=headers, timeout=30)
+            if response.status_code != 429 and response.status_code < 500:
+                break
+            if attempt < 3:
+                time.sleep(retry_delay(response.headers.get('Retry-After'), 2 ** attempt))
+        time.sleep(self.delay)
+
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        if conditional:
+            self.validators[key] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+        return response.json()
+
+
+def load_sync_state(output_dir: str) -> dict:
+    path = os.path.join(output_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'topics': {}, 'validators': {}, 'last_bumped_at': None, 'max_post_id': 0}
+
+
+def save_sync_state(output_dir: str, state: dict):
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def changed_topics(api: SyncSession, listing_path: str, state: dict):
+    """Page through a topic listing (newest bump first) until the high-water mark.
+
+    Listing pages are fetched unconditionally: they are cheap, and a 304
+    after an interrupted sync would hide topics that were never processed.
+    """
+    watermark = state['last_bumped_at']
+    page = 0
+    while True:
+        data = api.get_json(listing_path, params={'page': page}, conditional=False)
+        topics = data.get('topic_list', {}).get('topics', [])
+        for topic in topics:
+            if watermark and topic['bumped_at'] <= watermark:
+                if topic.get('pinned'):  # pinned topics sit on top regardless of bump
+                    continue
+                return
+            known = state['topics'].get(str(topic['id']))
+            if known and known['highest_post_number'] == topic['highest_post_number'] \
+                    and known['bumped_at'] == topic['bumped_at']:
+                continue
+            yield topic
+        if not topics or not data['topic_list'].get('more_topics_url'):
+            return
+        page += 1
+
+
+def sync_topic(api: SyncSession, topic: dict, output_dir: str, state: dict) -> int:
+    """Merge one topic's new and edited posts into its file, and drop its deleted posts"""
+    try:
+        return _sync_topic(api, topic, output_dir, state)
+    except Exception:
+        # Retry this topic unconditionally next time instead of getting a 304
+        api.forget(f"/t/{topic['id']}.json")
+        raise
+
+
+def _sync_topic(api: SyncSession, topic: dict, output_dir: str, state: dict) -> int:
+    topic_id = str(topic['id'])
+    known = state['topics'].setdefault(topic_id, {'highest_post_number': 0, 'bumped_at': None, 'posts': {}})
+    data = api.get_json(f"/t/{topic_id}.json")
+    if data is None:  # 304: our copy is current
+        known['highest_post_number'] = topic['highest_post_number']
+        known['bumped_at'] = topic['bumped_at']
+        return 0
+
+    path = os.path.join(output_dir, 'topics', f"{topic_id}.json")
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    else:
+        record = {'posts': []}
+    posts = {str(p['id']): p for p in record['posts']}
+
+    # The topic payload inlines the first ~20 posts. The rest are fetched by
+    # id, all of them: only a post's own payload says whether it was edited
+    inline = data['post_stream']['posts']
+    stream = [str(i) for i in data['post_stream']['stream']]
+    inline_ids = {str(p['id']) for p in inline}
+    rest = [i for i in stream if i not in inline_ids]
+    fetched = list(inline)
+    for i in range(0, len(rest), 20):
+        batch = api.get_json(f"/t/{topic_id}/posts.json", params={'post_ids[]': rest[i:i + 20]}, conditional=False)
+        fetched.extend(batch['post_stream']['posts'])
+
+    updated = 0
+    for post in fetched:
+        post_id = str(post['id'])
+        revision = [post.get('updated_at'), post.get('version')]
+        if known['posts'].get(post_id) == revision and post_id in posts:
+            continue
+        posts[post_id] = {
+            'id': post['id'],
+            'post_number': post['post_number'],
+            'author': post.get('username', ''),
+            'created_at': post.get('created_at'),
+            'updated_at': post.get('updated_at'),
+            'version': post.get('version'),
+            'cooked': post.get('cooked', '')
+        }
+        known['posts'][post_id] = revision
+        updated += 1
+
+    # Deleted posts drop out of the stream
+    live = set(stream)
+    for post_id in [post_id for post_id in posts if post_id not in live]:
+        del posts[post_id]
+        updated += 1
+    for post_id in [post_id for post_id in known['posts'] if post_id not in live]:
+        del known['posts'][post_id]
+
+    record.update({
+        'id': topic['id'],
+        'title': data.get('title', topic.get('title')),
+        'url': f"{api.base_url.rstrip('/')}/t/{data.get('slug', topic.get('slug'))}/{topic_id}",
+        'created_at': data.get('created_at'),
+        'bumped_at': topic['bumped_at'],
+        'posts': sorted(posts.values(), key=lambda p: p['post_number'])
+    })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+
+    known['highest_post_number'] = topic['highest_post_number']
+    known['bumped_at'] = topic['bumped_at']
+    return updated
+
+
+def sync_latest_posts(api: SyncSession, output_dir: str, state: dict) -> int:
+    """Page posts.json?before= back to the last seen post id and append new posts.
+
+    posts.json covers the whole forum, so only posts in topics the listing
+    sync knows about are kept. The first sync only records the newest post
+    id: the topic sync has just fetched every older post anyway.
+    """
+    if not state.get('max_post_id'):
+        data = api.get_json("/posts.json", conditional=False)
+        state['max_post_id'] = max((p['id'] for p in data.get('latest_posts', [])), default=0)
+        return 0
+
+    new_posts = []
+    before = None
+    while True:
+        params = {'before': before} if before else None
+        data = api.get_json("/posts.json", params=params, conditional=False)
+        batch = [p for p in data.get('latest_posts', []) if p['id'] > state['max_post_id']]
+        new_posts.extend(batch)
+        if not batch or len(batch) < len(data['latest_posts']):
+            break
+        before = min(p['id'] for p in batch)
+
+    if new_posts:
+        kept = [p for p in new_posts if str(p.get('topic_id')) in state['topics']]
+        with open(os.path.join(output_dir, 'posts.jsonl'), 'a', encoding='utf-8') as f:
+            for post in sorted(kept, key=lambda p: p['id']):
+                f.write(json.dumps(post, ensure_ascii=False) + "\n")
+        state['max_post_id'] = max(p['id'] for p in new_posts)
+        return len(kept)
+    return 0
+
+
+def sync_incremental(output_dir: str = "discourse_api_data", base_url: str = BASE_URL,
+                     listing_path: str = "/latest.json", delay: float = 0.2) -> dict:
+    """Fetch only what changed since the previous sync.
+
+    Topics are found by paging listing_path down to the stored bumped_at
+    high-water mark; each changed topic then has its posts re-listed and
+    only the new or edited ones (by updated_at and version) rewritten, and
+    its deleted posts dropped. Topic requests are conditional
+    (ETag/If-Modified-Since), so unchanged topics answer 304. Returns counts
+    of work done.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_sync_state(output_dir)
+    api = SyncSession(base_url, state['validators'], delay)
+    summary = {'topics': 0, 'posts': 0, 'latest_posts': 0}
+
+    newest = state['last_bumped_at']
+    try:
+        for topic in list(changed_topics(api, listing_path, state)):
+            summary['posts'] += sync_topic(api, topic, output_dir, state)
+            summary['topics'] += 1
+            if not newest or topic['bumped_at'] > newest:
+                newest = topic['bumped_at']
+            save_sync_state(output_dir, state)
+        summary['latest_posts'] = sync_latest_posts(api, output_dir, state)
+        state['last_bumped_at'] = newest
+    finally:
+        save_sync_state(output_dir, state)
+
+    print(f"Synced {summary['topics']} topics, {summary['posts']} posts")
+    return summary
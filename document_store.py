@@ -0,0 +1,236 @@
+"""
+Columnar in-memory document store.
+
+Instead of one str object per document plus dicts of per-document URLs and
+link lists, every document's text lives in one string blob and everything
+else in flat array columns indexed by doc_id. A lowercased copy of the blob
+is kept once, at the same offsets, for case-insensitive matching. URLs are
+interned into one table so repeated URLs cost one string. A document's
+sources are the other URLs its content was found at (see dedup.py).
+
+as_kb() returns Mapping views in the load_knowledge_base shape, so callers
+that index kb[section][fname] or kb["urls"][(section, fname)] keep working.
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+
+SECTIONS = ("course_content", "discourse_posts")
+NO_DATE = -1
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text without changing its length, so offsets stay valid"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # A few characters (e.g. "İ") lowercase to two code points; keep those as is
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class Document:
+    """Read-only view of one stored document"""
+
+    __slots__ = ("store", "doc_id")
+
+    def __init__(self, store: "DocumentStore", doc_id: int):
+        self.store = store
+        self.doc_id = doc_id
+
+    @property
+    def section(self) -> str:
+        return SECTIONS[self.store.section_ids[self.doc_id]]
+
+    @property
+    def fname(self) -> str:
+        return self.store.fnames[self.doc_id]
+
+    @property
+    def url(self):
+        return self.store.url(self.doc_id)
+
+    @property
+    def date(self):
+        """Unix timestamp, or None if unknown"""
+        return self.store.date(self.doc_id)
+
+    @property
+    def text(self) -> str:
+        return self.store.text_of(self.doc_id)
+
+    @property
+    def normalized(self) -> str:
+        return self.store.text_of(self.doc_id, normalized=True)
+
+    @property
+    def links(self) -> list:
+        return self.store.links_of(self.doc_id)
+
+    @property
+    def sources(self) -> list:
+        return self.store.sources_of(self.doc_id)
+
+    def __repr__(self):
+        return f"Document({self.section!r}, {self.fname!r})"
+
+
+class DocumentStore:
+    """Documents as columns indexed by doc_id"""
+
+    def __init__(self):
+        self.section_ids = array("B")
+        self.fnames = []
+        self.starts = array("q")
+        self.ends = array("q")
+        self.dates = array("q")
+        self.url_ids = array("l")
+        self.urls = []
+        # Link tables, flattened: doc_id's links are link_starts[doc_id]:link_starts[doc_id + 1]
+        self.link_starts = array("q", [0])
+        self.link_url_ids = array("l")
+        self.link_texts = []
+        self.link_offsets = array("q")
+        # Source URLs, flattened the same way
+        self.source_starts = array("q", [0])
+        self.source_url_ids = array("l")
+        self.text = ""
+        self.normalized = ""
+        self.ids = {section: {} for section in SECTIONS}
+        self._url_ids = {}
+
+    @classmethod
+    def build(cls, documents) -> "DocumentStore":
+        """Build a store from an iterable of (section, fname, text, url, date, links, sources)"""
+        store = cls()
+        parts = []
+        pos = 0
+        for section, fname, text, url, date, links, sources in documents:
+            doc_id = len(store.fnames)
+            store.ids[section][fname] = doc_id
+            store.section_ids.append(SECTIONS.index(section))
+            store.fnames.append(sys.intern(fname))
+            store.starts.append(pos)
+            pos += len(text)
+            store.ends.append(pos)
+            store.dates.append(NO_DATE if date is None else int(date))
+            store.url_ids.append(store._intern_url(url))
+            for link_url, link_text, offset in links:
+                store.link_url_ids.append(store._intern_url(link_url))
+                store.link_texts.append(sys.intern(link_text) if len(link_text) < 64 else link_text)
+                store.link_offsets.append(offset)
+            store.link_starts.append(len(store.link_offsets))
+            store.source_url_ids.extend(store._intern_url(source) for source in sources)
+            store.source_starts.append(len(store.source_url_ids))
+            parts.append(text)
+        store.text = "".join(parts)
+        del parts
+        store.normalized = normalize_text(store.text)
+        store._url_ids = None
+        return store
+
+    def _intern_url(self, url) -> int:
+        if url is None:
+            return -1
+        url_id = self._url_ids.get(url)
+        if url_id is None:
+            url_id = self._url_ids[url] = len(self.urls)
+            self.urls.append(sys.intern(url))
+        return url_id
+
+    def __len__(self):
+        return len(self.fnames)
+
+    def find(self, section: str, fname: str) -> int:
+        return self.ids[section][fname]
+
+    def document(self, doc_id: int) -> Document:
+        return Document(self, doc_id)
+
+    def __iter__(self):
+        return (Document(self, doc_id) for doc_id in range(len(self.fnames)))
+
+    def text_of(self, doc_id: int, start: int = 0, end: int = None, normalized: bool = False) -> str:
+        """Text of doc_id, or of its [start, end) span, sliced from the blob"""
+        base = self.starts[doc_id]
+        end = self.ends[doc_id] if end is None else base + end
+        return (self.normalized if normalized else self.text)[base + start:end]
+
+    def url(self, doc_id: int):
+        url_id = self.url_ids[doc_id]
+        return None if url_id < 0 else self.urls[url_id]
+
+    def date(self, doc_id: int):
+        date = self.dates[doc_id]
+        return None if date == NO_DATE else date
+
+    def links_of(self, doc_id: int) -> list:
+        """The document's [url, text, offset] link table, ordered by offset"""
+        return [
+            [self.urls[self.link_url_ids[i]], self.link_texts[i], self.link_offsets[i]]
+            for i in range(self.link_starts[doc_id], self.link_starts[doc_id + 1])
+        ]
+
+    def sources_of(self, doc_id: int) -> list:
+        """Other URLs the document's content was also found at"""
+        return [self.urls[self.source_url_ids[i]]
+                for i in range(self.source_starts[doc_id], self.source_starts[doc_id + 1])]
+
+    def as_kb(self) -> dict:
+        """Mapping views in the load_knowledge_base shape"""
+        kb = {section: StoreSection(self, section) for section in SECTIONS}
+        kb["urls"] = StoreColumn(self, self.url)
+        kb["links"] = StoreColumn(self, self.links_of)
+        kb["dates"] = StoreColumn(self, self.date)
+        kb["sources"] = StoreColumn(self, self.sources_of)
+        return kb
+
+
+class StoreSection(Mapping):
+    """fname -> text view of one section"""
+
+    def __init__(self, store: DocumentStore, section: str):
+        self.store = store
+        self.section = section
+        self._ids = store.ids[section]
+
+    def __getitem__(self, fname: str) -> str:
+        return self.store.text_of(self._ids[fname])
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def normalized_text(section: Mapping, fname: str, start: int = 0, end: int = None) -> str:
+    """Lowercased text of a document (span), from the store's normalized column if it is stored there.
+
+    section may be a StoreSection or an OverlaySection over one; files the
+    overlay changed, and other section types, are normalized on the fly.
+    """
+    base = getattr(section, "base", section)
+    if isinstance(base, StoreSection) and fname not in getattr(section, "changes", ()):
+        return base.store.text_of(base._ids[fname], start, end, normalized=True)
+    return normalize_text(section[fname][start:end])
+
+
+class StoreColumn(Mapping):
+    """(section, fname) -> value view of a per-document column"""
+
+    def __init__(self, store: DocumentStore, getter):
+        self.store = store
+        self.getter = getter
+
+    def __getitem__(self, key: tuple):
+        section, fname = key
+        return self.getter(self.store.ids[section][fname])
+
+    def __iter__(self):
+        for section in SECTIONS:
+            for fname in self.store.ids[section]:
+                yield section, fname
+
+    def __len__(self):
+        return len(self.store)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+HTML parsing for the Discourse scrapers.
+
+Topic and listing pages are parsed with the fastest backend available:
+selectolax (lexbor), else BeautifulSoup on lxml, else BeautifulSoup on the
+stdlib html.parser. BeautifulSoup only builds the nodes the extractors read
+(topic posts, topic rows and links), via SoupStrainers. Every backend returns
+the same structures.
+
+Parsing is CPU-bound, so crawls run it in a ParserPool of worker processes
+that take raw page bytes and return plain dicts. To time the backends over
+saved pages:
+
+    python html_parsing.py pages/*.html --backend lxml --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+BACKENDS = ("selectolax", "lxml", "html.parser")
+# "auto" picks the first installed backend in BACKENDS
+HTML_PARSER = os.getenv("HTML_PARSER", "auto")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+TOPIC_STRAINER = SoupStrainer('div', class_=['topic-container', 'topic-post'])
+LIST_STRAINER = SoupStrainer(['tr', 'a', 'span', 'link'])
+
+DROP_TAGS = ('script', 'style', 'iframe', 'nav')
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+TOPIC_ID_RE = re.compile(r'/t/[^/]+/(\d+)')
+
+
+def resolve_backend(name: str = None) -> str:
+    name = name or HTML_PARSER
+    if name == "auto":
+        if LexborHTMLParser is not None:
+            return "selectolax"
+        return "lxml" if lxml is not None else "html.parser"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown HTML parser {name!r}, expected one of {', '.join(BACKENDS)} or auto")
+    if (name == "selectolax" and LexborHTMLParser is None) or (name == "lxml" and lxml is None):
+        raise ValueError(f"HTML parser {name!r} is not installed")
+    return name
+
+
+BACKEND = resolve_backend()
+
+
+def make_soup(html, parse_only: SoupStrainer = None, backend: str = None) -> BeautifulSoup:
+    """BeautifulSoup of html (str or raw bytes) on lxml if available, else html.parser"""
+    builder = "lxml" if resolve_backend(backend) != "html.parser" and lxml is not None else "html.parser"
+    return BeautifulSoup(html, builder, parse_only=parse_only)
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_topic(html, backend: str = None) -> dict:
+    """Extract the title and every post from a topic page's HTML (str or bytes)"""
+    if resolve_backend(backend) == "selectolax":
+        return _parse_topic_lexbor(html)
+
+    soup = make_soup(html, TOPIC_STRAINER, backend)
+    topic_data = {
+        'posts': []
+    }
+
+    topic_container = soup.find('div', class_='topic-container')
+    if topic_container:
+        title = topic_container.find('h1')
+        topic_data['title'] = title.text.strip() if title else ""
+
+    for post in soup.find_all('div', class_='topic-post'):
+        post_data = {
+            'author': post.get('data-username', ''),
+            'post_number': post.get('data-post-number', ''),
+            'content': "",
+            'links': []
+        }
+
+        content = post.find('div', class_='post')
+        if content:
+            for element in content(DROP_TAGS):
+                element.decompose()
+            # Quoted earlier replies duplicate the posts they quote
+            for element in content.select('aside.quote, blockquote'):
+                element.decompose()
+
+            post_data['content'] = content.get_text(' ', strip=True)
+            for link in content.find_all('a', href=True):
+                post_data['links'].append({
+                    'text': link.get_text(strip=True),
+                    'url': link['href']
+                })
+
+        topic_data['posts'].append(post_data)
+
+    return topic_data
+
+
+def parse_topic_list(html, page_url: str, backend: str = None):
+    """Extract topics from a category page.
+
+    Returns (topics, next_url) where each topic is a dict with title, url,
+    topic_id and date (a datetime, or None if the page has no timestamp),
+    and next_url is the next listing page if there is one.
+    """
+    if resolve_backend(backend) == "selectolax":
+        return _parse_topic_list_lexbor(html, page_url)
+
+    soup = make_soup(html, LIST_STRAINER, backend)
+    topics = []
+    seen = set()
+
+    rows = [row for row in soup.find_all('tr') if 'data-topic-id' in row.attrs]
+    candidates = rows or soup.select('a.title, a.topic-title')
+    for topic in candidates:
+        if topic.name == 'tr':
+            title_link = topic.find('a', class_='title') or topic.find('a', class_='topic-title')
+            date_span = topic.find('span', class_='relative-date') or topic.find('span', class_='post-time')
+        else:
+            title_link = topic
+            date_span = topic.find_next('span', class_='relative-date')
+        if not title_link or not title_link.get('href'):
+            continue
+
+        url = urljoin(page_url, title_link['href'])
+        if url in seen:
+            continue
+        seen.add(url)
+
+        match = TOPIC_ID_RE.search(url)
+        topics.append({
+            'title': title_link.text.strip(),
+            'url': url,
+            'topic_id': topic.get('data-topic-id') or (match.group(1) if match else None),
+            'date': parse_date(date_span.get('title')) if date_span else None
+        })
+
+    next_link = soup.find(['a', 'link'], rel='next', href=True)
+    next_url = urljoin(page_url, next_link['href']) if next_link else None
+    return topics, next_url
+
+
+def _lexbor_tree(html):
+    if isinstance(html, bytes):
+        # Discourse always serves UTF-8
+        html = html.decode('utf-8', 'replace')
+    return LexborHTMLParser(html)
+
+
+def _lexbor_text(node, separator: str = ' ') -> str:
+    """node's text like BeautifulSoup's get_text(separator, strip=True)"""
+    strings = (child.text_content.strip() for child in node.traverse(include_text=True) if child.tag == '-text')
+    return separator.join(s for s in strings if s)
+
+
+def _parse_topic_lexbor(html) -> dict:
+    tree = _lexbor_tree(html)
+    topic_data = {
+        'posts': []
+    }
+
+    topic_container = tree.css_first('div.topic-container')
+    if topic_container:
+        title = topic_container.css_first('h1')
+        topic_data['title'] = title.text().strip() if title else ""
+
+    for post in tree.css('div.topic-post'):
+        attributes = post.attributes
+        post_data = {
+            'author': attributes.get('data-username') or '',
+            'post_number': attributes.get('data-post-number') or '',
+            'content': "",
+            'links': []
+        }
+
+        content = post.css_first('div.post')
+        if content:
+            # Innermost first, so no node is decomposed after its ancestor
+            for element in reversed(content.css(', '.join(DROP_TAGS) + ', aside.quote, blockquote')):
+                element.decompose()
+
+            post_data['content'] = _lexbor_text(content)
+            for link in content.css('a[href]'):
+                post_data['links'].append({
+                    'text': _lexbor_text(link, ''),
+                    'url': link.attributes['href']
+                })
+
+        topic_data['posts'].append(post_data)
+
+    return topic_data
+
+
+def _parse_topic_list_lexbor(html, page_url: str):
+    tree = _lexbor_tree(html)
+    topics = []
+    seen = set()
+
+    rows = tree.css('tr[data-topic-id]')
+    if rows:
+        candidates = []
+        for row in rows:
+            title_link = row.css_first('a.title') or row.css_first('a.topic-title')
+            date_span = row.css_first('span.relative-date') or row.css_first('span.post-time')
+            candidates.append((row, title_link, date_span))
+    else:
+        # In document order, so each link's date is the next relative-date span
+        candidates = []
+        next_date = None
+        for node in reversed(tree.css('a.title, a.topic-title, span.relative-date')):
+            if node.tag == 'span':
+                next_date = node
+            else:
+                candidates.append((node, node, next_date))
+        candidates.reverse()
+
+    for topic, title_link, date_span in candidates:
+        if not title_link or not title_link.attributes.get('href'):
+            continue
+
+        url = urljoin(page_url, title_link.attributes['href'])
+        if url in seen:
+            continue
+        seen.add(url)
+
+        match = TOPIC_ID_RE.search(url)
+        topics.append({
+            'title': title_link.text().strip(),
+            'url': url,
+            'topic_id': topic.attributes.get('data-topic-id') or (match.group(1) if match else None),
+            'date': parse_date(date_span.attributes.get('title')) if date_span else None
+        })
+
+    next_link = tree.css_first('a[rel~="next"][href], link[rel~="next"][href]')
+    next_url = urljoin(page_url, next_link.attributes['href']) if next_link else None
+    return topics, next_url
+
+
+def parse_page(kind: str, content, url: str = None, backend: str = None):
+    """Parse one raw page: a "topic" page to its topic dict, a "list" page to (topics, next_url)"""
+    if kind == 'list':
+        return parse_topic_list(content, url, backend)
+    return parse_topic(content, backend)
+
+
+class ParserPool:
+    """Parses raw pages in worker processes, off the event loop and the GIL.
+
+    workers=0 parses inline, which is cheaper for small crawls.
+    """
+
+    def __init__(self, workers: int = None, backend: str = None):
+        self.workers = PARSE_WORKERS if workers is None else workers
+        self.backend = resolve_backend(backend)
+        self.executor = ProcessPoolExecutor(self.workers) if self.workers > 0 else None
+
+    async def parse(self, kind: str, content, url: str = None):
+        if self.executor is None:
+            return parse_page(kind, content, url, self.backend)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, parse_page, kind, content, url, self.backend)
+
+    def map(self, pages, chunksize: int = 8):
+        """parse_page over an iterable of (kind, content, url), in order"""
+        if self.executor is None:
+            return (parse_page(kind, content, url, self.backend) for kind, content, url in pages)
+        pages = list(pages)
+        if not pages:
+            return []
+        kinds, contents, urls = zip(*pages)
+        return self.executor.map(parse_page, kinds, contents, urls, [self.backend] * len(pages),
+                                 chunksize=chunksize)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse saved Discourse pages and report throughput')
+    parser.add_argument('files', nargs='+', help='Saved topic (or, with --list, listing) HTML pages')
+    parser.add_argument('--list', action='store_true', help='Parse the files as topic listing pages')
+    parser.add_argument('--backend', default=HTML_PARSER, help=f'auto, {", ".join(BACKENDS)}')
+    parser.add_argument('--workers', '-w', type=int, default=PARSE_WORKERS,
+                       help='Parser processes (0 parses in this process)')
+    args = parser.parse_args()
+
+    kind = 'list' if args.list else 'topic'
+    pages = []
+    for path in args.files:
+        with open(path, 'rb') as f:
+            pages.append((kind, f.read(), 'https://discourse.onlinedegree.iitm.ac.in/'))
+
+    with ParserPool(args.workers, args.backend) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(pages))
+        elapsed = time.perf_counter() - start
+
+    if args.list:
+        items = f"{sum(len(topics) for topics, _ in results)} topics"
+    else:
+        items = f"{sum(len(result['posts']) for result in results)} posts"
+    megabytes = sum(len(content) for _, content, _ in pages) / 1e6
+    print(f"{pool.backend}: {len(pages)} pages ({megabytes:.1f} MB, {items}) in {elapsed:.2f}s, "
+          f"{len(pages) / elapsed:.1f} pages/s with {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Hybrid retrieval: BM25 and embedding search run side by side and fused with
+reciprocal-rank fusion, then optionally rescored by a reranker.
+
+BM25 catches exact identifiers ("GA4", "gpt-3.5-turbo-0125") that embeddings
+blur; embeddings catch paraphrases that share no terms with the question.
+RRF needs no score calibration between the two, only ranks.
+"""
+
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from search_index import tokenize
+
+RRF_K = int(os.getenv("RRF_K", "60"))
+# "off", "heuristic", or a sentence-transformers cross-encoder model name
+RERANKER = os.getenv("RERANKER", "off")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "30"))
+
+IDENTIFIER_RE = re.compile(r'[a-z]+[\w.-]*\d[\w.-]*|\d+[\w.-]*[a-z][\w.-]*', re.IGNORECASE)
+
+# The dense search is mostly a NumPy matmul, which releases the GIL, so it
+# overlaps with the pure-Python BM25 search running in the caller's thread
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """Fuse ranked [(key, score)] lists into one by sum of 1 / (k + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking, 1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def filter_ranked(index, ranked: list, filters: dict) -> list:
+    """Drop (key, score) pairs whose passage fails the index's metadata filters.
+
+    For rankings that don't come from the inverted index itself, i.e. dense
+    search, which can only filter after the fact.
+    """
+    if not filters:
+        return ranked
+    keys = index.filter_keys([key for key, _ in ranked], filters)
+    return [(key, score) for key, score in ranked if key in keys]
+
+
+def hybrid_search(index, vectors, query: str, top_k: int = 20, candidates: int = None, filters: dict = None) -> list:
+    """Run BM25 and vector search concurrently and return the fused top_k"""
+    return hybrid_search_many(index, vectors, [query], top_k, candidates, [filters])[0]
+
+
+def hybrid_search_many(index, vectors, queries: list, top_k: int = 20, candidates: int = None,
+                       filters: list = None) -> list:
+    """hybrid_search for many queries, with the dense side as one batched search"""
+    candidates = candidates or top_k * 2
+    filters = filters or [None] * len(queries)
+    # Dense results are filtered afterwards, so over-fetch when there are filters
+    dense = _executor.submit(vectors.search_many, queries, candidates * (5 if any(filters) else 1))
+    lexical = [index.search(query, candidates, query_filters) for query, query_filters in zip(queries, filters)]
+    return [
+        reciprocal_rank_fusion([ranked, filter_ranked(index, dense_ranked, query_filters)[:candidates]])[:top_k]
+        for ranked, dense_ranked, query_filters in zip(lexical, dense.result(), filters)
+    ]
+
+
+class HeuristicReranker:
+    """Cheap lexical rescoring: query-term coverage, phrase overlap and exact identifiers.
+
+    Scores lie in [0, 1]. Runs in microseconds per passage, so it fits any
+    reasonable budget without a model. Expects already-lowercased passages.
+    """
+
+    name = "heuristic"
+    normalized_input = True
+
+    def score(self, query: str, texts: list) -> list:
+        terms = tokenize(query)
+        unique = set(terms)
+        bigrams = set(zip(terms, terms[1:]))
+        identifiers = {m.group(0).lower().strip(".-") for m in IDENTIFIER_RE.finditer(query)}
+
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            present = set(tokens)
+            coverage = len(unique & present) / len(unique) if unique else 0.0
+            phrase = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            exact = sum(1 for ident in identifiers if ident in text) / len(identifiers) if identifiers else 0.0
+            scores.append(0.5 * coverage + 0.3 * phrase + 0.2 * exact)
+        return scores
+
+
+class CrossEncoderReranker:
+    """Reranker backed by a locally cached sentence-transformers cross-encoder"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model_name
+        self.model = CrossEncoder(model_name)
+
+    def score(self, query: str, texts: list) -> list:
+        logits = self.model.predict([(query, text) for text in texts])
+        return [1 / (1 + math.exp(-float(logit))) for logit in logits]
+
+
+def get_reranker(name: str = RERANKER):
+    """Return the reranker registered under name, or None for "off" """
+    if not name or name == "off":
+        return None
+    if name == "heuristic":
+        return HeuristicReranker()
+    return CrossEncoderReranker(name)
+
+
+def rerank(reranker, query: str, ranked: list, text_of, top_n: int = RERANK_TOP_N,
+           budget_ms: float = RERANK_BUDGET_MS, batch_size: int = 8) -> list:
+    """Rescore the head of ranked [(key, score)] within budget_ms.
+
+    Candidates are scored in batches from the top until the budget runs out;
+    the scored prefix is reordered by score + |score| * rerank score and the
+    rest keeps its order. Rerank scores lie in [0, 1], so the blend never drops
+    below the original score, even for the negative cosines of semantic mode,
+    and the list stays sorted by score across the boundary.
+    """
+    deadline = time.perf_counter() + budget_ms / 1000
+    head = ranked[:top_n]
+    scored = []
+    for i in range(0, len(head), batch_size):
+        batch = head[i:i + batch_size]
+        rerank_scores = reranker.score(query, [text_of(key) for key, _ in batch])
+        scored += [(key, score + abs(score) * rerank_score) for (key, score), rerank_score in zip(batch, rerank_scores)]
+        if time.perf_counter() > deadline:
+            break
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored + ranked[len(scored):]
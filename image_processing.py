@@ -0,0 +1,104 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+IMAGE_TARGET_SIZE = int(os.getenv("IMAGE_TARGET_SIZE", "1024"))
+# "vision": forward the downscaled image to the model; "ocr": extract text
+# locally with pytesseract; "off": ignore images
+IMAGE_MODE = os.getenv("IMAGE_MODE", "vision")
+
+# Refuse decompression bombs while decoding, not after
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageError(ValueError):
+    """The request's image is missing, too large or not decodable"""
+
+
+def decode_base64_image(data: str) -> bytes:
+    """Decode a base64 (or data: URI) image, refusing oversized payloads before decoding"""
+    if data.startswith("data:"):
+        data = data.partition(",")[2]
+    if len(data) * 3 // 4 > MAX_IMAGE_BYTES:
+        raise ImageError(f"Image larger than {MAX_IMAGE_BYTES} bytes")
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageError("Image is not valid base64")
+
+
+def prepare_image(raw: bytes, mode: str = IMAGE_MODE) -> dict:
+    """Downscale and re-encode an image, and OCR it in "ocr" mode.
+
+    Dimensions are checked from the header before any pixels are decoded,
+    and JPEGs are decoded straight at reduced scale via draft().
+    """
+    try:
+        image = Image.open(io.BytesIO(raw))
+        width, height = image.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageError(f"Image has more than {MAX_IMAGE_PIXELS} pixels")
+        image.draft("RGB", (IMAGE_TARGET_SIZE, IMAGE_TARGET_SIZE))
+        image = image.convert("RGB")
+    except ImageError:
+        raise
+    except Exception as e:
+        raise ImageError(f"Could not decode image: {str(e)}")
+    image.thumbnail((IMAGE_TARGET_SIZE, IMAGE_TARGET_SIZE))
+
+    result = {"size": [width, height], "data_url": None, "text": None}
+    if mode == "ocr" and pytesseract is not None:
+        result["text"] = pytesseract.image_to_string(image).strip()
+    else:
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=85, optimize=True)
+        result["data_url"] = "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+    return result
+
+
+class ImageProcessor:
+    """Runs prepare_image in a worker pool and caches results by content hash.
+
+    Pillow releases the GIL while decoding and resizing, so a thread pool
+    keeps the event loop free without pickling images across processes.
+    """
+
+    def __init__(self, workers: int = 2, max_entries: int = 64, mode: str = IMAGE_MODE):
+        self.mode = mode
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def process(self, data: str) -> dict:
+        """Return {"hash", "size", "data_url", "text"} for a base64 image"""
+        raw = decode_base64_image(data)
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, prepare_image, raw, self.mode)
+        result["hash"] = digest
+        with self._lock:
+            self._cache[digest] = result
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
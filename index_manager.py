@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+from knowledge_base import (
+    COURSE_DIR, DISCOURSE_DIR, extract_date, extract_link_table, extract_source_url, list_documents,
+    list_records, read_records, split_passages
+)
+from document_store import SECTIONS, DocumentStore
+from metadata_index import document_metadata, passage_metadata
+
+# Fold overlays back into the base once they hold this many files, or this
+# share of the base, whichever is more
+OVERLAY_COMPACT_MIN = int(os.getenv("KB_OVERLAY_COMPACT_MIN", "256"))
+OVERLAY_COMPACT_RATIO = float(os.getenv("KB_OVERLAY_COMPACT_RATIO", "0.1"))
+
+
+class OverlaySection(Mapping):
+    """fname -> text view of a base section with changed/deleted files on top.
+
+    Works over a plain dict, an mmap'd ArtifactSection or a StoreSection
+    without copying it; a None in changes marks a deleted file. The same
+    view overlays the (section, fname)-keyed urls, links, dates and sources
+    tables.
+    """
+
+    def __init__(self, base: Mapping, changes: dict):
+        self.base = base
+        self.changes = changes
+
+    @classmethod
+    def extend(cls, section: Mapping, changes: dict) -> "OverlaySection":
+        if isinstance(section, OverlaySection):
+            return cls(section.base, {**section.changes, **changes})
+        return cls(section, changes)
+
+    def __getitem__(self, fname: str) -> str:
+        if fname in self.changes:
+            text = self.changes[fname]
+            if text is None:
+                raise KeyError(fname)
+            return text
+        return self.base[fname]
+
+    def __iter__(self):
+        for fname in self.base:
+            if fname not in self.changes:
+                yield fname
+        for fname, text in self.changes.items():
+            if text is not None:
+                yield fname
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def compact_documents(kb: dict) -> dict:
+    """Fold a snapshot's overlaid sections and columns into one fresh DocumentStore.
+
+    O(corpus), so only done once the overlays pass OVERLAY_COMPACT_*; keys
+    and texts are unchanged, so the snapshot's index stays valid.
+    """
+    dates = kb.get("dates", {})
+    sources = kb.get("sources", {})
+
+    def documents():
+        for section in SECTIONS:
+            for fname in kb[section]:
+                key = (section, fname)
+                yield (section, fname, kb[section][fname], kb["urls"].get(key), dates.get(key),
+                       kb["links"].get(key) or [], sources.get(key) or [])
+
+    return DocumentStore.build(documents()).as_kb()
+
+
+class IndexManager:
+    """Holds the current knowledge-base snapshot and applies file deltas to it.
+
+    A snapshot is the dict returned by load_knowledge_base. Updates build a
+    new snapshot from the old one (copy-on-write index, overlay sections)
+    and publish it with a single reference assignment, so requests that
+    already hold the old snapshot finish on it undisturbed. Work per update
+    is proportional to the changed files: the index and vectors add a
+    segment and tombstones, and sections get an overlay. Overlays are folded
+    back into a fresh store, and segments merged, once they grow past their
+    thresholds, so those O(corpus) steps are amortized over many updates.
+    """
+
+    def __init__(self, kb: dict, course_dir: str = COURSE_DIR, discourse_dir: str = DISCOURSE_DIR,
+                 records_dir: str = None):
+        self.current = kb
+        self.version = 0
+        self.course_dir = course_dir
+        self.discourse_dir = discourse_dir
+        # Set when the snapshot was loaded from ingested records: watch those instead
+        self.records_dir = records_dir
+        self._lock = threading.RLock()
+        self._stamps = None
+        self._digests = {}
+        self._watcher = None
+
+    def scan(self) -> dict:
+        """(section, fname) -> (mtime_ns, size) for every file in the data directories.
+
+        In records mode, JSONL file name -> (mtime_ns, size) instead.
+        """
+        if self.records_dir is not None:
+            paths = ((fname, os.path.join(self.records_dir, fname)) for fname in list_records(self.records_dir))
+        else:
+            paths = (((section, fname), path)
+                     for section, fname, path in list_documents(self.course_dir, self.discourse_dir))
+        stamps = {}
+        for key, path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stamps[key] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def _read_records(self, name: str):
+        """({(section, id): digest}, {(section, id): (text, url, date, links, sources)}) of one JSONL file"""
+        digests = {}
+        records = {}
+        try:
+            for section, fname, *value in read_records(os.path.join(self.records_dir, name)):
+                value = tuple(value)
+                digests[(section, fname)] = hashlib.blake2b(
+                    json.dumps(value, ensure_ascii=False).encode("utf-8"), digest_size=16
+                ).digest()
+                records[(section, fname)] = value
+        except FileNotFoundError:
+            pass
+        return digests, records
+
+    def _file_changes(self, stamps: dict, previous: dict):
+        changes = {}
+        summary = {"added": 0, "changed": 0, "deleted": 0}
+        for key, stamp in stamps.items():
+            if key not in previous or previous[key] != stamp:
+                section, fname = key
+                path = os.path.join(self.course_dir if section == "course_content" else self.discourse_dir, fname)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        changes[key] = f.read()
+                except FileNotFoundError:
+                    changes[key] = None
+                summary["added" if key not in previous else "changed"] += 1
+        for key in previous.keys() - stamps.keys():
+            changes[key] = None
+            summary["deleted"] += 1
+        return changes, summary, self._digests
+
+    def _record_changes(self, stamps: dict, previous: dict):
+        """Re-read the JSONL files whose stamp changed and diff their records by key and digest"""
+        digests = dict(self._digests)
+        old = {}
+        new = {}
+        records = {}
+        for name in stamps.keys() | previous.keys():
+            if stamps.get(name) != previous.get(name):
+                old.update(digests.pop(name, {}))
+                file_digests, file_records = self._read_records(name)
+                if name in stamps:
+                    digests[name] = file_digests
+                new.update(file_digests)
+                records.update(file_records)
+
+        changes = {}
+        summary = {"added": 0, "changed": 0, "deleted": 0}
+        for key, digest in new.items():
+            if old.get(key) != digest:
+                changes[key] = records[key]
+                summary["added" if key not in old else "changed"] += 1
+        for key in old.keys() - new.keys():
+            # A record that only moved to an unchanged file is still there
+            if not any(key in file_digests for file_digests in digests.values()):
+                changes[key] = None
+                summary["deleted"] += 1
+        return changes, summary, digests
+
+    def refresh(self) -> dict:
+        """Diff the data directories (or, in records mode, the records) against the last scan and apply the delta.
+
+        The first call only records a baseline, taken to match the snapshot
+        loaded at startup; in records mode that reads every record once.
+        """
+        with self._lock:
+            stamps = self.scan()
+            previous = self._stamps
+            if previous is None:
+                if self.records_dir is not None:
+                    self._digests = {name: self._read_records(name)[0] for name in stamps}
+                self._stamps = stamps
+                return {"added": 0, "changed": 0, "deleted": 0, "version": self.version}
+
+            if self.records_dir is not None:
+                changes, summary, digests = self._record_changes(stamps, previous)
+            else:
+                changes, summary, digests = self._file_changes(stamps, previous)
+            if changes:
+                self.apply(changes)
+            # Only advance the baseline once the delta is live
+            self._stamps = stamps
+            self._digests = digests
+            summary["version"] = self.version
+            return summary
+
+    def apply(self, changes: dict) -> dict:
+        """Apply {(section, fname): new text or None} and publish a new snapshot.
+
+        A value may also be a (text, url, date, links, sources) record, whose fields
+        are used instead of extracting them from the text.
+        """
+        with self._lock:
+            old = self.current
+            index = old["index"].copy()
+            urls = {}
+            links = {}
+            dates = {}
+            sources = {}
+            texts = {}
+            section_changes = {"course_content": {}, "discourse_posts": {}}
+
+            for key, value in changes.items():
+                section, fname = key
+                # Tombstone the file's old passages; the new ones go to a fresh segment
+                index.remove_group(key)
+                if isinstance(value, str):
+                    value = (value, extract_source_url(value), extract_date(value), extract_link_table(value), [])
+                text, urls[key], dates[key], links[key], sources[key] = value or (None,) * 5
+                texts[key] = text
+                if text is not None:
+                    document = document_metadata(text, urls[key], dates[key])
+                    for start, end in split_passages(text):
+                        index.add_document((section, fname, start, end), text[start:end], key,
+                                           passage_metadata(document, text, start, end))
+                section_changes[section][fname] = text
+            index.compact()
+
+            new = dict(old)
+            new["index"] = index
+            new["urls"] = OverlaySection.extend(old["urls"], urls)
+            new["links"] = OverlaySection.extend(old["links"], links)
+            for column, column_delta in [("dates", dates), ("sources", sources)]:
+                if column in old:
+                    new[column] = OverlaySection.extend(old[column], column_delta)
+            for section, section_delta in section_changes.items():
+                if section_delta:
+                    new[section] = OverlaySection.extend(old[section], section_delta)
+            if any(self._overlay_full(new[section]) for section in SECTIONS):
+                new.update(compact_documents(new))
+            if "vectors" in old:
+                new["vectors"] = old["vectors"].updated(texts)
+
+            self.current = new
+            self.version += 1
+            return new
+
+    @staticmethod
+    def _overlay_full(section: Mapping) -> bool:
+        if not isinstance(section, OverlaySection):
+            return False
+        return len(section.changes) > max(OVERLAY_COMPACT_MIN, OVERLAY_COMPACT_RATIO * len(section.base))
+
+    def watch(self, interval: float):
+        """Poll the data directories (or records) every interval seconds in a daemon thread"""
+        if self._watcher is not None:
+            return
+        self.refresh()
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    summary = self.refresh()
+                    if summary["added"] or summary["changed"] or summary["deleted"]:
+                        print(f"Knowledge base reloaded: {summary}")
+                except Exception as e:
+                    print(f"Knowledge base reload failed: {str(e)}")
+
+        self._watcher = threading.Thread(target=loop, name="kb-watcher", daemon=True)
+        self._watcher.start()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Knowledge-base compiler.
+
+Compiles the ingested records (or ./data/course_content and
+./data/discourse_posts if there are none) into one binary artifact so the
+API can mmap it at cold start instead of walking and reading every file. Build it with:
+
+    python kb_compiler.py --output data/kb.bin
+
+Layout:
+
+    magic | header (TOC position and length, uint64) | sections | TOC JSON
+
+Every section is a flat little-endian array (or UTF-8 blob) that load_artifact
+wraps in a memoryview of the mapping, so loading reads only the small TOC and
+worker processes share the pages. Documents are stored sorted by
+"section\0fname": names, texts and per-document metadata (url, date, link
+table, sources) are blobs with offset arrays, looked up by bisect. The inverted index
+is stored as one segment: a sorted term table with offsets into doc id and
+term frequency arrays, the passage tables, each document's passage range and
+the metadata columns with their sorted views. Nothing is unpickled.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+from document_store import SECTIONS
+from knowledge_base import extract_date, extract_link_table, extract_source_url, load_documents
+from metadata_index import MetadataColumns
+from search_index import InvertedIndex, build_index
+
+MAGIC = b"TDSKB\x00\x00\x04"
+HEADER = struct.Struct("<2Q")  # TOC pos/len
+DATA_START = len(MAGIC) + HEADER.size
+
+
+def _file_key(section: str, fname: str) -> bytes:
+    return f"{section}\0{fname}".encode("utf-8")
+
+
+class _Writer:
+    """Appends 8-byte aligned sections to the artifact and records them in the TOC"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+
+    def _align(self):
+        self.f.write(b"\x00" * (-self.f.tell() % 8))
+
+    def array(self, name: str, typecode: str, values):
+        data = values if isinstance(values, array) and values.typecode == typecode else array(typecode, values)
+        self._align()
+        self.sections[name] = [self.f.tell(), len(data), typecode]
+        data.tofile(self.f)
+
+    def strings(self, name: str, values):
+        """UTF-8 blob of values back to back, plus a name + "_offsets" array of len(values) + 1"""
+        offsets = array("q", [0])
+        self._align()
+        pos = self.f.tell()
+        for value in values:
+            data = value if isinstance(value, bytes) else value.encode("utf-8")
+            self.f.write(data)
+            offsets.append(offsets[-1] + len(data))
+        self.sections[name] = [pos, offsets[-1], "B"]
+        self.array(name + "_offsets", "q", offsets)
+
+
+def compile_knowledge_base(kb: dict, output_path: str):
+    """Write the knowledge base and its inverted index to output_path"""
+    files = sorted((_file_key(section, fname), section, fname) for section in SECTIONS for fname in kb[section])
+    urls = kb.get("urls", {})
+    links = kb.get("links", {})
+    dates = kb.get("dates", {})
+    sources = kb.get("sources", {})
+
+    # Index the documents in artifact order, so each one's passages are one local id range
+    ordered = {section: {} for section in SECTIONS}
+    ordered["urls"] = {}
+    ordered["dates"] = {}
+    metadata = []
+    for _, section, fname in files:
+        content = kb[section][fname]
+        url = urls.get((section, fname)) or extract_source_url(content)
+        date = dates.get((section, fname))
+        date = extract_date(content) if date is None else date
+        ordered[section][fname] = content
+        ordered["urls"][(section, fname)] = url
+        ordered["dates"][(section, fname)] = date
+        metadata.append(json.dumps({
+            "url": url,
+            "date": date,
+            "links": links.get((section, fname)) or extract_link_table(content),
+            "sources": sources.get((section, fname)) or []
+        }, ensure_ascii=False))
+    index = build_index(ordered)
+    segment = index.segments[0] if index.segments else None
+
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + HEADER.pack(0, 0))
+        out = _Writer(f)
+        out.strings("names", (key for key, _, _ in files))
+        out.strings("texts", (ordered[section][fname] for _, section, fname in files))
+        out.strings("metadata", metadata)
+
+        toc = {"k1": index.k1, "b": index.b, "terms": [], "authors": [], "total_length": 0}
+        if segment is not None:
+            terms = sorted(segment.postings, key=lambda term: term.encode("utf-8"))
+            out.strings("terms", terms)
+            starts = array("q", [0])
+            post_docs = array("I")
+            post_tfs = array("I")
+            for term in terms:
+                postings = segment.postings[term]
+                post_docs.extend(postings)
+                post_tfs.extend(postings.values())
+                starts.append(len(post_docs))
+            out.array("postings_offsets", "q", starts)
+            out.array("postings_docs", "I", post_docs)
+            out.array("postings_tfs", "I", post_tfs)
+
+            file_ids = {(section, fname): file_id for file_id, (_, section, fname) in enumerate(files)}
+            out.array("doc_files", "q", (file_ids[key[:2]] for key in segment.doc_keys))
+            out.array("doc_starts", "q", (key[2] for key in segment.doc_keys))
+            out.array("doc_ends", "q", (key[3] for key in segment.doc_keys))
+            out.array("doc_lengths", "q", segment.doc_lengths)
+            passages = array("q", [0])
+            for _, section, fname in files:
+                passages.append(passages[-1] + len(segment.groups.get((section, fname), ())))
+            out.array("file_passages", "q", passages)
+
+            for name in MetadataColumns.COLUMNS:
+                out.array("meta_" + name, "q", getattr(segment.meta, name))
+            for name, values in segment.meta.sorted_views().items():
+                out.array("meta_" + name, "q", values)
+            toc.update(terms=segment.meta.terms, authors=segment.meta.authors, total_length=segment.total_length)
+
+        toc["sections"] = out.sections
+        toc_pos = f.tell()
+        data = json.dumps(toc, ensure_ascii=False).encode("utf-8")
+        f.write(data)
+        f.seek(len(MAGIC))
+        f.write(HEADER.pack(toc_pos, len(data)))
+
+    # Replace atomically so running workers never see a half-written file
+    os.replace(tmp_path, output_path)
+    return len(files)
+
+
+class StringTable:
+    """Sequence of the UTF-8 strings in a blob section, as bytes, with bisect lookup"""
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def raw(self, i: int) -> memoryview:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+    def find(self, value: bytes, lo: int = 0, hi: int = None) -> int:
+        """Position of value, or -1"""
+        hi = len(self) if hi is None else hi
+        i = bisect.bisect_left(self, value, lo, hi)
+        return i if i < hi and self[i] == value else -1
+
+
+class Artifact:
+    """A mapped artifact's sections, as memoryviews"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled knowledge base (or was compiled by another version)")
+        if sys.byteorder != "little":
+            raise ValueError("compiled knowledge bases are little-endian and can't be mapped on this machine")
+        buffer = memoryview(mm)
+        toc_pos, toc_len = HEADER.unpack_from(mm, len(MAGIC))
+        self.toc = json.loads(str(buffer[toc_pos:toc_pos + toc_len], "utf-8"))
+        self.buffer = buffer
+        self.names = self.strings("names")
+        self.texts = self.strings("texts")
+        self.metadata = self.strings("metadata")
+
+    def array(self, name: str) -> memoryview:
+        pos, count, typecode = self.toc["sections"][name]
+        view = self.buffer[pos:pos + count * array(typecode).itemsize]
+        return view if typecode == "B" else view.cast(typecode)
+
+    def strings(self, name: str) -> StringTable:
+        return StringTable(self.array(name), self.array(name + "_offsets"))
+
+    def file_id(self, section: str, fname: str) -> int:
+        return self.names.find(_file_key(section, fname))
+
+    def file_key(self, file_id: int) -> tuple:
+        section, fname = self.names[file_id].decode("utf-8").split("\0", 1)
+        return section, fname
+
+    def section_range(self, section: str) -> tuple:
+        prefix = section.encode("utf-8")
+        return (bisect.bisect_left(self.names, prefix + b"\0"), bisect.bisect_left(self.names, prefix + b"\1"))
+
+
+class ArtifactSection(Mapping):
+    """Read-only fname -> text view of one section of a mapped artifact.
+
+    Texts are decoded from the shared mapping only when accessed; raw() gives
+    the zero-copy UTF-8 bytes.
+    """
+
+    def __init__(self, artifact: Artifact, section: str):
+        self._artifact = artifact
+        self._section = section
+        self._lo, self._hi = artifact.section_range(section)
+
+    def _file_id(self, fname: str) -> int:
+        file_id = self._artifact.names.find(_file_key(self._section, fname), self._lo, self._hi)
+        if file_id < 0:
+            raise KeyError(fname)
+        return file_id
+
+    def raw(self, fname: str) -> memoryview:
+        return self._artifact.texts.raw(self._file_id(fname))
+
+    def __getitem__(self, fname: str) -> str:
+        return str(self.raw(fname), "utf-8")
+
+    def __contains__(self, fname) -> bool:
+        return isinstance(fname, str) and self._artifact.names.find(
+            _file_key(self._section, fname), self._lo, self._hi) >= 0
+
+    def __iter__(self):
+        for file_id in range(self._lo, self._hi):
+            yield self._artifact.file_key(file_id)[1]
+
+    def __len__(self):
+        return self._hi - self._lo
+
+
+class ArtifactColumn(Mapping):
+    """(section, fname) -> one field of the per-document metadata, decoded on access"""
+
+    def __init__(self, artifact: Artifact, field: str):
+        self._artifact = artifact
+        self._field = field
+
+    def __getitem__(self, key: tuple):
+        file_id = self._artifact.file_id(*key)
+        if file_id < 0:
+            raise KeyError(key)
+        return json.loads(str(self._artifact.metadata.raw(file_id), "utf-8")).get(self._field)
+
+    def __iter__(self):
+        for file_id in range(len(self._artifact.names)):
+            yield self._artifact.file_key(file_id)
+
+    def __len__(self):
+        return len(self._artifact.names)
+
+
+class MappedPostings:
+    """{local doc id: tf} view of one term's postings, sorted by doc id"""
+
+    __slots__ = ("docs", "tfs")
+
+    def __init__(self, docs: memoryview, tfs: memoryview):
+        self.docs = docs
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.docs)
+
+    def items(self):
+        return zip(self.docs, self.tfs)
+
+    def get(self, local: int, default=None):
+        i = bisect.bisect_left(self.docs, local)
+        return self.tfs[i] if i < len(self.docs) and self.docs[i] == local else default
+
+    def __getitem__(self, local: int) -> int:
+        tf = self.get(local)
+        if tf is None:
+            raise KeyError(local)
+        return tf
+
+    def __contains__(self, local) -> bool:
+        return self.get(local) is not None
+
+
+class MappedTerms:
+    """term -> MappedPostings view of the artifact's term table"""
+
+    def __init__(self, artifact: Artifact):
+        self._terms = artifact.strings("terms")
+        self._offsets = artifact.array("postings_offsets")
+        self._docs = artifact.array("postings_docs")
+        self._tfs = artifact.array("postings_tfs")
+
+    def _postings(self, i: int) -> MappedPostings:
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return MappedPostings(self._docs[start:end], self._tfs[start:end])
+
+    def get(self, term: str, default=None):
+        i = self._terms.find(term.encode("utf-8"))
+        return self._postings(i) if i >= 0 else default
+
+    def items(self):
+        for i in range(len(self._terms)):
+            yield self._terms[i].decode("utf-8"), self._postings(i)
+
+
+class MappedDocKeys:
+    """local doc id -> (section, fname, start, end)"""
+
+    def __init__(self, artifact: Artifact):
+        self._artifact = artifact
+        self._files = artifact.array("doc_files")
+        self._starts = artifact.array("doc_starts")
+        self._ends = artifact.array("doc_ends")
+
+    def __len__(self):
+        return len(self._files)
+
+    def __getitem__(self, local: int) -> tuple:
+        return (*self._artifact.file_key(self._files[local]), self._starts[local], self._ends[local])
+
+
+class MappedGroups:
+    """(section, fname) -> range of the file's local doc ids"""
+
+    def __init__(self, artifact: Artifact):
+        self._artifact = artifact
+        self._passages = artifact.array("file_passages")
+
+    def get(self, group: tuple, default=()):
+        file_id = self._artifact.file_id(*group)
+        if file_id < 0 or self._passages[file_id] == self._passages[file_id + 1]:
+            return default
+        return range(self._passages[file_id], self._passages[file_id + 1])
+
+    def items(self):
+        for file_id in range(len(self._artifact.names)):
+            if self._passages[file_id] < self._passages[file_id + 1]:
+                yield self._artifact.file_key(file_id), range(self._passages[file_id], self._passages[file_id + 1])
+
+
+class MappedSegment:
+    """An index segment (see search_index.Segment) read in place from the artifact; never appended to"""
+
+    def __init__(self, artifact: Artifact):
+        toc = artifact.toc
+        self.postings = MappedTerms(artifact)
+        self.doc_keys = MappedDocKeys(artifact)
+        self.doc_lengths = artifact.array("doc_lengths")
+        self.groups = MappedGroups(artifact)
+        self.meta = MetadataColumns.from_columns(
+            {name: artifact.array("meta_" + name) for name in MetadataColumns.COLUMNS},
+            toc["terms"], toc["authors"],
+            {name + suffix: artifact.array(f"meta_{name}{suffix}")
+             for name in MetadataColumns.COLUMNS for suffix in ("_order", "_sorted")}
+        )
+        self.total_length = toc["total_length"]
+
+    def __len__(self):
+        return len(self.doc_keys)
+
+
+def load_artifact(path: str) -> dict:
+    """Map a compiled artifact and return it in the load_knowledge_base shape"""
+    artifact = Artifact(path)
+    kb = {section: ArtifactSection(artifact, section) for section in SECTIONS}
+    kb["urls"] = ArtifactColumn(artifact, "url")
+    kb["links"] = ArtifactColumn(artifact, "links")
+    kb["dates"] = ArtifactColumn(artifact, "date")
+    kb["sources"] = ArtifactColumn(artifact, "sources")
+    segments = [MappedSegment(artifact)] if "terms" in artifact.toc["sections"] else []
+    kb["index"] = InvertedIndex(artifact.toc["k1"], artifact.toc["b"], segments)
+    return kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the knowledge base into one artifact')
+    parser.add_argument('--output', '-o', default='data/kb.bin',
+                       help='Path of the compiled artifact')
+    args = parser.parse_args()
+
+    count = compile_knowledge_base(load_documents(), args.output)
+    print(f"Compiled {count} documents into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
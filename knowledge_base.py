@@ -0,0 +1,187 @@
+import bisect
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+from document_store import DocumentStore
+
+COURSE_DIR = "./data/course_content"
+DISCOURSE_DIR = "./data/discourse_posts"
+# JSONL records written by data_processing.py
+RECORDS_DIR = "./data/records"
+
+# Passage boundaries: markdown/HTML headings, which includes "### Post #n"
+HEADING_RE = re.compile(r"^(?:#{1,6}\s|<h[1-6][\s>])", re.MULTILINE | re.IGNORECASE)
+PASSAGE_CHARS = 1000
+PASSAGE_OVERLAP = 150
+MIN_PASSAGE_CHARS = 200
+
+# YAML front matter: url/date/author are read from it, but it is not passage text
+FRONT_MATTER_RE = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+# Front-matter key written by the Discourse/course exporters
+SOURCE_URL_RE = re.compile(r'^(?:original_url|url):\s*"?(https?://[^"\s]+)"?\s*$', re.MULTILINE)
+DATE_RE = re.compile(r'^(?:downloaded_at|date|created_at):\s*"?([^"\n]+?)"?\s*$', re.MULTILINE)
+
+# Outbound links: markdown [text](url), HTML <a href>, then bare URLs
+MD_LINK_RE = re.compile(r'\[([^\]]*)\]\((https?://[^)\s]+)\)')
+HTML_LINK_RE = re.compile(r'<a\s[^>]*?href="(https?://[^"]+)"[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+BARE_URL_RE = re.compile(r'https?://[^\s)\]"<>]+')
+
+
+def list_documents(course_dir: str = COURSE_DIR, discourse_dir: str = DISCOURSE_DIR):
+    """Yield (section, fname, path) for every indexable file in the data directories"""
+    for fname in os.listdir(course_dir):
+        if fname.endswith(".html") or fname.endswith(".md"):
+            yield "course_content", fname, os.path.join(course_dir, fname)
+
+    for fname in os.listdir(discourse_dir):
+        if fname.endswith(".md"):
+            yield "discourse_posts", fname, os.path.join(discourse_dir, fname)
+
+
+def read_documents(course_dir: str = COURSE_DIR, discourse_dir: str = DISCOURSE_DIR) -> dict:
+    """Read the course and Discourse data directories into filename -> text dicts"""
+    kb = {
+        "course_content": {},
+        "discourse_posts": {}
+    }
+    for section, fname, path in list_documents(course_dir, discourse_dir):
+        with open(path, "r", encoding="utf-8") as f:
+            kb[section][fname] = f.read()
+    return kb
+
+
+def extract_link_table(text: str) -> list:
+    """Return [url, anchor text, offset] for every outbound link, ordered by offset"""
+    links = []
+    covered = set()
+    for match in MD_LINK_RE.finditer(text):
+        links.append([match.group(2), match.group(1).strip(), match.start()])
+        covered.add(match.start(2))
+    for match in HTML_LINK_RE.finditer(text):
+        links.append([match.group(1), re.sub(r"<[^>]+>", "", match.group(2)).strip(), match.start()])
+        covered.add(match.start(1))
+    for match in BARE_URL_RE.finditer(text):
+        if match.start() not in covered:
+            links.append([match.group(0), "", match.start()])
+    links.sort(key=lambda link: link[2])
+    return links
+
+
+def links_in_span(links: list, start: int, end: int) -> list:
+    """The [url, text, offset] entries of an offset-sorted link table within [start, end)"""
+    offsets = [link[2] for link in links]
+    return links[bisect.bisect_left(offsets, start):bisect.bisect_left(offsets, end)]
+
+
+def read_records(path: str):
+    """Yield (section, fname, text, url, date, links, sources) for every record of one JSONL file"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            links = [[link["url"], link["text"], link["offset"]] for link in record["links"]]
+            # dedup.py lists the record's own URL first; keep only the others
+            sources = [url for url in record.get("sources", []) if url != record["url"]]
+            yield (record["section"], record["id"], record["text"], record["url"],
+                   parse_date(record.get("date")), links, sources)
+
+
+def list_records(records_dir: str = RECORDS_DIR) -> list:
+    """JSONL record files in records_dir, in load order; empty if there are none"""
+    if not os.path.isdir(records_dir):
+        return []
+    return sorted(fname for fname in os.listdir(records_dir) if fname.endswith(".jsonl"))
+
+
+def iter_records(records_dir: str = RECORDS_DIR):
+    """Yield (section, fname, text, url, date, links, sources) for every ingested JSONL record"""
+    for fname in list_records(records_dir):
+        yield from read_records(os.path.join(records_dir, fname))
+
+
+def iter_files(course_dir: str = COURSE_DIR, discourse_dir: str = DISCOURSE_DIR):
+    """Yield (section, fname, text, url, date, links, sources) for every file in the data directories"""
+    for section, fname, path in list_documents(course_dir, discourse_dir):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        yield section, fname, text, extract_source_url(text), extract_date(text), extract_link_table(text), []
+
+
+def load_documents() -> dict:
+    """Documents and their URLs, links and sources from ingested records if present, else the data directories.
+
+    Documents are streamed into a columnar DocumentStore, and the result is
+    its Mapping views (see document_store.py).
+    """
+    if list_records():
+        return DocumentStore.build(iter_records()).as_kb()
+    return DocumentStore.build(iter_files()).as_kb()
+
+
+def extract_source_url(text: str):
+    """Return the canonical URL from a document's front matter, if any"""
+    match = SOURCE_URL_RE.search(text[:2000])
+    return match.group(1) if match else None
+
+
+def parse_date(value, end_of_day: bool = False):
+    """ISO 8601 date/datetime string to a Unix timestamp (UTC if no zone), or None.
+
+    With end_of_day, a date without a time is its last second rather than
+    midnight, for inclusive upper bounds.
+    """
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    timestamp = int(date.timestamp())
+    # "2025-03-01" or "20250301": anything longer has a time
+    if end_of_day and len(value.strip()) <= 10:
+        timestamp += 86400 - 1
+    return timestamp
+
+
+def extract_date(text: str):
+    """Return the front-matter date of a document as a Unix timestamp, if any"""
+    match = DATE_RE.search(text[:2000])
+    return parse_date(match.group(1)) if match else None
+
+
+def front_matter_end(text: str) -> int:
+    """Offset where text's body starts: after its YAML front matter, or 0 if it has none"""
+    match = FRONT_MATTER_RE.match(text)
+    return match.end() if match else 0
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP) -> list:
+    """Split text at headings/posts into (start, end) passages of at most max_chars.
+
+    Front matter is skipped, so its URLs are neither indexed nor sent to the
+    model. Sections shorter than MIN_PASSAGE_CHARS are merged into the next
+    one; longer ones are cut at line breaks with overlap characters repeated.
+    """
+    body = front_matter_end(text)
+    boundaries = [body] + [m.start() for m in HEADING_RE.finditer(text, body) if m.start() > body] + [len(text)]
+    sections = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        if sections and sections[-1][1] - sections[-1][0] < MIN_PASSAGE_CHARS and end - sections[-1][0] <= max_chars:
+            sections[-1] = (sections[-1][0], end)
+        else:
+            sections.append((start, end))
+
+    spans = []
+    for start, end in sections:
+        while end - start > max_chars:
+            cut = text.rfind("\n", start + max_chars // 2, start + max_chars)
+            if cut == -1:
+                cut = start + max_chars
+            spans.append((start, cut))
+            start = cut - overlap
+        if text[start:end].strip():
+            spans.append((start, end))
+    return spans
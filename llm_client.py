@@ -0,0 +1,116 @@
+import hashlib
+import os
+
+import httpx
+from openai import AsyncOpenAI
+
+import metrics
+from prompt_builder import ANSWER_TOKEN_RESERVE, count_tokens
+from upstream import Upstream
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+# Used instead of LLM_MODEL when the question comes with an image
+LLM_VISION_MODEL = os.getenv("LLM_VISION_MODEL", "gpt-4o-mini")
+LLM_TEMPERATURE = 0.3
+SYSTEM_PROMPT = "You are a helpful teaching assistant..."
+
+_client = None
+# Coalescing, adaptive concurrency, timeouts, retries and hedging for every call
+upstream = Upstream.from_env()
+metrics.register_collector(upstream.metrics_lines)
+
+
+def get_client() -> AsyncOpenAI:
+    """Return the process-wide async client, creating it on first use.
+
+    One client means one pooled keep-alive HTTP transport, so requests reuse
+    TCP/TLS connections to the upstream instead of opening one per question.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=os.getenv("API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            # Retries are upstream's job, under its retry budget
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+                    max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+                    keepalive_expiry=30,
+                ),
+                timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "60")), connect=5.0),
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def build_messages(prompt: str, image_url: str = None) -> list:
+    content = prompt
+    if image_url:
+        content = [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": image_url}}
+        ]
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content}
+    ]
+
+
+async def complete(prompt: str, image_url: str = None) -> str:
+    """Return the full answer for prompt, optionally with an image input.
+
+    Concurrent calls with the same prompt and image share one upstream call.
+    """
+    model = LLM_VISION_MODEL if image_url else LLM_MODEL
+
+    async def request():
+        response = await get_client().chat.completions.create(
+            model=model,
+            messages=build_messages(prompt, image_url),
+            temperature=LLM_TEMPERATURE,
+            max_tokens=ANSWER_TOKEN_RESERVE
+        )
+        if response.usage:
+            record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+    key = hashlib.sha256(f"{model}\0{image_url or ''}\0{prompt}".encode("utf-8")).hexdigest()
+    return await upstream.call(key, request)
+
+
+async def stream(prompt: str, image_url: str = None):
+    """Yield the answer for prompt token by token.
+
+    Only opening the stream goes through upstream (limit, timeout, retries),
+    so its latency signal is time to first byte; streams are not coalesced
+    or hedged.
+    """
+    response = await upstream.call(None, lambda: get_client().chat.completions.create(
+        model=LLM_VISION_MODEL if image_url else LLM_MODEL,
+        messages=build_messages(prompt, image_url),
+        temperature=LLM_TEMPERATURE,
+        max_tokens=ANSWER_TOKEN_RESERVE,
+        stream=True
+    ), hedge=False)
+    parts = []
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    # Streaming responses carry no usage block; count locally
+    record_tokens(count_tokens(SYSTEM_PROMPT + prompt), count_tokens("".join(parts)))
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int):
+    metrics.TOKENS.inc(prompt_tokens, kind="prompt")
+    metrics.TOKENS.inc(completion_tokens, kind="completion")
+    metrics.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
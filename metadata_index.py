@@ -0,0 +1,275 @@
+"""
+Per-passage metadata for structured retrieval filters and boosts.
+
+Every indexed passage gets a date, course term ("jan-2025", "may-2025",
+"sep-2025"), Discourse topic id and author, stored as array columns next to
+the inverted index's segments. Each column also has a sorted view (doc ids
+ordered by value), built on first use per segment, which never changes once
+published, or stored in the compiled artifact. BM25 checks a filter against
+the columns per posting, or, when the filter is narrow, walks its sorted-view
+range (found with a bisect per value) instead of the term's postings.
+"""
+
+import bisect
+import math
+import os
+import re
+from array import array
+from datetime import datetime, timezone
+
+from knowledge_base import parse_date
+
+NO_DATE = -1
+NO_TOPIC = -1
+
+# "TDS Jan 2025", "tds-sep-2025", "May_2024": course terms start in Jan, May and Sep
+TERM_RE = re.compile(r'\b(jan(?:uary)?|may|sep(?:t(?:ember)?)?)[\s_-]*(20\d\d)\b', re.IGNORECASE)
+TOPIC_URL_RE = re.compile(r'/t/(?:[^/\s]+/)?(\d+)')
+FRONT_MATTER_AUTHOR_RE = re.compile(r'^author:\s*"?@?([A-Za-z0-9_.-]*[A-Za-z0-9_])', re.MULTILINE)
+HEADING_AUTHOR_RE = re.compile(r'@([A-Za-z0-9_.-]*[A-Za-z0-9_])')
+HEADING_DATE_RE = re.compile(r'\b\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2})?(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?')
+
+# Discourse usernames of course staff/TAs, comma-separated
+STAFF_USERNAMES = frozenset(
+    name.strip().lower().lstrip("@") for name in os.getenv("STAFF_USERNAMES", "").split(",") if name.strip()
+)
+STAFF_BOOST = float(os.getenv("STAFF_BOOST", "0.3"))
+RECENCY_BOOST = float(os.getenv("RECENCY_BOOST", "0.2"))
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("RECENCY_HALF_LIFE_DAYS", "120"))
+
+
+def term_of_date(timestamp: int) -> str:
+    date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return f"{('jan', 'may', 'sep')[(date.month - 1) // 4]}-{date.year}"
+
+
+def find_term(text: str):
+    match = TERM_RE.search(text)
+    return f"{match.group(1)[:3].lower()}-{match.group(2)}" if match else None
+
+
+def document_metadata(text: str, url: str = None, date: int = None) -> dict:
+    """Document-level metadata; passages inherit it unless their heading overrides it"""
+    head = text[:2000]
+    author = FRONT_MATTER_AUTHOR_RE.search(head)
+    topic = TOPIC_URL_RE.search(url or "")
+    return {
+        "date": date,
+        # An explicit mention in the title/URL beats the date: posts about
+        # next term's exam are often written in the previous one
+        "term": find_term(f"{url or ''} {head[:500]}") or (term_of_date(date) if date is not None else None),
+        "topic_id": int(topic.group(1)) if topic else None,
+        "author": author.group(1).lower() if author else None
+    }
+
+
+def passage_metadata(document: dict, text: str, start: int, end: int) -> tuple:
+    """(date, term, topic_id, author) of the passage text[start:end]"""
+    line_end = text.find("\n", start, end)
+    heading = text[start:end if line_end == -1 else line_end]
+    date = document["date"]
+    author = document["author"]
+    if heading.startswith("#"):
+        # "### Post #3 by @user (2025-01-15T10:00:00Z)"
+        match = HEADING_AUTHOR_RE.search(heading)
+        if match:
+            author = match.group(1).lower()
+        match = HEADING_DATE_RE.search(heading)
+        if match:
+            date = parse_date(match.group(0)) or date
+    return date, document["term"], document["topic_id"], author
+
+
+def infer_filters(question: str) -> dict:
+    """Filters implied by the question itself: a course term or a topic URL.
+
+    They are inferred_term/inferred_topic_id, which keep passages with no
+    term or topic (e.g. course content), unlike a client's own term/topic_id.
+    """
+    filters = {}
+    term = find_term(question)
+    if term:
+        filters["inferred_term"] = term
+    topic = TOPIC_URL_RE.search(question)
+    if topic:
+        filters["inferred_topic_id"] = int(topic.group(1))
+    return filters
+
+
+class MetadataColumns:
+    """Per-doc_id metadata columns of an index segment"""
+
+    # Every column uses -1 for a missing value
+    COLUMNS = ("dates", "topics", "term_ids", "author_ids")
+
+    def __init__(self):
+        self.dates = array("q")
+        self.topics = array("q")
+        self.term_ids = array("q")
+        self.author_ids = array("q")
+        self.terms = []
+        self.authors = []
+        self._codes = {}
+        self._views = None
+
+    @classmethod
+    def from_columns(cls, columns: dict, terms: list, authors: list, views: dict = None) -> "MetadataColumns":
+        """Read-only columns over existing int sequences, e.g. memoryviews into a mapped artifact.
+
+        views, if given, are precomputed sorted_views() arrays.
+        """
+        meta = cls()
+        for name in cls.COLUMNS:
+            setattr(meta, name, columns[name])
+        for value in terms:
+            meta._code(meta.terms, "term", value)
+        for value in authors:
+            meta._code(meta.authors, "author", value)
+        if views is not None:
+            meta._views = meta._finish_views(views)
+        return meta
+
+    def _code(self, table: list, kind: str, value) -> int:
+        if value is None:
+            return -1
+        code = self._codes.get((kind, value))
+        if code is None:
+            code = self._codes[(kind, value)] = len(table)
+            table.append(value)
+        return code
+
+    def append(self, meta: tuple = None):
+        date, term, topic_id, author = meta or (None, None, None, None)
+        self.dates.append(NO_DATE if date is None else date)
+        self.topics.append(NO_TOPIC if topic_id is None else topic_id)
+        self.term_ids.append(self._code(self.terms, "term", term))
+        self.author_ids.append(self._code(self.authors, "author", author))
+        self._views = None
+
+    def row(self, doc_id: int) -> tuple:
+        """(date, term, topic_id, author) of doc_id, as passed to append"""
+        date, topic = self.dates[doc_id], self.topics[doc_id]
+        term, author = self.term_ids[doc_id], self.author_ids[doc_id]
+        return (None if date == NO_DATE else date, self.terms[term] if term >= 0 else None,
+                None if topic == NO_TOPIC else topic, self.authors[author] if author >= 0 else None)
+
+    def sorted_views(self) -> dict:
+        """Per column, the doc ids that have a value ("<column>_order", sorted by value) and those values"""
+        views = {}
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            order = sorted((i for i, value in enumerate(column) if value != -1), key=column.__getitem__)
+            views[name + "_order"] = array("q", order)
+            views[name + "_sorted"] = array("q", (column[i] for i in order))
+        return views
+
+    def _finish_views(self, views: dict) -> dict:
+        staff = [self._codes[("author", name)] for name in STAFF_USERNAMES if ("author", name) in self._codes]
+        views["staff"] = frozenset(doc_id for code in staff for doc_id in self._range(views, "author_ids", code, code))
+        views["newest"] = views["dates_sorted"][-1] if len(views["dates_sorted"]) else None
+        return views
+
+    @staticmethod
+    def _range(views: dict, name: str, lo=None, hi=None):
+        """Doc ids whose value in column name is within [lo, hi] (None is unbounded)"""
+        values = views[name + "_sorted"]
+        start = bisect.bisect_left(values, lo) if lo is not None else 0
+        end = bisect.bisect_right(values, hi) if hi is not None else len(values)
+        return views[name + "_order"][start:end]
+
+    def views(self) -> dict:
+        """Sorted views of every column plus the staff set, built once per segment"""
+        views = self._views
+        if views is None:
+            views = self._views = self._finish_views(self.sorted_views())
+        return views
+
+    def matcher(self, filters: dict):
+        """(candidates, check) for filters, or None if there are no filters.
+
+        filters may hold since/until (Unix timestamps), term, topic_id,
+        authors (usernames) and staff_only. inferred_term and
+        inferred_topic_id, for values only inferred from the question, also
+        let through doc ids with no term or topic.
+
+        check(doc_id) reads the columns directly, so even a broad filter costs
+        a few comparisons per posting and no per-query set. candidates is the
+        narrowest filter's sorted-view range (doc ids in value order), or None
+        if no filter has one; callers walk it instead of a term's postings
+        when it is the shorter of the two.
+        """
+        if not filters:
+            return None
+        views = self.views()
+        ranges = []
+        checks = []
+
+        def matching(name, code):
+            return self._range(views, name, code, code) if code is not None else ()
+
+        since, until = filters.get("since"), filters.get("until")
+        if since is not None or until is not None:
+            dates = self.dates
+            lo = since if since is not None else -math.inf
+            hi = until if until is not None else math.inf
+            ranges.append(self._range(views, "dates", since, until))
+            checks.append(lambda doc_id: dates[doc_id] != NO_DATE and lo <= dates[doc_id] <= hi)
+        if filters.get("term"):
+            code = self._codes.get(("term", filters["term"].lower()))
+            term_ids = self.term_ids
+            ranges.append(matching("term_ids", code))
+            checks.append(lambda doc_id: term_ids[doc_id] == code)
+        if filters.get("inferred_term"):
+            allowed = (-1, self._codes.get(("term", filters["inferred_term"].lower()), -1))
+            term_ids = self.term_ids
+            checks.append(lambda doc_id: term_ids[doc_id] in allowed)
+        if filters.get("topic_id") is not None:
+            topic = int(filters["topic_id"])
+            topics = self.topics
+            ranges.append(matching("topics", topic))
+            checks.append(lambda doc_id: topics[doc_id] == topic)
+        if filters.get("inferred_topic_id") is not None:
+            allowed_topics = (NO_TOPIC, int(filters["inferred_topic_id"]))
+            topics = self.topics
+            checks.append(lambda doc_id: topics[doc_id] in allowed_topics)
+        if filters.get("authors"):
+            codes = {self._codes.get(("author", name.lower().lstrip("@"))) for name in filters["authors"]} - {None}
+            author_ids = self.author_ids
+            ranges.append([doc_id for code in codes for doc_id in matching("author_ids", code)])
+            checks.append(lambda doc_id: author_ids[doc_id] in codes)
+        if filters.get("staff_only"):
+            staff = views["staff"]
+            ranges.append(staff)
+            checks.append(staff.__contains__)
+
+        candidates = min(ranges, key=len) if ranges else None
+        if len(checks) == 1:
+            return candidates, checks[0]
+
+        def check_all(doc_id):
+            for check in checks:
+                if not check(doc_id):
+                    return False
+            return True
+
+        return candidates, check_all
+
+    def newest(self):
+        """Latest date in the columns, or None"""
+        return self.views()["newest"]
+
+    def boost(self, doc_id: int, newest: int = None) -> float:
+        """Score multiplier favouring recent and staff-authored passages.
+
+        Recency is measured back from newest, by default the latest date here.
+        """
+        views = self.views()
+        newest = views["newest"] if newest is None else newest
+        factor = 1.0
+        if doc_id in views["staff"]:
+            factor += STAFF_BOOST
+        date = self.dates[doc_id]
+        if RECENCY_BOOST and date != NO_DATE and newest is not None:
+            age_days = (newest - date) / 86400
+            factor += RECENCY_BOOST * math.exp(-math.log(2) * age_days / RECENCY_HALF_LIFE_DAYS)
+        return factor
@@ -0,0 +1,211 @@
+"""
+Request tracing and Prometheus-format metrics.
+
+Wrap a request in trace() and each step in stage(); stage timings feed
+cumulative latency histograms, and the request's spans can be returned as
+a timing breakdown or exported as OpenTelemetry-style JSON lines to
+TRACE_EXPORT_PATH.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set"""
+
+    def __init__(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("tds_request_seconds", "End-to-end request latency")
+STAGE_SECONDS = Histogram("tds_stage_seconds", "Latency of each request stage")
+ERRORS = Counter("tds_errors_total", "Failures by stage and exception type")
+TOKENS = Counter("tds_llm_tokens_total", "Prompt and completion tokens sent to/received from the LLM")
+
+_metrics = [REQUEST_SECONDS, STAGE_SECONDS, ERRORS, TOKENS]
+_collectors = []
+
+
+def register_collector(collect):
+    """Add a callable returning extra exposition lines at scrape time"""
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Spans of one request"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+        self.status = "ok"
+
+    def breakdown(self) -> dict:
+        """Structured timing breakdown for debug responses"""
+        stages = {}
+        for span in self.spans:
+            stages[span["name"]] = round(stages.get(span["name"], 0) + span["duration_ms"], 3)
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "stages": stages,
+            **self.attributes
+        }
+
+
+_current = contextvars.ContextVar("trace", default=None)
+_export_lock = threading.Lock()
+
+
+def annotate(**attributes):
+    """Attach attributes (token counts, cache result, ...) to the current trace"""
+    trace_ = _current.get()
+    if trace_ is not None:
+        trace_.attributes.update(attributes)
+
+
+@contextmanager
+def trace(name: str):
+    """Root span for one request"""
+    trace_ = Trace(name)
+    token = _current.set(trace_)
+    try:
+        yield trace_
+    except Exception:
+        trace_.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        REQUEST_SECONDS.observe(time.perf_counter() - trace_.start, endpoint=name)
+        if TRACE_EXPORT_PATH:
+            export(trace_)
+
+
+@contextmanager
+def stage(name: str):
+    """Time one step of the current request"""
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception as e:
+        status = "error"
+        ERRORS.inc(stage=name, error=type(e).__name__)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        trace_ = _current.get()
+        if trace_ is not None:
+            trace_.spans.append({
+                "name": name,
+                "span_id": os.urandom(8).hex(),
+                "start_time_unix_nano": start_ns,
+                "duration_ms": duration * 1000,
+                "status": status
+            })
+
+
+def export(trace_: Trace):
+    """Append the trace's spans as OpenTelemetry-style JSON lines"""
+    end_ns = trace_.start_ns + int((time.perf_counter() - trace_.start) * 1e9)
+    records = [{
+        "trace_id": trace_.trace_id,
+        "span_id": trace_.span_id,
+        "parent_span_id": None,
+        "name": trace_.name,
+        "start_time_unix_nano": trace_.start_ns,
+        "end_time_unix_nano": end_ns,
+        "attributes": trace_.attributes,
+        "status": trace_.status
+    }]
+    for span in trace_.spans:
+        records.append({
+            "trace_id": trace_.trace_id,
+            "span_id": span["span_id"],
+            "parent_span_id": trace_.span_id,
+            "name": span["name"],
+            "start_time_unix_nano": span["start_time_unix_nano"],
+            "end_time_unix_nano": span["start_time_unix_nano"] + int(span["duration_ms"] * 1e6),
+            "attributes": {},
+            "status": span["status"]
+        })
+    with _export_lock, open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
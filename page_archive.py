@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Content-addressed archive of raw HTTP responses.
+
+Response bodies are stored once per content hash, gzip-compressed, under
+blobs/<sha256[:2]>/<sha256>.gz. An append-only index.jsonl records every
+fetch: URL, time, status, validators (ETag, Last-Modified), content type,
+hash, and the crawler's page kind. Re-fetching an unchanged page only appends
+an index line. The newest line per URL is the current version.
+
+The crawler sends the stored validators as a conditional GET, and on a 304
+it reuses the archived body. `crawler.replay` re-parses the archive offline.
+To show what is stored, or to export it as a standard WARC file:
+
+    python page_archive.py data/page_archive
+    python page_archive.py data/page_archive --warc pages.warc.gz
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+PAGE_ARCHIVE_DIR = os.getenv("PAGE_ARCHIVE_DIR", "./data/page_archive")
+INDEX_FILE = "index.jsonl"
+# Response headers worth keeping: validators and what the parsers need to decode the body
+KEPT_HEADERS = ("etag", "last-modified", "content-type")
+
+
+class PageArchive:
+    """Raw responses keyed by URL, with bodies stored by content hash"""
+
+    def __init__(self, root: str = PAGE_ARCHIVE_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.latest = {}
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.latest[record["url"]] = record
+
+    def __len__(self):
+        return len(self.latest)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.latest
+
+    def get(self, url: str):
+        """The newest record for url, or None"""
+        return self.latest.get(url)
+
+    def records(self, kind: str = None):
+        """Newest record per URL, optionally only those of one page kind"""
+        return [record for record in self.latest.values() if kind is None or record.get("kind") == kind]
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256 + ".gz")
+
+    def read(self, record: dict) -> bytes:
+        with gzip.open(self.blob_path(record["sha256"]), "rb") as f:
+            return f.read()
+
+    def validators(self, url: str) -> dict:
+        """Conditional request headers for url, empty if it is not archived"""
+        record = self.latest.get(url)
+        headers = {}
+        if record:
+            if record.get("etag"):
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last-modified"):
+                headers["If-Modified-Since"] = record["last-modified"]
+        return headers
+
+    def put(self, url: str, content: bytes, headers=None, status: int = 200, kind: str = None) -> dict:
+        """Archive one response body; unchanged bodies only add an index line"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        record = {
+            "url": url,
+            "fetched_at": datetime.now(timezone.utc).isoformat(),
+            "status": status,
+            "sha256": sha256,
+            "size": len(content)
+        }
+        for name in KEPT_HEADERS:
+            value = headers.get(name) if headers is not None else None
+            if value:
+                record[name] = value
+        if kind:
+            record["kind"] = kind
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.latest[url] = record
+        return record
+
+    def revalidated(self, url: str, headers=None) -> bytes:
+        """Record a 304 for url and return its archived body"""
+        record = self.latest[url]
+        content = self.read(record)
+        merged = {name: record[name] for name in KEPT_HEADERS if name in record}
+        for name in KEPT_HEADERS:
+            # A 304 may carry updated validators
+            if headers is not None and headers.get(name):
+                merged[name] = headers[name]
+        self.put(url, content, merged, record["status"], record.get("kind"))
+        return content
+
+    def export_warc(self, path: str) -> int:
+        """Write the newest response per URL to a gzipped WARC/1.0 file; returns the record count"""
+        count = 0
+        with open(path, "wb") as out:
+            for record in self.latest.values():
+                head = f"HTTP/1.1 {record['status']} {HTTPStatus(record['status']).phrase}\r\n"
+                for name in KEPT_HEADERS:
+                    if name in record:
+                        head += f"{name.title()}: {record[name]}\r\n"
+                block = head.encode("utf-8") + b"\r\n" + self.read(record)
+                warc_head = (
+                    "WARC/1.0\r\n"
+                    "WARC-Type: response\r\n"
+                    f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+                    f"WARC-Date: {record['fetched_at'][:19]}Z\r\n"
+                    f"WARC-Target-URI: {record['url']}\r\n"
+                    f"WARC-Payload-Digest: sha256:{record['sha256']}\r\n"
+                    "Content-Type: application/http; msgtype=response\r\n"
+                    f"Content-Length: {len(block)}\r\n\r\n"
+                )
+                # One gzip member per record, as WARC readers expect
+                out.write(gzip.compress(warc_head.encode("utf-8") + block + b"\r\n\r\n"))
+                count += 1
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or export the raw page archive')
+    parser.add_argument('archive', nargs='?', default=PAGE_ARCHIVE_DIR, help='Archive directory')
+    parser.add_argument('--warc', default=None, help='Export the newest response per URL to this .warc.gz file')
+    args = parser.parse_args()
+
+    archive = PageArchive(args.archive)
+    kinds = Counter(record.get("kind") or "other" for record in archive.records())
+    hashes = {record["sha256"] for record in archive.records()}
+    raw = sum(record["size"] for record in archive.records())
+    stored = sum(os.path.getsize(archive.blob_path(sha256)) for sha256 in hashes)
+    print(f"{len(archive)} URLs ({', '.join(f'{n} {kind}' for kind, n in sorted(kinds.items())) or 'none'}), "
+          f"{len(hashes)} distinct bodies, {raw / 1e6:.1f} MB raw, {stored / 1e6:.1f} MB stored")
+    if args.warc:
+        print(f"Wrote {archive.export_warc(args.warc)} records to {args.warc}")
+
+
+if __name__ == "__main__":
+    main()
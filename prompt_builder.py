@@ -0,0 +1,69 @@
+import os
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or BPE file not cached and no network
+    _encoding = None
+
+# Rough BPE stand-in: words, numbers and single punctuation marks
+_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "16385"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+ANSWER_TOKEN_RESERVE = int(os.getenv("ANSWER_TOKEN_RESERVE", "700"))
+
+PROMPT_TEMPLATE = """Question: {question}
+
+Context (most relevant first):
+{passages}
+
+Please provide a detailed answer with references to the sources above where applicable."""
+
+PASSAGE_TEMPLATE = "[{n}] {source}\n{text}\n"
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, else a local estimate"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(_ESTIMATE_RE.findall(text))
+
+
+def context_budget(question: str) -> int:
+    """Tokens left for passages once the template, question and answer reserve are paid for"""
+    budget = min(PROMPT_TOKEN_BUDGET, MODEL_CONTEXT_TOKENS - ANSWER_TOKEN_RESERVE)
+    return budget - count_tokens(PROMPT_TEMPLATE.format(question=question, passages=""))
+
+
+def select_passages(question: str, passages: list) -> list:
+    """Keep passages in relevance order while they fit the token budget.
+
+    Passages that would overflow are skipped so smaller ones further down
+    can still fill the remaining space.
+    """
+    remaining = context_budget(question)
+    selected = []
+    for passage in passages:
+        cost = count_tokens(render_passage(len(selected) + 1, passage))
+        if cost > remaining:
+            continue
+        passage["tokens"] = cost
+        selected.append(passage)
+        remaining -= cost
+    return selected
+
+
+def render_passage(n: int, passage: dict) -> str:
+    return PASSAGE_TEMPLATE.format(
+        n=n, source=passage.get("url") or passage["file"], text=passage["text"].strip()
+    )
+
+
+def build_prompt(question: str, passages: list) -> str:
+    """Render the question and delimited passages, each with its source"""
+    return PROMPT_TEMPLATE.format(
+        question=question,
+        passages="\n".join(render_passage(n, p) for n, p in enumerate(passages, 1))
+    )
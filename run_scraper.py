@@ -6,7 +6,14 @@ This script runs the Discourse scraper for TDS Jan 2025 course posts.
 """
 
 from tds_scraper import scrape_discourse_posts
+from crawler import crawl, replay
+from dedup import dedup_topics
+from discourse_api import sync_incremental
+from page_archive import PAGE_ARCHIVE_DIR, PageArchive
+from urllib.parse import urlsplit
+from datetime import datetime
 import argparse
+import asyncio
 import sys
 
 def main():
@@ -16,6 +23,34 @@ def main():
                        help='Output directory for scraped data')
     parser.add_argument('--url', '-u', default='https://discourse.onlinedegree.iitm.ac.in/c/courses/tds-kb/34',
                        help='Base URL to scrape')
+    parser.add_argument('--concurrency', '-c', type=int, default=4,
+                       help='Maximum number of requests in flight')
+    parser.add_argument('--rate', '-r', type=float, default=2.0,
+                       help='Average requests per second')
+    parser.add_argument('--retries', type=int, default=3,
+                       help='Retries per request on network errors, 429 and 5xx')
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None,
+                       help='Skip topics before this date (YYYY-MM-DD)')
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None,
+                       help='Skip topics after this date (YYYY-MM-DD)')
+    parser.add_argument('--limit', type=int, default=None,
+                       help='Maximum number of topics to fetch')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                       help='Processes parsing pages (default: CPU count, at most --concurrency; 0 parses inline)')
+    parser.add_argument('--archive', default=PAGE_ARCHIVE_DIR,
+                       help='Directory archiving raw responses for conditional re-fetches and --offline')
+    parser.add_argument('--no-archive', action='store_true',
+                       help='Do not archive raw responses')
+    parser.add_argument('--offline', action='store_true',
+                       help='Re-parse the archived pages instead of fetching anything')
+    parser.add_argument('--fresh', action='store_true',
+                       help='Ignore the saved checkpoint and start the crawl over')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Sync only new/changed topics via the Discourse JSON API')
+    parser.add_argument('--legacy', action='store_true',
+                       help='Use the sequential tds_scraper instead of the async crawler')
+    parser.add_argument('--no-dedup', action='store_true',
+                       help='Keep duplicate topics and posts (see dedup.py)')
     args = parser.parse_args()
 
     # Configuration
@@ -28,15 +63,50 @@ def main():
 
     try:
         # Run the scraper
-        total_scraped = scrape_discourse_posts(base_url, output_dir)
+        if args.incremental:
+            # Category page URL -> site root plus the category's .json listing
+            parts = urlsplit(base_url)
+            sync_incremental(
+                output_dir,
+                base_url=f"{parts.scheme}://{parts.netloc}",
+                listing_path=parts.path.rstrip('/') + '.json' if parts.path.strip('/') else '/latest.json'
+            )
+            # Nothing new is a successful incremental run
+            return 0
+        elif args.offline:
+            total_scraped = replay(
+                PageArchive(args.archive), output_dir,
+                start_date=args.since,
+                end_date=args.until,
+                parse_workers=args.parse_workers
+            )
+        elif args.legacy:
+            total_scraped = scrape_discourse_posts(base_url, output_dir, args.limit)
+        else:
+            total_scraped = asyncio.run(crawl(
+                base_url, output_dir,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                max_retries=args.retries,
+                start_date=args.since,
+                end_date=args.until,
+                limit=args.limit,
+                resume=not args.fresh,
+                parse_workers=args.parse_workers,
+                archive=None if args.no_archive else PageArchive(args.archive)
+            ))
         if total_scraped == 0:
             print("\nWarning: No posts were scraped. Possible reasons:")
             print("- No posts in the specified date range (Jan 1 - Apr 14 2025)")
             print("- Website structure changed (check selectors in tds_scraper.py)")
             print("- Authentication required")
             print("- Website blocking scrapers")
+            print("- A previous crawl already finished (use --fresh to start over)")
         else:
             print(f"\nScraping complete! Total posts scraped: {total_scraped}")
+            if not args.no_dedup:
+                # Topics saved twice under different filenames, and posts quoting each other
+                print(f"Deduplicated: {dedup_topics(output_dir)}")
         return 0 if total_scraped > 0 else 1
     except Exception as e:
         print(f"\nError during scraping: {str(e)}", file=sys.stderr)
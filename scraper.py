@@ -1,10 +1,11 @@
 import requests
-from bs4 import BeautifulSoup
 import os
 from datetime import datetime
 import time
 import json
 
+from html_parsing import TOPIC_STRAINER, make_soup, parse_topic
+
 def scrape_discourse_posts(base_url: str, output_dir: str):
     """Scrape TDS Discourse posts from 1 Jan 2025 - 14 Apr 2025"""
     start_date = datetime(2025, 1, 1)
@@ -23,7 +24,7 @@ def scrape_discourse_posts(base_url: str, output_dir: str):
             print(f"Failed to fetch page. Status code: {response.status_code}")
             return 0
             
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = make_soup(response.content)
         
         # Find the topic list container - adjust this selector based on actual HTML
         topic_list = soup.find('div', class_='topic-list') or soup.find('table', {'class': 'topic-list'})
@@ -88,7 +89,7 @@ def scrape_discourse_posts(base_url: str, output_dir: str):
                 # Scrape topic page
                 topic_response = requests.get(full_url, headers=headers)
                 if topic_response.status_code == 200:
-                    topic_soup = BeautifulSoup(topic_response.text, 'html.parser')
+                    topic_soup = make_soup(topic_response.content, TOPIC_STRAINER)
                     
                     # Extract main content
                     main_post = topic_soup.find('div', class_='topic-post')
@@ -128,50 +129,8 @@ def scrape_topic(topic_url: str) -> dict:
             print(f"Failed to fetch topic {topic_url}. Status code: {response.status_code}")
             return None
             
-        soup = BeautifulSoup(response.text, 'html.parser')
-        topic_data = {
-            'posts': []
-        }
-        
-        # Extract topic metadata
-        topic_container = soup.find('div', class_='topic-container')
-        if topic_container:
-            topic_data['title'] = topic_container.find('h1').text.strip() if topic_container.find('h1') else ""
-            
-        # Extract all posts in the topic
-        posts = soup.find_all('div', class_='topic-post')
-        for post in posts:
-            post_data = {
-                'author': post.get('data-username', ''),
-                'post_number': post.get('data-post-number', ''),
-                'content': "",
-                'links': []
-            }
-            
-            # Extract post content
-            content = post.find('div', class_='post')
-            if content:
-                # Clean up content
-                for element in content(['script', 'style', 'iframe', 'nav']):
-                    element.decompose()
-                
-                post_data['content'] = content.get_text(' ', strip=True)
-                
-                # Extract all links
-                for link in content.find_all('a', href=True):
-                    post_data['links'].append({
-                        'text': link.get_text(strip=True),
-                        'url': link['href']
-                    })
-            
-            topic_data['posts'].append(post_data)
-        
-        return topic_data
+        return parse_topic(response.content)
         
     except Exception as e:
         print(f"Error scraping topic {topic_url}: {str(e)}")
         return None
-
- 
-
-
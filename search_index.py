@@ -0,0 +1,309 @@
+import bisect
+import heapq
+import math
+import os
+import re
+from array import array
+
+from knowledge_base import split_passages
+from metadata_index import MetadataColumns, document_metadata, passage_metadata
+
+# Keep dotted version numbers ("3.5", "4o") together, split everything else
+# on punctuation so "gpt-3.5-turbo" matches "gpt", "3.5" and "turbo".
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it
+its me my of on or should so that the their then there these this to was we
+what when where which who will with would you your
+""".split())
+
+# Merge the segments after the first once there are more than this many
+MAX_SEGMENTS = int(os.getenv("INDEX_MAX_SEGMENTS", "8"))
+# Rewrite every segment once this share of indexed documents is deleted
+COMPACT_DELETED_RATIO = float(os.getenv("INDEX_COMPACT_RATIO", "0.2"))
+
+
+def tokenize(text: str) -> list:
+    """Lowercase and split text into index terms"""
+    return TOKEN_RE.findall(text.lower())
+
+
+class Segment:
+    """A block of passages with local doc ids: postings, doc tables and metadata.
+
+    Only the newest segment of an unpublished index version is appended to;
+    once published, a segment is shared by later versions and never changes.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_keys = []
+        self.doc_lengths = array("q")
+        self.groups = {}
+        self.meta = MetadataColumns()
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_keys)
+
+    def add(self, key, counts: dict, length: int, group=None, meta: tuple = None) -> int:
+        local = len(self.doc_keys)
+        for term, tf in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+            postings[local] = tf
+        self.doc_keys.append(key)
+        self.doc_lengths.append(length)
+        self.meta.append(meta)
+        self.total_length += length
+        if group is not None:
+            self.groups.setdefault(group, []).append(local)
+        return local
+
+
+class InvertedIndex:
+    """Term -> postings index with BM25 ranking.
+
+    The index is a list of segments (see Segment), each mapping terms to
+    {local doc id: term frequency}, so a query only touches the postings of
+    its own terms. A document's doc_id is its segment's base plus its local
+    id. BM25 needs no positions, and small ints are shared objects, so
+    postings cost one dict slot each.
+
+    Documents can be grouped (one group per source file) so a changed file's
+    passages can be removed and re-added. copy() gives a new version that
+    shares every segment with the original: additions go to a fresh segment
+    and removals are tombstones, so an update costs time proportional to
+    its delta while the original keeps serving queries. Small segments are
+    merged, and deleted documents purged, by compact().
+
+    Each segment's meta holds its documents' date, term, topic and author
+    (see metadata_index.py) for search filters and boosts.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, segments: list = None):
+        self.k1 = k1
+        self.b = b
+        self.segments = []
+        self.bases = []
+        self.deleted = set()
+        self.live_docs = 0
+        self.total_length = 0
+        self._tail = None  # the segment this (unpublished) version appends to
+        for segment in segments or []:
+            self._append_segment(segment)
+
+    def __len__(self):
+        return self.live_docs
+
+    def _append_segment(self, segment):
+        self.bases.append(self.bases[-1] + len(self.segments[-1]) if self.segments else 0)
+        self.segments.append(segment)
+        self.live_docs += len(segment)
+        self.total_length += segment.total_length
+
+    def _locate(self, doc_id: int):
+        n = bisect.bisect_right(self.bases, doc_id) - 1
+        return self.segments[n], doc_id - self.bases[n]
+
+    def doc_key(self, doc_id: int):
+        segment, local = self._locate(doc_id)
+        return segment.doc_keys[local]
+
+    def copy(self) -> "InvertedIndex":
+        """New version sharing every segment; O(segments + deleted documents)"""
+        clone = InvertedIndex.__new__(InvertedIndex)
+        clone.__dict__.update(self.__dict__)
+        clone.segments = list(self.segments)
+        clone.bases = list(self.bases)
+        clone.deleted = set(self.deleted)
+        clone._tail = None
+        # Further additions to the original must not show up in the clone
+        self._tail = None
+        return clone
+
+    def add_document(self, key, text: str, group=None, meta: tuple = None) -> int:
+        """Index text under key, with optional (date, term, topic_id, author), and return its doc id"""
+        if self._tail is None:
+            self._tail = Segment()
+            self._append_segment(self._tail)
+        tokens = tokenize(text)
+        counts = {}
+        for term in tokens:
+            if term not in STOPWORDS:
+                counts[term] = counts.get(term, 0) + 1
+        local = self._tail.add(key, counts, len(tokens), group, meta)
+        self.live_docs += 1
+        self.total_length += len(tokens)
+        return self.bases[-1] + local
+
+    def remove_document(self, doc_id: int):
+        """Tombstone doc_id; its postings go when its segment is next merged"""
+        if doc_id in self.deleted:
+            return
+        segment, local = self._locate(doc_id)
+        self.deleted.add(doc_id)
+        self.live_docs -= 1
+        self.total_length -= segment.doc_lengths[local]
+
+    def group(self, group) -> list:
+        """Live doc ids of a group"""
+        doc_ids = []
+        for base, segment in zip(self.bases, self.segments):
+            for local in segment.groups.get(group, ()):
+                if base + local not in self.deleted:
+                    doc_ids.append(base + local)
+        return doc_ids
+
+    def remove_group(self, group) -> int:
+        """Remove every live document of a group and return how many there were"""
+        doc_ids = self.group(group)
+        for doc_id in doc_ids:
+            self.remove_document(doc_id)
+        return len(doc_ids)
+
+    def compact(self, max_segments: int = MAX_SEGMENTS, deleted_ratio: float = COMPACT_DELETED_RATIO) -> bool:
+        """Merge segments once there are too many, or too many deleted documents.
+
+        Past deleted_ratio every segment is rewritten without its deleted
+        documents (O(corpus), but only after that many deletions); past
+        max_segments only the segments after the first are merged.
+        """
+        total = sum(len(segment) for segment in self.segments)
+        if self.deleted and len(self.deleted) > deleted_ratio * total:
+            first = 0
+        elif len(self.segments) > max_segments:
+            first = 1
+        else:
+            return False
+        merged = Segment()
+        for base, segment in zip(self.bases[first:], self.segments[first:]):
+            renumbered = {}
+            for local in range(len(segment)):
+                if base + local not in self.deleted:
+                    renumbered[local] = merged.add(
+                        segment.doc_keys[local], {}, segment.doc_lengths[local], None, segment.meta.row(local)
+                    )
+            for term, postings in segment.postings.items():
+                target = None
+                for local, tf in postings.items():
+                    new_local = renumbered.get(local)
+                    if new_local is not None:
+                        if target is None:
+                            target = merged.postings.setdefault(term, {})
+                        target[new_local] = tf
+            for group, locals_ in segment.groups.items():
+                kept = [renumbered[local] for local in locals_ if local in renumbered]
+                if kept:
+                    merged.groups.setdefault(group, []).extend(kept)
+
+        merged_base = self.bases[first] if first < len(self.bases) else 0
+        segments = self.segments[:first]
+        deleted = {doc_id for doc_id in self.deleted if doc_id < merged_base}
+        self.segments, self.bases, self.deleted = [], [], deleted
+        self.live_docs = self.total_length = 0
+        for segment in segments + ([merged] if len(merged) else []):
+            self._append_segment(segment)
+        for doc_id in deleted:
+            segment, local = self._locate(doc_id)
+            self.live_docs -= 1
+            self.total_length -= segment.doc_lengths[local]
+        self._tail = None
+        return True
+
+    def filter_keys(self, keys, filters: dict) -> set:
+        """The (section, fname, start, end) keys among keys whose live passage matches filters.
+
+        For rankings that don't come from this index, such as dense search;
+        each key is found through its file's group.
+        """
+        wanted = {}
+        for key in keys:
+            wanted.setdefault(tuple(key[:2]), set()).add(key)
+        matched = set()
+        for base, segment in zip(self.bases, self.segments):
+            matcher = segment.meta.matcher(filters)
+            for group, group_keys in wanted.items():
+                for local in segment.groups.get(group, ()):
+                    key = segment.doc_keys[local]
+                    if key not in group_keys or base + local in self.deleted:
+                        continue
+                    if matcher is None or matcher[1](local):
+                        matched.add(key)
+        return matched
+
+    def search(self, query: str, top_k: int = 10, filters: dict = None, boost: bool = True) -> list:
+        """Return up to top_k (key, score) pairs ranked by BM25.
+
+        filters (see MetadataColumns.matcher) restrict scoring to matching
+        documents; boost applies the recency/staff multipliers.
+        """
+        n_docs = self.live_docs
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs or 1.0
+        segments = list(zip(self.bases, self.segments))
+        # Per segment, (candidates, check) of the filters, or None
+        matchers = [segment.meta.matcher(filters) for _, segment in segments]
+
+        scores = {}
+        deleted = self.deleted
+        for term in set(tokenize(query)) - STOPWORDS:
+            term_postings = [(n, postings) for n, (_, segment) in enumerate(segments)
+                             if (postings := segment.postings.get(term))]
+            if not term_postings:
+                continue
+            # Deleted documents still count until their segment is merged, as in Lucene
+            df = min(sum(len(postings) for _, postings in term_postings), n_docs)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for n, postings in term_postings:
+                base, segment = segments[n]
+                lengths = segment.doc_lengths
+                matcher = matchers[n]
+                if matcher is None:
+                    candidates = postings.items()
+                else:
+                    local_allowed, check = matcher
+                    if local_allowed is not None and len(local_allowed) < len(postings):
+                        # Walk the smaller side: the filter's range, not the term's postings
+                        candidates = ((local, postings[local]) for local in local_allowed
+                                      if local in postings and check(local))
+                    else:
+                        candidates = ((local, tf) for local, tf in postings.items() if check(local))
+                for local, tf in candidates:
+                    doc_id = base + local
+                    if doc_id in deleted:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * lengths[local] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if boost:
+            newest = max((date for _, segment in segments if (date := segment.meta.newest()) is not None),
+                         default=None)
+            # Boosts are bounded multipliers, so rescoring a generous head is enough
+            head = heapq.nlargest(max(top_k * 5, 50), scores.items(), key=lambda item: item[1])
+            scores = {}
+            for doc_id, score in head:
+                segment, local = self._locate(doc_id)
+                scores[doc_id] = score * segment.meta.boost(local, newest)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_key(doc_id), score) for doc_id, score in best]
+
+
+def build_index(knowledge_base: dict) -> InvertedIndex:
+    """Build an inverted index over the passages of every knowledge-base document.
+
+    Keys are (section, fname, start, end) so results point at the passage.
+    """
+    index = InvertedIndex()
+    urls = knowledge_base.get("urls", {})
+    dates = knowledge_base.get("dates", {})
+    for section in ["course_content", "discourse_posts"]:
+        for fname, content in knowledge_base.get(section, {}).items():
+            document = document_metadata(content, urls.get((section, fname)), dates.get((section, fname)))
+            for start, end in split_passages(content):
+                index.add_document((section, fname, start, end), content[start:end], (section, fname),
+                                   passage_metadata(document, content, start, end))
+    return index
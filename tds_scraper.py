@@ -1,13 +1,14 @@
 # tds_scraper.py
 import requests
-from bs4 import BeautifulSoup
 import os
 from datetime import datetime
 import time
 import json
 import re
 
-def scrape_discourse_posts(base_url: str, output_dir: str):
+from html_parsing import parse_topic_list
+
+def scrape_discourse_posts(base_url: str, output_dir: str, limit: int = None):
     """Scrape TDS Discourse posts with updated selectors"""
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -20,22 +21,13 @@ def scrape_discourse_posts(base_url: str, output_dir: str):
             print(f"Failed to fetch page. Status code: {response.status_code}")
             return 0
             
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
         # Debug: Save the HTML for inspection
         os.makedirs(output_dir, exist_ok=True)
         with open(os.path.join(output_dir, 'debug_page.html'), 'w', encoding='utf-8') as f:
             f.write(response.text)
         
-        # New approach to find topics - looking for topic rows
-        topics = []
-        for row in soup.find_all('tr'):
-            if 'data-topic-id' in row.attrs:
-                topics.append(row)
-        
-        if not topics:
-            print("Alternative approach: Looking for topic links")
-            topics = soup.select('a.title, a.topic-title')
+        # Topic rows, or failing that bare topic links
+        topics, _ = parse_topic_list(response.content, base_url)
         
         if not topics:
             print("Could not find any topics using any method")
@@ -44,35 +36,11 @@ def scrape_discourse_posts(base_url: str, output_dir: str):
         print(f"Found {len(topics)} potential topics")
         scraped_count = 0
         
-        for topic in topics[:5]:  # Limit to 5 for testing
+        for topic in topics[:limit]:
             try:
-                # Extract topic info
-                if topic.name == 'tr':
-                    # Handle table row format
-                    title_link = topic.find('a', class_='title') or topic.find('a', class_='topic-title')
-                    date_span = topic.find('span', class_='relative-date') or topic.find('span', class_='post-time')
-                else:
-                    # Handle direct link format
-                    title_link = topic
-                    date_span = topic.find_next('span', class_='relative-date')
-                
-                if not title_link or not hasattr(title_link, 'href'):
-                    continue
-                    
-                topic_title = title_link.text.strip()
-                topic_url = title_link['href']
-                
-                # Handle relative URLs
-                if not topic_url.startswith('http'):
-                    topic_url = f"https://discourse.onlinedegree.iitm.ac.in{topic_url}"
-                
-                # Extract date - handle multiple formats
-                post_date = None
-                if date_span and hasattr(date_span, 'attrs') and 'title' in date_span.attrs:
-                    try:
-                        post_date = datetime.strptime(date_span['title'], "%Y-%m-%dT%H:%M:%S.%fZ")
-                    except ValueError:
-                        pass
+                topic_title = topic['title']
+                topic_url = topic['url']
+                post_date = topic['date']
                 
                 if not post_date:
                     print(f"Could not parse date for {topic_title}, using current date")
@@ -104,4 +72,4 @@ def scrape_discourse_posts(base_url: str, output_dir: str):
         
     except Exception as e:
         print(f"Error: {str(e)}")
-        return 0
\ No newline at end of file
+        return 0
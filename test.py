@@ -1,9 +1,9 @@
 import os
 import re
-from main import load_knowledge_base  # assuming your load function is in main.py
+from knowledge_base import load_documents
 
 # Load the knowledge base
-knowledge_base = load_knowledge_base()
+knowledge_base = load_documents()
 
 # Print some links from the knowledge base to verify they're loaded correctly
 for section in ["course_content", "discourse_posts"]:
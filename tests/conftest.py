@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The modules under test live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def serve_api(tmp_path, monkeypatch):
+    """serve_api(files) imports api/index.py serving files ({"course_content/x.md": text, ...})"""
+    def serve(files: dict):
+        monkeypatch.chdir(tmp_path)
+        for section in ["course_content", "discourse_posts"]:
+            os.makedirs(os.path.join("data", section), exist_ok=True)
+        for path, text in files.items():
+            with open(os.path.join("data", path), "w", encoding="utf-8") as f:
+                f.write(text)
+        monkeypatch.setenv("API_KEY", "test")
+        monkeypatch.setenv("KB_ARTIFACT", str(tmp_path / "missing-kb.bin"))
+        monkeypatch.syspath_prepend(os.path.join(ROOT, "api"))
+        import index
+        from index_manager import IndexManager
+
+        monkeypatch.setattr(index, "index_manager", IndexManager(index.load_knowledge_base()))
+        return index
+
+    return serve
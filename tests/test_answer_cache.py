@@ -0,0 +1,42 @@
+from answer_cache import AnswerCache
+
+CONTEXT = {"passages": [{"file": "ga4.md", "text": "The GA4 deadline is Sunday."}]}
+
+
+def test_near_tier_matches_reworded_questions():
+    cache = AnswerCache(near_duplicate_threshold=0.3)
+    cache.set("When is the GA4 deadline for submission?", CONTEXT, {"answer": "Sunday"})
+    assert cache.get("when is the GA4 deadline for submission exactly?", CONTEXT) == {"answer": "Sunday"}
+    assert cache.stats["near_hits"] == 1
+
+
+def test_images_partition_both_tiers():
+    cache = AnswerCache(near_duplicate_threshold=0.3)
+    question = "What does the error in this screenshot mean for GA4?"
+    cache.set(question, CONTEXT, {"answer": "first image"}, partition="image-a")
+
+    assert cache.get(question, CONTEXT, partition="image-b") is None
+    assert cache.get(question + " Please explain.", CONTEXT, partition="image-b") is None
+    assert cache.get(question, CONTEXT) is None
+    assert cache.get(question + " Please explain.", CONTEXT, partition="image-a") == {"answer": "first image"}
+
+
+def test_near_tier_matches_paraphrases_over_real_retrieval(serve_api):
+    api = serve_api({
+        "course_content/docker.md": "# Docker\n\nRun containers with docker compose.\n",
+        "discourse_posts/ga4.md": "# GA4\n\nThe GA4 deadline for project submission is Sunday.\n\n"
+                                  "## Late\n\nLate project submission loses marks.\n",
+    })
+    cache = AnswerCache(near_duplicate_threshold=0.5)
+    question = "When is the GA4 deadline for the project submission?"
+    reworded = "Is the GA4 deadline for the project submission on Sunday?"
+    context, reworded_context = api.search_knowledge_base(question), api.search_knowledge_base(reworded)
+    # Same passages, different scores
+    assert context != reworded_context
+
+    cache.set(question, context, {"answer": "Sunday"})
+    assert cache.get(reworded, reworded_context) == {"answer": "Sunday"}
+    assert cache.stats["near_hits"] == 1
+    # A question retrieving other passages doesn't share the answer
+    assert cache.get("When is the docker project submission deadline?",
+                     api.search_knowledge_base("When is the docker project submission deadline?")) is None
@@ -0,0 +1,29 @@
+CORPUS = {
+    "course_content/docker.md": "# Docker\n\nRun containers with docker compose.\n",
+    "discourse_posts/ga4.md": '---\nurl: "https://discourse.example/t/ga4/155"\ndate: 2025-02-01\n---\n'
+                              "# GA4\n\nDocker fails on the GA4 server.\n",
+    "discourse_posts/old.md": '---\nurl: "https://discourse.example/t/old/90"\ndate: 2024-10-01\n---\n'
+                              "# Old\n\nDocker fails on the old server.\n",
+}
+
+
+def files(context):
+    return {passage["file"] for passage in context["passages"]}
+
+
+def test_inferred_term_keeps_passages_without_a_term(serve_api):
+    api = serve_api(CORPUS)
+    assert files(api.search_knowledge_base("docker Jan 2025")) == {"docker.md", "ga4.md"}
+    # A client's own term is still a hard filter
+    assert files(api.search_knowledge_base("docker", api.SearchFilters(term="jan-2025"))) == {"ga4.md"}
+    assert files(api.search_knowledge_base("docker Sep 2024", api.SearchFilters(term="jan-2025"))) == {"ga4.md"}
+
+
+def test_date_only_until_includes_that_day(serve_api):
+    api = serve_api({
+        "discourse_posts/ga4.md": '---\ndate: 2025-03-01T10:00:00Z\n---\n# GA4\n\nDocker fails on GA4.\n',
+        "discourse_posts/ga5.md": '---\ndate: 2025-03-02T00:00:00Z\n---\n# GA5\n\nDocker fails on GA5.\n',
+    })
+    assert files(api.search_knowledge_base("docker", api.SearchFilters(until="2025-03-01"))) == {"ga4.md"}
+    assert files(api.search_knowledge_base("docker", api.SearchFilters(until="2025-03-01T09:00:00Z"))) == set()
+    assert files(api.search_knowledge_base("docker", api.SearchFilters(since="2025-03-01"))) == {"ga4.md", "ga5.md"}
@@ -0,0 +1,44 @@
+import json
+
+from crawler import CrawlState
+
+
+def topic(n):
+    return {"kind": "topic", "url": f"https://d/t/t/{n}", "title": f"T{n}", "date": None}
+
+
+def test_state_log_replays_and_retries_failures(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = CrawlState(path)
+    for n in range(3):
+        state.add(topic(n))
+    state.finish(topic(0)["url"])
+    state.finish(topic(1)["url"], error="404")
+    state.save()
+    # A crash mid-write leaves a partial last line
+    state._log.write('{"event": "fin')
+    state.close()
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 7
+
+    state = CrawlState(path)
+    assert state.done == {topic(0)["url"]}
+    assert list(state.pending) == [topic(2)["url"]]
+    assert state.failed == {topic(1)["url"]: "404"}
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1  # compacted to a snapshot
+
+    assert state.retry_failed() == 1
+    assert topic(1)["url"] in state.pending
+    assert not state.add(topic(0))
+    state.finish(topic(1)["url"])
+    state.close()
+    assert CrawlState(path).failed == {}
+
+
+def test_reads_a_pre_log_checkpoint(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps({"pending": [topic(1)], "done": ["https://d/c/x"], "failed": {}}), encoding="utf-8")
+    state = CrawlState(str(path))
+    assert list(state.pending) == [topic(1)["url"]] and state.done == {"https://d/c/x"}
+    state.close()
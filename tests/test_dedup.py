@@ -0,0 +1,59 @@
+import json
+
+from dedup import dedup_records, dedup_topics, remove_passages
+from document_store import DocumentStore
+from knowledge_base import iter_records
+
+BODY = ("Docker compose lets you run the whole project stack with one command, "
+        "and the graders use the same compose file to start your containers.")
+OTHER = ("Pandas groupby splits the frame into groups, applies a function to each "
+         "group and combines the results into a new frame for the assignment.")
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_dropped_duplicates_become_sources(tmp_path):
+    write_jsonl(tmp_path / "posts.jsonl", [
+        {"section": "discourse_posts", "id": "a.md", "url": "https://d/t/a/1", "text": BODY, "links": []},
+        {"section": "discourse_posts", "id": "b.md", "url": "https://d/t/b/2", "text": BODY + " ", "links": []},
+        {"section": "discourse_posts", "id": "c.md", "url": "https://d/t/c/3", "text": OTHER, "links": []},
+    ])
+    stats = dedup_records(str(tmp_path))
+    assert (stats["records"], stats["dropped"]) == (3, 1)
+
+    kb = DocumentStore.build(iter_records(str(tmp_path))).as_kb()
+    assert sorted(kb["discourse_posts"]) == ["a.md", "c.md"]
+    assert kb["urls"][("discourse_posts", "a.md")] == "https://d/t/a/1"
+    assert kb["sources"][("discourse_posts", "a.md")] == ["https://d/t/b/2"]
+    assert kb["sources"][("discourse_posts", "c.md")] == []
+
+
+def test_dedup_topic_files(tmp_path):
+    def topic(url, *contents):
+        return {"title": "t", "url": url, "content": contents[0],
+                "posts": [{"author": "x", "post_number": str(n), "content": c, "links": []}
+                          for n, c in enumerate(contents, 1)]}
+
+    for name, data in [("20250101_a.json", topic("https://d/t/a/1", BODY, OTHER)),
+                       ("20250101_a_.json", topic("https://d/t/a/1?page=1", BODY, OTHER)),
+                       ("20250102_b.json", topic("https://d/t/b/2", "Thanks, that fixed it for me.", OTHER))]:
+        (tmp_path / name).write_text(json.dumps(data), encoding="utf-8")
+    (tmp_path / ".crawl_state.json").write_text(json.dumps({"done": []}), encoding="utf-8")
+
+    stats = dedup_topics(str(tmp_path))
+    assert (stats["topics"], stats["dropped"], stats["trimmed"]) == (3, 1, 1)
+    assert not (tmp_path / "20250101_a_.json").exists()
+    kept = json.loads((tmp_path / "20250101_a.json").read_text(encoding="utf-8"))
+    assert kept["sources"] == ["https://d/t/a/1", "https://d/t/a/1?page=1", "https://d/t/b/2"]
+    trimmed = json.loads((tmp_path / "20250102_b.json").read_text(encoding="utf-8"))
+    assert [post["content"] for post in trimmed["posts"]] == ["Thanks, that fixed it for me."]
+    assert (tmp_path / ".crawl_state.json").exists()
+
+
+def test_remove_passages_keeps_front_matter():
+    text = f'---\nurl: "https://d/t/a/1"\n---\n# A\n\n{BODY} {BODY}\n# B\n\n{OTHER}\n'
+    assert remove_passages(text, [0]) == f'---\nurl: "https://d/t/a/1"\n---\n# B\n\n{OTHER}\n'
@@ -0,0 +1,106 @@
+import json
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import discourse_api
+from discourse_api import retry_delay, sync_incremental
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeDiscourse:
+    """Just enough of the Discourse JSON API: one topic, 20 posts inlined"""
+
+    def __init__(self, n_posts):
+        self.posts = {i: {"id": i, "post_number": i, "username": "u", "updated_at": "v1", "version": 1,
+                          "cooked": f"post {i}"} for i in range(1, n_posts + 1)}
+        self.bumped_at = "2025-01-01T00:00:00Z"
+        self.errors = []
+        self.headers = {}
+        # posts.json, forum-wide, served newest first two per page
+        self.latest = []
+        self.latest_requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        if self.errors:
+            return self.errors.pop(0)
+        stream = sorted(self.posts)
+        if url.endswith("/latest.json"):
+            topic = {"id": 7, "slug": "t", "title": "T", "bumped_at": self.bumped_at,
+                     "highest_post_number": max(stream)}
+            return FakeResponse(200, {"topic_list": {"topics": [topic]}})
+        if url.endswith("/posts.json") and "/t/" not in url:
+            self.latest_requests.append(params)
+            before = (params or {}).get("before", float("inf"))
+            page = sorted((p for p in self.latest if p["id"] < before), key=lambda p: -p["id"])[:2]
+            return FakeResponse(200, {"latest_posts": page})
+        if url.endswith("/t/7.json"):
+            return FakeResponse(200, {"title": "T", "slug": "t", "post_stream": {
+                "stream": stream, "posts": [self.posts[i] for i in stream[:20]]}})
+        ids = [int(i) for i in params["post_ids[]"]]
+        return FakeResponse(200, {"post_stream": {"posts": [self.posts[i] for i in ids if i in self.posts]}})
+
+
+def run_sync(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(discourse_api.requests, "Session", lambda: server)
+    sync_incremental(str(tmp_path), base_url="https://discourse.example", delay=0)
+    with open(tmp_path / "topics" / "7.json", encoding="utf-8") as f:
+        return {post["id"]: post for post in json.load(f)["posts"]}
+
+
+def test_sync_refetches_edits_and_drops_deleted_posts(tmp_path, monkeypatch):
+    server = FakeDiscourse(26)
+    assert len(run_sync(tmp_path, server, monkeypatch)) == 26
+
+    server.posts[22].update(updated_at="v2", version=2, cooked="edited")
+    del server.posts[5]
+    server.bumped_at = "2025-01-02T00:00:00Z"
+    posts = run_sync(tmp_path, server, monkeypatch)
+    assert posts[22]["updated_at"] == "v2" and posts[22]["cooked"] == "edited"
+    assert 5 not in posts and len(posts) == 25
+
+
+def test_latest_posts_start_at_the_newest_post_and_skip_other_categories(tmp_path, monkeypatch):
+    server = FakeDiscourse(3)
+    server.latest = [{"id": i, "topic_id": 7} for i in range(1, 101)]
+    run_sync(tmp_path, server, monkeypatch)
+    # The first sync records the newest id without walking back through history
+    assert server.latest_requests == [None]
+    assert not (tmp_path / "posts.jsonl").exists()
+
+    server.latest += [{"id": 101, "topic_id": 7}, {"id": 102, "topic_id": 99}, {"id": 103, "topic_id": 7}]
+    server.latest_requests = []
+    run_sync(tmp_path, server, monkeypatch)
+    assert len(server.latest_requests) == 2
+    with open(tmp_path / "posts.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == [101, 103]
+
+
+def test_retries_5xx_and_http_date_retry_after(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(discourse_api.time, "sleep", sleeps.append)
+    server = FakeDiscourse(3)
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    server.errors = [FakeResponse(503, headers={"Retry-After": later}), FakeResponse(429, headers={"Retry-After": "2"}),
+                     FakeResponse(502)]
+    assert len(run_sync(tmp_path, server, monkeypatch)) == 3
+    assert 25 < sleeps[0] <= 30 and sleeps[1:3] == [2.0, 4]
+
+
+def test_retry_delay():
+    assert retry_delay("5", 1) == 5.0
+    assert retry_delay(None, 1) == 1
+    assert retry_delay("not a date", 3) == 3
+    assert retry_delay("Wed, 21 Oct 2015 07:28:00 GMT", 1) == 0.0
@@ -0,0 +1,14 @@
+from html_parsing import ParserPool
+
+TOPIC = (b'<div class="topic-container"><h1>GA4</h1></div>'
+         b'<div class="topic-post" data-username="u" data-post-number="1"><div class="post">Hello</div></div>')
+
+
+def test_map_handles_empty_input_and_generators():
+    with ParserPool(1, "html.parser") as pool:
+        assert list(pool.map([])) == []
+        assert list(pool.map(iter([]))) == []
+        pages = (("topic", TOPIC, None) for _ in range(3))
+        assert [topic["title"] for topic in pool.map(pages)] == ["GA4"] * 3
+    with ParserPool(0, "html.parser") as pool:
+        assert list(pool.map([])) == []
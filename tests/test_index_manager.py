@@ -0,0 +1,148 @@
+import json
+import os
+
+from document_store import DocumentStore
+from index_manager import IndexManager, OverlaySection
+from knowledge_base import iter_files, iter_records
+from search_index import MAX_SEGMENTS, build_index
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # Make sure the stamp changes even on filesystems with coarse mtimes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def make_manager(tmp_path):
+    course_dir = tmp_path / "course_content"
+    discourse_dir = tmp_path / "discourse_posts"
+    course_dir.mkdir()
+    discourse_dir.mkdir()
+    write(course_dir / "docker.md", "# Docker\n\nRun zanzibar containers with docker compose.\n")
+    write(discourse_dir / "ga4.md", "# GA4\n\nThe quokka deadline for GA4 is Sunday.\n")
+    kb = DocumentStore.build(iter_files(str(course_dir), str(discourse_dir))).as_kb()
+    kb["index"] = build_index(kb)
+    manager = IndexManager(kb, str(course_dir), str(discourse_dir))
+    manager.refresh()
+    return manager, course_dir, discourse_dir
+
+
+def top_file(manager, query):
+    results = manager.current["index"].search(query, 1)
+    return results[0][0][1] if results else None
+
+
+def test_edit_then_reload(tmp_path):
+    manager, course_dir, _ = make_manager(tmp_path)
+    assert top_file(manager, "zanzibar") == "docker.md"
+
+    # Terms unique to the file lose all their postings, then come back
+    write(course_dir / "docker.md", "# Docker\n\nRun zanzibar containers with podman instead.\n")
+    summary = manager.refresh()
+    assert summary["changed"] == 1
+    assert top_file(manager, "podman") == "docker.md"
+    assert top_file(manager, "zanzibar") == "docker.md"
+    assert top_file(manager, "compose") is None
+
+    # And again, so a second reload over the patched version works too
+    write(course_dir / "docker.md", "# Docker\n\nzanzibar compose files, revisited.\n")
+    assert manager.refresh()["changed"] == 1
+    assert top_file(manager, "compose") == "docker.md"
+    assert top_file(manager, "podman") is None
+
+
+def test_add_and_delete_then_reload(tmp_path):
+    manager, course_dir, discourse_dir = make_manager(tmp_path)
+    old = manager.current
+
+    write(discourse_dir / "new.md", "# New\n\nA wombat question about pandas.\n")
+    os.remove(course_dir / "docker.md")
+    summary = manager.refresh()
+    assert (summary["added"], summary["deleted"]) == (1, 1)
+    assert top_file(manager, "wombat") == "new.md"
+    assert top_file(manager, "zanzibar") is None
+    assert "docker.md" not in manager.current["course_content"]
+
+    # The previous snapshot keeps serving unchanged
+    assert old["index"].search("zanzibar", 1)[0][0][1] == "docker.md"
+    assert not old["index"].search("wombat", 1)
+
+
+def test_reloads_stay_compact(tmp_path, monkeypatch):
+    import index_manager
+    monkeypatch.setattr(index_manager, "OVERLAY_COMPACT_MIN", 3)
+    manager, course_dir, _ = make_manager(tmp_path)
+
+    for i in range(12):
+        write(course_dir / "docker.md", f"# Docker\n\nzanzibar revision{i} notes.\n")
+        manager.refresh()
+        index = manager.current["index"]
+        assert len(index.segments) <= MAX_SEGMENTS
+        # Tombstones are merged away before they pile up
+        assert len(index.deleted) <= index.live_docs
+        section = manager.current["course_content"]
+        assert not isinstance(section, OverlaySection) or len(section.changes) <= 3
+
+    assert top_file(manager, "revision11") == "docker.md"
+    assert top_file(manager, "revision10") is None
+    assert top_file(manager, "quokka") == "ga4.md"
+    assert manager.current["course_content"]["docker.md"].endswith("revision11 notes.\n")
+
+
+def test_vector_update_and_compact():
+    from vector_index import HashingEmbedder, VectorIndex
+
+    embedder = HashingEmbedder()
+    chunks = [("course_content", "a.md", "alpha apples"), ("course_content", "b.md", "beta bananas")]
+    vectors = VectorIndex(embedder.embed([text for _, _, text in chunks]), chunks, embedder)
+
+    for i in range(20):
+        vectors = vectors.updated({("course_content", "a.md"): f"alpha apples version{i}"})
+    assert len(vectors) == 2
+    assert len(vectors.blocks) <= 8
+    assert vectors.search("version19 apples", 1)[0][0][1] == "a.md"
+    assert vectors.search("bananas", 1)[0][0][1] == "b.md"
+
+    vectors = vectors.updated({("course_content", "b.md"): None})
+    assert [chunk[1] for chunk, _ in vectors.search("bananas", 5)] == ["a.md"]
+
+
+def write_records(path, records):
+    lines = []
+    for section, record_id, text in records:
+        record = {"section": section, "id": record_id, "text": text, "url": f"https://example.com/{record_id}",
+                  "date": "2025-01-15", "links": []}
+        lines.append(json.dumps(record) + "\n")
+    write(path, "".join(lines))
+
+
+def test_records_mode_reload(tmp_path):
+    records_dir = tmp_path / "records"
+    records_dir.mkdir()
+    write_records(records_dir / "course.jsonl", [
+        ("course_content", "zip/docker.md", "# Docker\n\nzanzibar compose.\n"),
+        ("course_content", "zip/git.md", "# Git\n\nCommit and push.\n"),
+    ])
+    kb = DocumentStore.build(iter_records(str(records_dir))).as_kb()
+    kb["index"] = build_index(kb)
+    manager = IndexManager(kb, str(tmp_path / "missing"), str(tmp_path / "missing"), records_dir=str(records_dir))
+    manager.refresh()
+
+    # Re-ingest: one record edited, one unchanged, one dropped; plus a new file
+    write_records(records_dir / "course.jsonl", [
+        ("course_content", "zip/docker.md", "# Docker\n\nzanzibar podman.\n"),
+    ])
+    write_records(records_dir / "discourse.jsonl", [("discourse_posts", "zip/ga4.md", "# GA4\n\nquokka.\n")])
+    summary = manager.refresh()
+    assert (summary["added"], summary["changed"], summary["deleted"]) == (1, 1, 1)
+    assert top_file(manager, "podman") == "zip/docker.md"
+    assert top_file(manager, "push") is None
+    assert top_file(manager, "quokka") == "zip/ga4.md"
+    assert manager.current["urls"][("discourse_posts", "zip/ga4.md")] == "https://example.com/zip/ga4.md"
+    assert len(manager.current["index"]) == 2
+
+    # Rewriting a file with identical records changes nothing
+    write_records(records_dir / "discourse.jsonl", [("discourse_posts", "zip/ga4.md", "# GA4\n\nquokka.\n")])
+    assert manager.refresh()["changed"] == 0
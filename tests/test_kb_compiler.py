@@ -0,0 +1,65 @@
+from document_store import DocumentStore
+from index_manager import IndexManager
+from kb_compiler import compile_knowledge_base, load_artifact
+from knowledge_base import iter_files, parse_date
+from search_index import build_index
+
+from test_index_manager import top_file, write
+
+
+def make_corpus(tmp_path):
+    course_dir = tmp_path / "course_content"
+    discourse_dir = tmp_path / "discourse_posts"
+    course_dir.mkdir()
+    discourse_dir.mkdir()
+    write(course_dir / "docker.md", "# Docker Jan 2025\n\nRun zanzibar containers with docker compose.\n")
+    write(course_dir / "git.md", "# Git\n\nCommit zanzibar changes, then push.\n")
+    write(discourse_dir / "ga4.md",
+          '---\nurl: "https://discourse.example/t/ga4/155"\ndate: 2025-03-01\n---\n'
+          "# GA4\n\nThe quokka deadline for [GA4](https://example.com/ga4) is Sunday.\n")
+    write(discourse_dir / "ga5.md",
+          '---\nurl: "https://discourse.example/t/ga5/160"\ndate: 2025-06-01\n---\n'
+          "# GA5\n\nThe quokka deadline for GA5 moved.\n")
+    kb = DocumentStore.build(iter_files(str(course_dir), str(discourse_dir))).as_kb()
+    compile_knowledge_base(kb, str(tmp_path / "kb.bin"))
+    return kb, course_dir, discourse_dir
+
+
+def test_artifact_matches_built_index(tmp_path):
+    kb, _, _ = make_corpus(tmp_path)
+    artifact = load_artifact(str(tmp_path / "kb.bin"))
+    index = build_index(kb)
+
+    assert sorted(artifact["course_content"]) == ["docker.md", "git.md"]
+    assert artifact["discourse_posts"]["ga4.md"] == kb["discourse_posts"]["ga4.md"]
+    assert "missing.md" not in artifact["discourse_posts"]
+    for key in kb["urls"]:
+        assert artifact["urls"][key] == kb["urls"][key]
+        assert artifact["dates"][key] == kb["dates"][key]
+        assert artifact["links"][key] == kb["links"][key]
+
+    for filters in [None, {"term": "jan-2025"}, {"topic_id": 160},
+                    {"since": parse_date("2025-05-01")}, {"until": parse_date("2025-04-01")}]:
+        for query in ["zanzibar", "quokka deadline", "docker push"]:
+            expected = index.search(query, 5, filters=filters)
+            assert sorted(artifact["index"].search(query, 5, filters=filters)) == sorted(expected)
+
+
+def test_reload_over_artifact(tmp_path):
+    _, course_dir, discourse_dir = make_corpus(tmp_path)
+    manager = IndexManager(load_artifact(str(tmp_path / "kb.bin")), str(course_dir), str(discourse_dir))
+    manager.refresh()
+
+    write(course_dir / "docker.md", "# Docker\n\nRun zanzibar containers with podman.\n")
+    assert manager.refresh()["changed"] == 1
+    assert top_file(manager, "podman") == "docker.md"
+    assert top_file(manager, "compose") is None
+    assert top_file(manager, "push") == "git.md"
+
+    # Enough deletions to merge the mapped segment into memory
+    (course_dir / "git.md").unlink()
+    (discourse_dir / "ga5.md").unlink()
+    manager.refresh()
+    assert top_file(manager, "quokka") == "ga4.md"
+    assert top_file(manager, "push") is None
+    assert len(manager.current["index"]) == 2
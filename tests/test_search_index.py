@@ -0,0 +1,56 @@
+import random
+
+from knowledge_base import split_passages
+from search_index import InvertedIndex, build_index
+
+TERMS = ["jan-2025", "may-2025", None]
+
+
+def make_index():
+    """Two segments, one file removed, and random metadata with gaps"""
+    rng = random.Random(7)
+    words = [f"w{i}" for i in range(200)]
+    index = InvertedIndex()
+    rows = {}
+    for i in range(1500):
+        if i == 1000:
+            index = index.copy()
+        key = ("discourse_posts", f"f{i // 5}.md", i, i + 1)
+        meta = (rng.choice([None, 1_700_000_000 + i]), rng.choice(TERMS), rng.choice([None, i // 50]),
+                rng.choice([None, f"u{i % 7}"]))
+        index.add_document(key, " ".join(rng.choices(words, k=30)), key[:2], meta)
+        rows[key] = meta
+    index.remove_group(("discourse_posts", "f3.md"))
+    return index, rows
+
+
+def matches(meta, filters):
+    date, term, topic_id, author = meta
+    if "since" in filters and (date is None or date < filters["since"]):
+        return False
+    if "until" in filters and (date is None or date > filters["until"]):
+        return False
+    if "term" in filters and term != filters["term"]:
+        return False
+    if "topic_id" in filters and topic_id != filters["topic_id"]:
+        return False
+    return "authors" not in filters or author in filters["authors"]
+
+
+def test_filters_match_brute_force():
+    index, rows = make_index()
+    for filters in [{"term": "jan-2025"}, {"term": "sep-2030"}, {"topic_id": 10},
+                    {"since": 1_700_000_900, "until": 1_700_001_200}, {"authors": ["u1", "u2"], "term": "may-2025"}]:
+        for query in ["w1 w2", "w5", "w7 w8 w9"]:
+            ranked = index.search(query, len(rows), boost=False)
+            expected = [(key, score) for key, score in ranked if matches(rows[key], filters)]
+            assert sorted(index.search(query, len(rows), filters, boost=False)) == sorted(expected)
+            assert index.filter_keys([key for key, _ in ranked], filters) == {key for key, _ in expected}
+
+
+def test_front_matter_is_not_passage_text():
+    text = '---\nurl: "https://discourse.example/t/ga5-question/160"\ndate: 2025-06-01\n---\n# GA5\n\nThe deadline moved.\n'
+    assert [text[start:end] for start, end in split_passages(text)] == ["# GA5\n\nThe deadline moved.\n"]
+    index = build_index({"discourse_posts": {"ga5.md": text}, "urls": {}, "dates": {}})
+    assert index.search("discourse example question") == []
+    assert index.search("ga5 deadline")[0][0] == ("discourse_posts", "ga5.md", text.index("# GA5"), len(text))
@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from upstream import AdaptiveLimiter, Overloaded, RetryBudget, Upstream
+
+
+class StatusError(Exception):
+    """An upstream HTTP error, as classify() sees openai's"""
+
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.response = None
+
+
+class FakeUpstream:
+    """factory() for Upstream.call: replies with results in order, raising any exceptions among them.
+
+    A result of "hang" waits until released; every call's start time is recorded.
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.starts = []
+        self.released = None
+
+    async def __call__(self):
+        loop = asyncio.get_running_loop()
+        if self.released is None:
+            self.released = asyncio.Event()
+        self.starts.append(loop.time())
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if result == "hang":
+            await self.released.wait()
+            return "late"
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    async def main():
+        fake = FakeUpstream("hang")
+        upstream = Upstream(hedge_after=0)
+        calls = [asyncio.ensure_future(upstream.call("same question", fake)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        # One caller giving up doesn't cancel the shared call for the rest
+        calls[0].cancel()
+        fake.released.set()
+        results = await asyncio.gather(*calls[1:])
+        return fake, results
+
+    fake, results = asyncio.run(main())
+    assert len(fake.starts) == 1
+    assert results == ["late"] * 4
+
+
+def test_429_halves_the_limit_once_per_window():
+    async def main():
+        limiter = AdaptiveLimiter(initial=16, latency_target=10)
+        upstream = Upstream(limiter, max_retries=0, hedge_after=0)
+        fake = FakeUpstream(StatusError(429))
+        burst = await asyncio.gather(*[upstream.call(None, fake) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(error, StatusError) for error in burst)
+        assert limiter.limit == 8
+
+        # Once the window has passed, the next 429 halves it again
+        limiter._last_decrease -= 1.0
+        with pytest.raises(StatusError):
+            await upstream.call(None, fake)
+        assert limiter.limit == 4
+
+    asyncio.run(main())
+
+
+def test_full_queue_sheds_with_overloaded():
+    async def main():
+        limiter = AdaptiveLimiter(initial=1, maximum=1, max_queue=1)
+        upstream = Upstream(limiter, hedge_after=0)
+        fake = FakeUpstream("hang")
+        running = asyncio.ensure_future(upstream.call(None, fake))
+        queued = asyncio.ensure_future(upstream.call(None, fake))
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 1 and len(limiter._waiters) == 1
+        with pytest.raises(Overloaded):
+            await upstream.call(None, fake)
+
+        fake.released.set()
+        assert await asyncio.gather(running, queued) == ["late", "late"]
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_sheds_with_overloaded():
+    async def main():
+        limiter = AdaptiveLimiter(initial=1, maximum=1, queue_timeout=0.01)
+        upstream = Upstream(limiter, hedge_after=0)
+        fake = FakeUpstream("hang")
+        running = asyncio.ensure_future(upstream.call(None, fake))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await upstream.call(None, fake)
+        assert not limiter._waiters
+        fake.released.set()
+        await running
+
+    asyncio.run(main())
+
+
+def hedging_upstream(initial: int, p95: float):
+    limiter = AdaptiveLimiter(initial=initial, maximum=initial)
+    limiter.latencies.extend([p95] * 20)
+    return Upstream(limiter)
+
+
+def test_hedge_fires_after_the_p95():
+    async def main():
+        upstream = hedging_upstream(initial=4, p95=0.05)
+        fake = FakeUpstream("hang", "fast")
+        assert await upstream.call(None, fake) == "fast"
+        fake.released.set()
+        return fake
+
+    fake = asyncio.run(main())
+    assert len(fake.starts) == 2
+    assert fake.starts[1] - fake.starts[0] >= 0.049
+
+
+def test_hedge_needs_spare_capacity_and_latency_history():
+    async def main(upstream):
+        fake = FakeUpstream("hang", "fast")
+        call = asyncio.ensure_future(upstream.call(None, fake))
+        await asyncio.sleep(0.1)
+        fake.released.set()
+        assert await call == "late"
+        return fake
+
+    # Every slot taken: the hedge would have to queue
+    assert len(asyncio.run(main(hedging_upstream(initial=1, p95=0.01))).starts) == 1
+    # Fewer than 20 latencies: no p95 yet
+    assert len(asyncio.run(main(Upstream(AdaptiveLimiter(initial=4)))).starts) == 1
+
+
+def test_exhausted_retry_budget_stops_retries():
+    async def main(budget):
+        upstream = Upstream(max_retries=5, backoff=0, hedge_after=0, budget=budget)
+        fake = FakeUpstream(StatusError(503), StatusError(503), "ok")
+        try:
+            return await upstream.call(None, fake), len(fake.starts)
+        except StatusError:
+            return None, len(fake.starts)
+
+    assert asyncio.run(main(RetryBudget())) == ("ok", 3)
+    # One token buys one retry, no more
+    assert asyncio.run(main(RetryBudget(ratio=1, cap=1))) == (None, 2)
+    assert asyncio.run(main(RetryBudget(ratio=0, cap=0))) == (None, 1)
+
+
+def test_attempt_timeouts_retry_within_the_deadline():
+    async def main(deadline):
+        upstream = Upstream(attempt_timeout=0.02, deadline=deadline, backoff=0, hedge_after=0)
+        fake = FakeUpstream("hang", "ok")
+        try:
+            return await upstream.call(None, fake), len(fake.starts)
+        except asyncio.TimeoutError:
+            return None, len(fake.starts)
+
+    # A hung attempt times out and is retried
+    assert asyncio.run(main(deadline=1.0)) == ("ok", 2)
+    # The deadline caps the attempt timeout, leaving no time to retry
+    assert asyncio.run(main(deadline=0.01)) == (None, 1)
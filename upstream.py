@@ -0,0 +1,288 @@
+"""
+Protection for calls to the LLM upstream.
+
+Every call goes through one Upstream, which combines:
+
+- single-flight: concurrent calls with the same key share one upstream call
+- an AIMD concurrency limit: +1 per window of on-target responses, halved on
+  429/503, timeouts or responses slower than the latency target
+- a bounded wait queue: calls beyond it, or waiting longer than the queue
+  timeout, are shed with Overloaded instead of piling up
+- per-attempt timeouts within an overall deadline, and retries with
+  jittered backoff that honour Retry-After
+- hedging: a second attempt once the first is slower than the recent p95
+- a retry budget, so retries and hedges stay a small fraction of traffic
+  and an upstream outage does not turn into a retry storm
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import openai
+
+import metrics
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Statuses that mean "send less", as opposed to plain failures
+OVERLOAD_STATUSES = {429, 503}
+
+EVENTS = metrics.Counter("tds_llm_upstream_events_total",
+                         "Coalesced, shed, hedged, retried and timed-out LLM upstream calls")
+
+
+class Overloaded(RuntimeError):
+    """The upstream limiter's queue is full; the call was shed"""
+
+
+def classify(error: Exception):
+    """Return (retryable, overload, retry_after seconds or None) for an upstream error"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True, True, None
+    if isinstance(error, openai.APIConnectionError):
+        return True, False, None
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return False, False, None
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        value = response.headers.get("retry-after", "")
+        retry_after = float(value) if value.replace(".", "", 1).isdigit() else None
+    return status in RETRY_STATUSES, status in OVERLOAD_STATUSES, retry_after
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded FIFO wait queue"""
+
+    def __init__(self, initial: int = 16, minimum: int = 1, maximum: int = 64,
+                 latency_target: float = 10.0, max_queue: int = 256, queue_timeout: float = 10.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.latencies = deque(maxlen=200)
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < max(1, int(self.limit)) and not self._waiters:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self):
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.max_queue:
+            EVENTS.inc(event="shed")
+            raise Overloaded("LLM upstream is overloaded, try again shortly")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release() hands the slot over by resolving the future
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._drop(waiter)
+            EVENTS.inc(event="shed")
+            raise Overloaded("Timed out waiting for LLM upstream capacity")
+        except asyncio.CancelledError:
+            self._drop(waiter)
+            raise
+
+    def _drop(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # Granted just as we gave up: pass the slot on
+            self.release(None, None)
+        else:
+            waiter.cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, latency, outcome):
+        """Free a slot. outcome: "ok" (with latency), "overload", or None for no signal"""
+        self.in_flight -= 1
+        if outcome == "ok":
+            self.latencies.append(latency)
+            if latency > self.latency_target:
+                self._decrease()
+            else:
+                # +1 per limit's worth of responses, i.e. about one per round trip
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif outcome == "overload":
+            self._decrease()
+        while self._waiters and self.in_flight < max(1, int(self.limit)):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _decrease(self):
+        now = time.monotonic()
+        # One halving per latency-target window, not one per failed call of a burst
+        if now - self._last_decrease >= min(self.latency_target, 1.0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+    def p95(self):
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class RetryBudget:
+    """Each first attempt deposits `ratio` tokens; each retry or hedge spends one"""
+
+    def __init__(self, ratio: float = 0.1, cap: float = 10.0):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+
+    def deposit(self):
+        self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Upstream:
+    def __init__(self, limiter: AdaptiveLimiter = None, attempt_timeout: float = 30.0, deadline: float = 60.0,
+                 max_retries: int = 2, backoff: float = 0.5, hedge_after: float = None, budget: RetryBudget = None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # None: hedge after the recent p95 latency; 0: never hedge
+        self.hedge_after = hedge_after
+        self.budget = budget or RetryBudget()
+        self._in_flight = {}
+
+    @classmethod
+    def from_env(cls) -> "Upstream":
+        hedge_after = os.getenv("LLM_HEDGE_AFTER", "")
+        limiter = AdaptiveLimiter(
+            initial=int(os.getenv("LLM_CONCURRENCY", "16")),
+            minimum=int(os.getenv("LLM_CONCURRENCY_MIN", "1")),
+            maximum=int(os.getenv("LLM_CONCURRENCY_MAX", "64")),
+            latency_target=float(os.getenv("LLM_LATENCY_TARGET", "10")),
+            max_queue=int(os.getenv("LLM_QUEUE_SIZE", "256")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+        )
+        return cls(
+            limiter,
+            attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30")),
+            deadline=float(os.getenv("LLM_DEADLINE", "60")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+            hedge_after=float(hedge_after) if hedge_after else None
+        )
+
+    async def call(self, key, factory, hedge: bool = True):
+        """Run await factory() under the limiter with timeouts, retries and hedging.
+
+        Calls made while another with the same key (unless None) is in
+        flight wait for that one's result instead of calling upstream.
+        """
+        if key is None:
+            return await self._call(factory, hedge)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(factory, hedge))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            EVENTS.inc(event="coalesced")
+        # Shielded so one caller disconnecting does not cancel the others' call
+        return await asyncio.shield(task)
+
+    async def _call(self, factory, hedge: bool):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await (self._hedged(factory, deadline) if hedge else self._attempt(factory, deadline))
+            except Overloaded:
+                raise
+            except Exception as e:
+                retryable, _, retry_after = classify(e)
+                attempt += 1
+                if not retryable or attempt > self.max_retries:
+                    raise
+                delay = max(retry_after or 0.0, self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                if loop.time() + delay >= deadline or not self.budget.withdraw():
+                    raise
+                EVENTS.inc(event="retry")
+                await asyncio.sleep(delay)
+
+    def _hedge_delay(self):
+        if self.hedge_after is not None:
+            return self.hedge_after or None
+        return self.limiter.p95()
+
+    async def _hedged(self, factory, deadline: float):
+        tasks = [asyncio.ensure_future(self._attempt(factory, deadline))]
+        try:
+            hedge_after = self._hedge_delay()
+            if hedge_after:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                # Only hedge into spare capacity, never by queueing
+                if not done and self.limiter.try_acquire():
+                    if self.budget.withdraw():
+                        EVENTS.inc(event="hedge")
+                        tasks.append(asyncio.ensure_future(self._attempt(factory, deadline, acquired=True)))
+                    else:
+                        self.limiter.release(None, None)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(self, factory, deadline: float, acquired: bool = False):
+        if not acquired:
+            await self.limiter.acquire()
+        start = time.monotonic()
+        outcome = None
+        try:
+            timeout = min(self.attempt_timeout, deadline - asyncio.get_running_loop().time())
+            result = await asyncio.wait_for(factory(), max(timeout, 0.001))
+            outcome = "ok"
+            return result
+        except asyncio.TimeoutError:
+            EVENTS.inc(event="timeout")
+            outcome = "overload"
+            raise
+        except Exception as e:
+            outcome = "overload" if classify(e)[1] else None
+            raise
+        finally:
+            self.limiter.release(time.monotonic() - start, outcome)
+
+    def metrics_lines(self) -> list:
+        lines = EVENTS.render()
+        for name, value, description in [
+            ("tds_llm_concurrency_limit", self.limiter.limit, "Current adaptive LLM concurrency limit"),
+            ("tds_llm_in_flight", self.limiter.in_flight, "LLM upstream calls in flight"),
+            ("tds_llm_queued", len(self.limiter._waiters), "LLM upstream calls waiting for a slot")
+        ]:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return lines
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Embedding index for semantic retrieval over the knowledge base.
+
+Documents are split into heading/post passages (see split_passages),
+embedded offline and saved as a NumPy matrix so a query costs one batched
+dot product plus an argpartition top-k. Build it with:
+
+    python vector_index.py --output data/vector_index
+"""
+
+import argparse
+import bisect
+import json
+import os
+import zlib
+
+import numpy as np
+
+from knowledge_base import load_documents, split_passages
+from search_index import COMPACT_DELETED_RATIO, MAX_SEGMENTS, tokenize
+
+
+class HashingEmbedder:
+    """Local stand-in embedder using signed feature hashing of unigrams and bigrams.
+
+    Needs no model download or network access, and is deterministic across
+    processes (crc32 rather than the salted built-in hash).
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _features(self, text: str):
+        tokens = tokenize(text)
+        yield from tokens
+        for a, b in zip(tokens, tokens[1:]):
+            yield f"{a} {b}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerEmbedder:
+    """Embedder backed by a locally cached sentence-transformers model"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def embed(self, texts: list) -> np.ndarray:
+        return self.model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def get_embedder(name: str = "hashing"):
+    """Return the embedder registered under name"""
+    if name == "hashing":
+        return HashingEmbedder()
+    return SentenceTransformerEmbedder(name)
+
+
+class VectorBlock:
+    """Embeddings of a run of chunks; never modified once part of an index"""
+
+    def __init__(self, embeddings: np.ndarray, chunks: list):
+        self.embeddings = embeddings
+        self.chunks = chunks
+        self._files = None
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def files(self) -> dict:
+        """(section, fname) -> the file's rows, built on first use"""
+        if self._files is None:
+            files = {}
+            for row, chunk in enumerate(self.chunks):
+                files.setdefault(chunk[:2], []).append(row)
+            self._files = files
+        return self._files
+
+
+class VectorIndex:
+    """Chunk embeddings plus the (section, fname, start, end) of every chunk.
+
+    The matrix is kept as blocks: updated() embeds changed files into a new
+    block and masks the rows they replace, so an update costs time
+    proportional to its delta instead of copying the whole matrix. Blocks
+    are merged like the inverted index's segments (see compact()).
+    """
+
+    def __init__(self, embeddings: np.ndarray, chunks: list, embedder):
+        self.embedder = embedder
+        self._set_blocks([VectorBlock(embeddings, chunks)], set())
+
+    def _set_blocks(self, blocks: list, removed: set):
+        self.blocks = [block for block in blocks if len(block)]
+        self.bases = []
+        total = 0
+        for block in self.blocks:
+            self.bases.append(total)
+            total += len(block)
+        self.total = total
+        self.removed = removed
+        self._removed_rows = np.fromiter(sorted(removed), dtype=np.int64, count=len(removed))
+
+    @classmethod
+    def from_blocks(cls, blocks: list, embedder, removed: set = None) -> "VectorIndex":
+        index = cls.__new__(cls)
+        index.embedder = embedder
+        index._set_blocks(blocks, removed or set())
+        return index
+
+    def __len__(self):
+        return self.total - len(self.removed)
+
+    @property
+    def chunks(self) -> list:
+        return [chunk for row, chunk in self._live_rows()]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The live rows as one matrix (a copy unless nothing was ever updated)"""
+        if len(self.blocks) == 1 and not self.removed:
+            return self.blocks[0].embeddings
+        return self._merge(self.blocks, self.bases)[0]
+
+    def _live_rows(self):
+        for base, block in zip(self.bases, self.blocks):
+            for row, chunk in enumerate(block.chunks):
+                if base + row not in self.removed:
+                    yield base + row, chunk
+
+    def _merge(self, blocks: list, bases: list):
+        matrices = []
+        chunks = []
+        for base, block in zip(bases, blocks):
+            keep = [row for row in range(len(block)) if base + row not in self.removed]
+            matrices.append(block.embeddings[keep] if len(keep) < len(block) else block.embeddings)
+            chunks.extend(block.chunks[row] for row in keep)
+        dim = self.blocks[0].embeddings.shape[1] if self.blocks else 1
+        return (np.vstack(matrices) if matrices else np.zeros((0, dim), dtype=np.float32)), chunks
+
+    def _chunk(self, row: int):
+        n = bisect.bisect_right(self.bases, row) - 1
+        return self.blocks[n].chunks[row - self.bases[n]]
+
+    def _scores(self, q: np.ndarray) -> np.ndarray:
+        scores = np.hstack([q @ block.embeddings.T for block in self.blocks])
+        if len(self._removed_rows):
+            scores[:, self._removed_rows] = -np.inf
+        return scores
+
+    def search(self, query: str, top_k: int = 10) -> list:
+        """Return up to top_k (chunk, score) pairs by cosine similarity"""
+        return self.search_many([query], top_k)[0]
+
+    def search_many(self, queries: list, top_k: int = 10, batch_size: int = 64) -> list:
+        """search() for many queries: one embedding call and one matmul per block per batch of queries.
+
+        Batches bound the (queries x chunks) score matrix.
+        """
+        if not len(self):
+            return [[] for _ in queries]
+        results = []
+        # Removed rows score -inf, so they never make a top k of live rows
+        k = min(top_k, len(self))
+        for i in range(0, len(queries), batch_size):
+            scores = self._scores(self.embedder.embed(queries[i:i + batch_size]))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row, candidates in enumerate(top):
+                candidates = candidates[np.argsort(-scores[row, candidates])]
+                results.append([(self._chunk(j), float(scores[row, j])) for j in candidates])
+        return results
+
+    def updated(self, changes: dict) -> "VectorIndex":
+        """Return a new index with changed/deleted files' chunks replaced.
+
+        changes maps (section, fname) to the file's new text, or None if it
+        was deleted. Only the changed files are re-chunked and embedded.
+        """
+        removed = set(self.removed)
+        for base, block in zip(self.bases, self.blocks):
+            files = block.files()
+            for key in changes:
+                removed.update(base + row for row in files.get(key, ()))
+        new_chunks = [
+            (section, fname, start, end)
+            for (section, fname), text in changes.items() if text is not None
+            for start, end in split_passages(text)
+        ]
+        blocks = list(self.blocks)
+        if new_chunks:
+            texts = [changes[chunk[:2]][chunk[2]:chunk[3]] for chunk in new_chunks]
+            blocks.append(VectorBlock(self.embedder.embed(texts), new_chunks))
+        index = VectorIndex.from_blocks(blocks, self.embedder, removed)
+        index.compact()
+        return index
+
+    def compact(self, max_blocks: int = MAX_SEGMENTS, removed_ratio: float = COMPACT_DELETED_RATIO) -> bool:
+        """Merge blocks by the same policy as InvertedIndex.compact"""
+        if self.removed and len(self.removed) > removed_ratio * self.total:
+            first = 0
+        elif len(self.blocks) > max_blocks:
+            first = 1
+        else:
+            return False
+        embeddings, chunks = self._merge(self.blocks[first:], self.bases[first:])
+        merged_base = self.bases[first]
+        self._set_blocks(self.blocks[:first] + [VectorBlock(embeddings, chunks)],
+                         {row for row in self.removed if row < merged_base})
+        return True
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.npy"), self.embeddings)
+        with open(os.path.join(path, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "chunks": self.chunks}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # mmap keeps the matrix in the page cache, shared across workers
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        chunks = [tuple(chunk) for chunk in meta["chunks"]]
+        return cls(embeddings, chunks, get_embedder(meta["embedder"]))
+
+
+def build_vector_index(knowledge_base: dict, embedder=None, batch_size: int = 256) -> VectorIndex:
+    """Chunk and embed every document of the knowledge base"""
+    embedder = embedder or HashingEmbedder()
+    chunks = []
+    for section in ["course_content", "discourse_posts"]:
+        for fname, content in knowledge_base.get(section, {}).items():
+            for start, end in split_passages(content):
+                chunks.append((section, fname, start, end))
+
+    batches = []
+    for i in range(0, len(chunks), batch_size):
+        texts = [
+            knowledge_base[section][fname][start:end]
+            for section, fname, start, end in chunks[i:i + batch_size]
+        ]
+        batches.append(embedder.embed(texts))
+    embeddings = np.vstack(batches) if batches else np.zeros((0, 1), dtype=np.float32)
+    return VectorIndex(embeddings, chunks, embedder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the semantic retrieval index')
+    parser.add_argument('--output', '-o', default='data/vector_index',
+                       help='Directory to write the index to')
+    parser.add_argument('--embedder', '-e', default='hashing',
+                       help='"hashing" or a local sentence-transformers model name')
+    args = parser.parse_args()
+
+    kb = load_documents()
+    index = build_vector_index(kb, get_embedder(args.embedder))
+    index.save(args.output)
+    print(f"Saved {len(index)} chunks to {args.output}")
+
+
+if __name__ == "__main__":
+    main()